@@ -7,13 +7,14 @@
 const VettingGate = (() => {
     // --- ESTADO PRIVADO ---
     const CONFIG = {
-        apiEndpoint: 'http://localhost:8002/chat', // Cambiaremos esto en producción
+        streamEndpoint: 'http://localhost:8002/chat/stream', // NDJSON: meta → tokens → done (Cambiaremos esto en producción)
         typingSpeed: 30, // ms por caracter
+        busyRetries: 2, // reintentos automáticos si el servidor está saturado (429/503)
     };
 
     let state = {
         isOpen: false,
-        history: [], // Historial de conversación para el modelo
+        sessionId: null, // Sesión del servidor: historial y expediente viven en el backend
         isTyping: false,
         ipScore: 0.0 // Score de prioridad inicial
     };
@@ -89,9 +90,11 @@ const VettingGate = (() => {
         gsap.to(msgDiv, { opacity: 1, y: -5, duration: 0.3 });
         scrollToBottom();
 
-        if (role === 'model') {
-            typeWriterEffect(msgDiv.querySelector('div'), text);
+        const bubble = msgDiv.querySelector('div');
+        if (role === 'model' && text) {
+            typeWriterEffect(bubble, text);
         }
+        return bubble;
     };
 
     // 3. Efecto de Escritura (Realismo)
@@ -116,6 +119,102 @@ const VettingGate = (() => {
         dom.log.scrollTop = dom.log.scrollHeight;
     };
 
+    // 3b. Burbuja en vivo para respuestas en streaming (sin typeWriter simulado)
+    const createStreamingBubble = () => {
+        const element = appendMessage('model', '');
+        return {
+            append: (chunk) => {
+                element.textContent += chunk;
+                scrollToBottom();
+            },
+            // Turno reemplazado: la respuesta llega en el turno que lo fusionó
+            remove: () => element.parentElement.remove()
+        };
+    };
+
+    // Lee el cuerpo NDJSON y despacha cada evento conforme llega
+    const readEventStream = async (response, onEvent) => {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let newline;
+            while ((newline = buffer.indexOf('\n')) >= 0) {
+                const line = buffer.slice(0, newline).trim();
+                buffer = buffer.slice(newline + 1);
+                if (line) onEvent(JSON.parse(line));
+            }
+        }
+        if (buffer.trim()) onEvent(JSON.parse(buffer));
+    };
+
+    // --- AUDITOR SILENCIOSO ---
+    // Si el backend detecta un lead de alto valor, desbloquea Calendly
+    const handleAudit = (audit) => {
+        if (audit && audit.action === 'UNLOCK_CALENDLY') {
+            unlockCalendly(audit.score);
+        }
+    };
+
+    // Aviso del servidor tal cual (sin typeWriter: no libera el envío a mitad de un reintento)
+    const appendNotice = (text) => {
+        const bubble = appendMessage('model', '');
+        bubble.textContent = text;
+    };
+
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+    // Un intento de turno. Devuelve null si hubo respuesta (o si un mensaje más
+    // nuevo lo reemplazó), o el aviso de saturación ({ detail, retryAfter }) si el
+    // servidor pidió esperar: 429/503 antes del stream o evento `error` dentro
+    const streamTurn = async (text, loadingId) => {
+        const response = await fetch(CONFIG.streamEndpoint, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ 
+                message: text, 
+                session_id: state.sessionId 
+            })
+        });
+
+        if (response.status === 429 || response.status === 503) {
+            const body = await response.json().catch(() => ({}));
+            return { detail: body.detail, retryAfter: Number(body.retry_after) || 1 };
+        }
+        // 409: otro mensaje de esta sesión reemplazó a éste antes de abrir el stream
+        if (response.status === 409) return null;
+        if (!response.ok || !response.body) throw new Error('Error en el servidor de IA');
+
+        let bubble = null;
+        let busy = null;
+        await readEventStream(response, (event) => {
+            if (busy) return;
+            if (event.type === 'superseded') {
+                if (bubble) bubble.remove();
+                bubble = null;
+            } else if (event.type === 'error') {
+                if (bubble) bubble.remove();
+                busy = { detail: event.detail, retryAfter: Number(event.retry_after) || 1 };
+            } else if (event.type === 'meta') {
+                state.sessionId = event.session_id || state.sessionId;
+                handleAudit(event.silent_audit);
+            } else if (event.type === 'token') {
+                if (!bubble) {
+                    // Primer token: se retira el loader y se abre la burbuja
+                    removeLoading(loadingId);
+                    bubble = createStreamingBubble();
+                }
+                bubble.append(event.content);
+            }
+        });
+        return busy;
+    };
+
     // 4. Lógica de Envío (CORE)
     const handleSend = async () => {
         const text = dom.input.value.trim();
@@ -124,41 +223,32 @@ const VettingGate = (() => {
         // Limpiar input y mostrar mensaje usuario
         dom.input.value = '';
         appendMessage('user', text);
-        state.history.push({ role: "user", parts: [text] });
 
         // Indicador de "Pensando..."
-        const loadingId = showLoading();
+        let loadingId = showLoading();
+        state.isTyping = true;
 
         try {
-            // --- CONEXIÓN AL BACKEND ---
-            const response = await fetch(CONFIG.apiEndpoint, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ 
-                    message: text, 
-                    history: state.history 
-                })
-            });
-
-            if (!response.ok) throw new Error('Error en el servidor de IA');
-
-            const data = await response.json();
-            
-            // Remover loading
-            removeLoading(loadingId);
-
-            // Mostrar respuesta IA
-            appendMessage('model', data.response);
-            state.history.push({ role: "model", parts: [data.response] });
+            // --- CONEXIÓN AL BACKEND (STREAMING) ---
+            for (let attempt = 0; ; attempt++) {
+                const busy = await streamTurn(text, loadingId);
+                removeLoading(loadingId);
+                if (!busy) break;
 
-            // --- AUDITOR SILENCIOSO ---
-            // Si el backend detecta un lead de alto valor, desbloquea Calendly
-            if (data.silent_audit && data.silent_audit.action === 'UNLOCK_CALENDLY') {
-                unlockCalendly(data.silent_audit.score);
+                // Servicio saturado: se muestra el aviso del servidor una vez y se
+                // reintenta solo tras Retry-After
+                if (attempt === 0) {
+                    appendNotice(busy.detail || 'Estamos atendiendo un volumen alto de diagnósticos. Reintentando en unos segundos…');
+                }
+                if (attempt >= CONFIG.busyRetries) break;
+                loadingId = showLoading();
+                await sleep(busy.retryAfter * 1000);
             }
+            state.isTyping = false;
 
         } catch (error) {
             removeLoading(loadingId);
+            state.isTyping = false;
             console.error('Falla en Vetting Gate:', error);
             // Fallback elegante (No mostrar error técnico)
             appendMessage('model', "Conexión inestable con el servidor seguro. Para garantizar la integridad del diagnóstico, por favor proceda directamente a nuestro canal prioritario: board@evangelista.co");
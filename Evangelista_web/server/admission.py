@@ -0,0 +1,427 @@
+"""
+admission.py — Evangelista & Co.
+Control de admisión delante del pipeline de agentes.
+
+Sin límite de concurrencia, un pico de tráfico se convertía en una ráfaga de
+llamadas simultáneas a Groq, una ola de 429 y todos los usuarios terminaban en la
+"Interrupción técnica". Este módulo pone tres compuertas:
+
+  - Petición (FairGate "request"): máximo de turnos en vuelo, cola de espera
+    acotada y turnos rotativos por sesión, para que un cliente insistente no
+    acapare la cola. Una sesión con demasiados turnos pendientes recibe 429.
+  - LLM (ThrottledProvider): semáforo global y uno por agente, con la misma
+    cola justa por sesión. Va por DENTRO de ResilientProvider: cada intento y
+    cada hedge pasa por la compuerta y se cobra de la cuota.
+  - Cuota del proveedor: cubetas de tokens por modelo para RPM y TPM. Si Groq
+    devuelve 429, el modelo se pausa de inmediato lo que indique Retry-After
+    (aunque no haya RPM/TPM configurados) y los intentos siguientes esperan o se
+    rechazan.
+
+Si la espera estimada no cabe en el tope (`max_wait`), se rechaza de inmediato
+con AdmissionRejected (429 por sesión o cuota, 503 por saturación) en lugar de
+esperar a que expire el deadline. main.py lo traduce a la respuesta HTTP con
+cabecera Retry-After.
+
+Métricas: evangelista_admission_queue_depth{scope}, _inflight{scope},
+_wait_seconds{scope} y _rejected_total{scope, reason}.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from llm import AGENTS, LLMProvider, LLMResult
+from metrics import REGISTRY, current_trace
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    "evangelista_admission_queue_depth", "Solicitudes esperando turno.", ("scope",))
+INFLIGHT = REGISTRY.gauge(
+    "evangelista_admission_inflight", "Solicitudes en vuelo.", ("scope",))
+WAIT_SECONDS = REGISTRY.histogram(
+    "evangelista_admission_wait_seconds", "Espera antes de ser admitido.", ("scope",))
+REJECTED = REGISTRY.counter(
+    "evangelista_admission_rejected_total", "Solicitudes rechazadas por el control de admisión.",
+    ("scope", "reason"))
+
+# Sesión de la petición en curso: las compuertas del LLM la usan como clave de turno
+_session: ContextVar[str] = ContextVar("admission_session", default="")
+
+# Tokens de salida que se reservan por agente antes de conocer el uso real
+COMPLETION_ALLOWANCE = {"scribe": 250, "strategist": 150, "voice": 300, "fused": 400}
+
+
+class AdmissionRejected(Exception):
+    """La petición no cabe: `status` 429 (sesión o cuota) o 503 (saturación)."""
+
+    def __init__(self, scope: str, reason: str, status: int, retry_after: float):
+        super().__init__(f"{scope}: {reason}")
+        self.scope       = scope
+        self.reason      = reason
+        self.status      = status
+        self.retry_after = retry_after
+        REJECTED.inc(scope, reason)
+
+    @property
+    def headers(self) -> dict:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+# ==============================================================================
+# COMPUERTA CON COLA JUSTA
+# ==============================================================================
+
+class Ticket:
+    """Cupo concedido por FairGate; `release` es idempotente."""
+
+    def __init__(self, gate: "FairGate", key: str, waited: float):
+        self.gate     = gate
+        self.key      = key
+        self.waited   = waited
+        self.started  = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.gate._release(self.key, time.monotonic() - self.started)
+
+
+class FairGate:
+    """
+    Semáforo con cola acotada. Los que esperan se agrupan por clave (sesión) y el
+    cupo liberado pasa al primero de la siguiente clave en turno rotativo.
+    """
+
+    def __init__(self, scope: str, limit: int, max_queue: int = 256,
+                 max_wait: float = 8.0, per_key: int = 0):
+        self.scope     = scope
+        self.limit     = limit
+        self.max_queue = max_queue
+        self.max_wait  = max_wait
+        self.per_key   = per_key            # 0 = sin tope por sesión
+        self.inflight  = 0
+        self.queued    = 0
+        self._waiting: "OrderedDict[str, deque]" = OrderedDict()
+        self._held: Dict[str, int] = {}     # por clave: en vuelo + en cola
+        self._service  = 0.0                # duración media del cupo (EWMA, s)
+
+    def estimated_wait(self) -> float:
+        """Espera esperada para el siguiente en la cola."""
+        return (self.queued + 1) / self.limit * self._service
+
+    async def enter(self, key: str = "") -> Ticket:
+        if self.per_key and self._held.get(key, 0) >= self.per_key:
+            raise AdmissionRejected(self.scope, "session_busy", 429, self._service or 1.0)
+        if self.inflight < self.limit and not self.queued:
+            self.inflight += 1
+            self._hold(key)
+            return Ticket(self, key, 0.0)
+        if self.queued >= self.max_queue:
+            raise AdmissionRejected(self.scope, "queue_full", 503, self.estimated_wait() or 1.0)
+        estimate = self.estimated_wait()
+        if estimate > self.max_wait:
+            raise AdmissionRejected(self.scope, "deadline", 503, estimate)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(key, deque()).append(future)
+        self.queued += 1
+        self._hold(key)
+        started = time.monotonic()
+        try:
+            await asyncio.wait({future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(key, 0.0)        # el cupo ya era nuestro: se devuelve
+            else:
+                self._abandon(key, future)
+            raise
+        if not future.done():
+            self._abandon(key, future)
+            raise AdmissionRejected(self.scope, "timeout", 503, self.estimated_wait() or 1.0)
+        waited = time.monotonic() - started
+        WAIT_SECONDS.observe(self.scope, value=waited)
+        return Ticket(self, key, waited)
+
+    def _hold(self, key: str) -> None:
+        self._held[key] = self._held.get(key, 0) + 1
+        self._publish()
+
+    def _drop(self, key: str) -> None:
+        left = self._held.get(key, 1) - 1
+        if left > 0:
+            self._held[key] = left
+        else:
+            self._held.pop(key, None)
+
+    def _abandon(self, key: str, future: asyncio.Future) -> None:
+        future.cancel()
+        queue = self._waiting.get(key)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.queued -= 1
+            if not queue:
+                del self._waiting[key]
+        self._drop(key)
+        self._publish()
+
+    def _release(self, key: str, elapsed: float) -> None:
+        self._drop(key)
+        if elapsed:
+            self._service = elapsed if not self._service else 0.8 * self._service + 0.2 * elapsed
+        while self._waiting:
+            next_key, queue = next(iter(self._waiting.items()))
+            future = queue.popleft()
+            del self._waiting[next_key]
+            if queue:
+                self._waiting[next_key] = queue    # vuelve al final: turno rotativo
+            self.queued -= 1
+            if not future.done():
+                future.set_result(True)            # el cupo pasa directo, inflight no cambia
+                self._publish()
+                return
+        self.inflight -= 1
+        self._publish()
+
+    def _publish(self) -> None:
+        QUEUE_DEPTH.set(self.scope, value=self.queued)
+        INFLIGHT.set(self.scope, value=self.inflight)
+
+    def stats(self) -> dict:
+        return {
+            "inflight":    self.inflight,
+            "limit":       self.limit,
+            "queued":      self.queued,
+            "sessions":    len(self._waiting),
+            "service_ms":  round(self._service * 1000, 1),
+        }
+
+
+class AdmissionController(FairGate):
+    """Compuerta de peticiones: además fija la sesión para las compuertas del LLM."""
+
+    async def enter(self, key: str = "") -> Ticket:
+        ticket = await super().enter(key)
+        _session.set(key)
+        trace = current_trace()
+        if trace and ticket.waited:
+            trace.add_stage("admission", ticket.waited)
+        return ticket
+
+
+# ==============================================================================
+# CUOTA DEL PROVEEDOR (RPM / TPM)
+# ==============================================================================
+
+class TokenBucket:
+    """Cubeta por minuto con reserva: el saldo puede quedar negativo y los
+    siguientes esperan proporcionalmente."""
+
+    def __init__(self, per_minute: float):
+        self.rate     = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level    = self.capacity
+        self.updated  = time.monotonic()
+
+    def delay(self, amount: float, now: float) -> float:
+        self.level   = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        if amount > self.level:
+            return (amount - self.level) / self.rate
+        return 0.0
+
+    def take(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level - amount)
+
+
+class RateLimit:
+    """Cubetas RPM y TPM de un modelo (un límite en 0 queda desactivado) y la
+    pausa por Retry-After del proveedor."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens   = TokenBucket(tpm) if tpm else None
+        self.paused_until = 0.0
+
+    def reserve(self, agent: str, tokens: int, max_wait: float) -> float:
+        """Reserva 1 petición + `tokens`; devuelve cuánto esperar o rechaza."""
+        now = time.monotonic()
+        wait, reason = max(0.0, self.paused_until - now), "retry_after"
+        if self.requests:
+            request_wait = self.requests.delay(1, now)
+            if request_wait > wait:
+                wait, reason = request_wait, "rpm"
+        if self.tokens:
+            token_wait = self.tokens.delay(tokens, now)
+            if token_wait > wait:
+                wait, reason = token_wait, "tpm"
+        if wait > max_wait:
+            raise AdmissionRejected(agent, reason, 429, wait)
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+        return wait
+
+    def settle(self, delta: int) -> None:
+        """Ajusta la reserva con el uso real (delta > 0: se gastó más)."""
+        if self.tokens and delta:
+            self.tokens.take(delta)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Segundos de Retry-After de un 429 del proveedor (None si no es 429)."""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 1.0))
+    except (AttributeError, TypeError, ValueError):
+        return 1.0
+
+
+# ==============================================================================
+# PROVEEDOR CON ADMISIÓN
+# ==============================================================================
+
+class ThrottledProvider(LLMProvider):
+    """Semáforo por agente + global y cuota por modelo antes de cada llamada."""
+
+    def __init__(
+        self,
+        inner: LLMProvider,
+        agent_limits: Optional[Dict[str, int]] = None,
+        global_limit: int = 48,
+        rpm: int = 0,
+        tpm: int = 0,
+        max_queue: int = 256,
+        max_wait: float = 4.0,
+    ):
+        self.inner    = inner
+        self.configs  = inner.configs
+        self.name     = inner.name
+        self.max_wait = max_wait
+        self.rpm, self.tpm = rpm, tpm
+        limits = agent_limits or {}
+        self.gates = {
+            agent: FairGate(agent, limits.get(agent, 32), max_queue, max_wait) for agent in AGENTS
+        }
+        self.global_gate = FairGate("llm", global_limit, max_queue, max_wait)
+        self.limits: Dict[str, RateLimit] = {}
+
+    def _limit(self, model: str) -> RateLimit:
+        if model not in self.limits:
+            self.limits[model] = RateLimit(self.rpm, self.tpm)
+        return self.limits[model]
+
+    async def _admit(self, agent: str, messages: list, model: str) -> Tuple[Ticket, Ticket, int]:
+        key    = _session.get()
+        agent_ticket = await self.gates[agent].enter(key)
+        try:
+            llm_ticket = await self.global_gate.enter(key)
+        except BaseException:
+            agent_ticket.release()
+            raise
+        waited = agent_ticket.waited + llm_ticket.waited
+        tokens = 0
+        if self.tpm:
+            # Estimación barata (4 caracteres/token): `settle` la corrige con el uso real
+            tokens = sum(len(m.get("content", "")) for m in messages) // 4
+            tokens += COMPLETION_ALLOWANCE.get(agent, 200)
+        try:
+            delay = self._limit(model).reserve(agent, tokens, max(self.max_wait - waited, 0.0))
+            if delay:
+                WAIT_SECONDS.observe("rate", value=delay)
+                await asyncio.sleep(delay)
+                waited += delay
+        except BaseException:
+            llm_ticket.release()
+            agent_ticket.release()
+            raise
+        trace = current_trace()
+        if trace and waited:
+            trace.add_stage("llm_queue", waited)
+        return agent_ticket, llm_ticket, tokens
+
+    def _failed(self, model: str, error: BaseException) -> None:
+        """Un 429 del proveedor pausa el modelo ya, antes de que se reintente."""
+        pause = retry_after(error)
+        if pause is not None:
+            self._limit(model).pause(pause)
+
+    async def complete(self, agent: str, messages: list, model: Optional[str] = None) -> LLMResult:
+        quota = model or self.configs[agent].model      # `model` sigue tal cual hacia abajo
+        agent_ticket, llm_ticket, reserved = await self._admit(agent, messages, quota)
+        try:
+            result = await self.inner.complete(agent, messages, model=model)
+        except Exception as e:
+            self._failed(quota, e)
+            raise
+        finally:
+            llm_ticket.release()
+            agent_ticket.release()
+        used = result.prompt_tokens + result.completion_tokens
+        if used and self.tpm:
+            self._limit(quota).settle(used - reserved)
+        return result
+
+    async def stream(self, agent: str, messages: list, model: Optional[str] = None) -> AsyncIterator[str]:
+        quota = model or self.configs[agent].model
+        agent_ticket, llm_ticket, reserved = await self._admit(agent, messages, quota)
+        emitted = 0
+        try:
+            async for token in self.inner.stream(agent, messages, model=model):
+                emitted += len(token)
+                yield token
+        except Exception as e:
+            self._failed(quota, e)
+            raise
+        finally:
+            llm_ticket.release()
+            agent_ticket.release()
+        if self.tpm:
+            self._limit(quota).settle(emitted // 4 - COMPLETION_ALLOWANCE.get(agent, 200))
+
+    def stats(self) -> dict:
+        return {
+            "llm":    self.global_gate.stats(),
+            "agents": {agent: gate.stats() for agent, gate in self.gates.items()},
+        }
+
+
+# ==============================================================================
+# CONSTRUCCIÓN DESDE ENTORNO
+# ==============================================================================
+
+def build_admission() -> AdmissionController:
+    """ADMISSION_MAX_INFLIGHT / _QUEUE / _MAX_WAIT_S / _PER_SESSION."""
+    return AdmissionController(
+        "request",
+        limit=int(os.getenv("ADMISSION_MAX_INFLIGHT", "32")),
+        max_queue=int(os.getenv("ADMISSION_QUEUE", "256")),
+        max_wait=float(os.getenv("ADMISSION_MAX_WAIT_S", "8")),
+        per_key=int(os.getenv("ADMISSION_PER_SESSION", "2")),
+    )
+
+
+def build_throttled(inner: LLMProvider) -> LLMProvider:
+    """LLM_ADMISSION=1 (por defecto) envuelve al proveedor; 0 lo deja tal cual."""
+    if os.getenv("LLM_ADMISSION", "1") != "1":
+        return inner
+    return ThrottledProvider(
+        inner,
+        agent_limits={
+            agent: int(os.getenv(f"{agent.upper()}_MAX_CONCURRENCY", "32")) for agent in AGENTS
+        },
+        global_limit=int(os.getenv("LLM_MAX_CONCURRENCY", "48")),
+        rpm=int(os.getenv("LLM_RPM", "0")),
+        tpm=int(os.getenv("LLM_TPM", "0")),
+        max_queue=int(os.getenv("LLM_QUEUE", "256")),
+        max_wait=float(os.getenv("LLM_QUEUE_MAX_WAIT_S", "4")),
+    )
@@ -0,0 +1,404 @@
+"""
+bench_chat.py — Evangelista & Co.
+Prueba de carga y benchmark de latencia del pipeline /chat, sin red.
+
+Simula prospectos concurrentes que reproducen guiones multi-turno (los casos de
+los few-shot de PROMPT_SCRIBE) contra la app FastAPI en proceso, con el LLM
+sustituido por FakeProvider y Google Sheets por una hoja simulada con latencia.
+
+Reporta p50/p95/p99, throughput, lag del event loop y tiempos por etapa, y puede
+escribir/comparar un baseline JSON para detectar regresiones:
+
+    python bench_chat.py --prospects 200 --concurrency 50 --write-baseline bench_baseline.json
+    python bench_chat.py --compare bench_baseline.json
+    python bench_chat.py --pipeline fused --compare bench_baseline.json
+
+Cada reporte es la mediana, métrica por métrica, de `--runs` corridas (3 por
+defecto). Aun así, en una máquina compartida la mediana varía hasta ~50 % en los
+p95 por etapa y ~30 ms en el lag del loop, así que `--compare` sólo mira p95 (el
+p99 de ~200 muestras es prácticamente el máximo) con tolerancia de 50 % y 50 ms:
+atrapa regresiones gruesas (un bloqueo del loop, etapas que se serializan). Para
+medir un ajuste fino, A/B en la misma máquina y en la misma sesión.
+
+bench_baseline.json (el que se versiona) se regenera con la configuración por
+defecto cada vez que un cambio mueve las latencias a propósito, en el mismo
+commit, para que `--compare` pase en HEAD. Con más corridas que la comparación,
+para que el baseline quede en el centro del ruido:
+
+    python bench_chat.py --runs 5 --write-baseline bench_baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("SHEETS_OUTBOX", "memory")
+os.environ.setdefault("TACTIC_LOG_PATH", ":memory:")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from llm import FakeProvider, LatencyModel  # noqa: E402
+from admission import build_throttled  # noqa: E402
+from leads import LeadIndex  # noqa: E402
+from resilience import ResilientProvider  # noqa: E402
+
+# ==============================================================================
+# GUIONES DE PROSPECTOS
+# Cada turno: mensaje del usuario, salida esperada del Perfilador y táctica.
+# ==============================================================================
+
+BENCH_SCRIPTS = [
+    {
+        "name": "textilera_sap",
+        "turns": [
+            {
+                "message": "Soy el dueño de una textilera en Puebla. Llevo 3 meses notando que "
+                           "mi inventario físico no cuadra con lo que dice SAP.",
+                "scribe": {
+                    "dolor_declarado": "Descuadre inventario físico vs SAP.",
+                    "driver_estrategico": "RESCATE_FORENSE",
+                    "autoridad_detectada": "C_LEVEL",
+                    "stack_tecnologico": "NUBE_DESCONECTADA",
+                    "nodo_critico": "ALMACEN_INVENTARIO",
+                    "red_flags": False,
+                },
+                "tactic": "INVESTIGATE_DEEP",
+            },
+            {
+                "message": "La empresa se llama Hilados del Valle.",
+                "scribe": {"empresa": "Hilados del Valle"},
+                "tactic": "ANCHOR_FOUNDATION_FEE",
+            },
+            {
+                "message": "Es caro, no tenemos ese presupuesto.",
+                "scribe": {"presupuesto_validado": False},
+                "tactic": "VALUE_WITHDRAWAL",
+            },
+        ],
+    },
+    {
+        "name": "transportes_veloz_red_flag",
+        "turns": [
+            {
+                "message": "Hola, soy auxiliar de rrhh en transportes veloz. Mi jefe me pidió "
+                           "cotizar una app móvil para que choferes registren asistencia.",
+                "scribe": {
+                    "empresa": "Transportes Veloz",
+                    "dolor_declarado": "Control de asistencia de choferes mediante app móvil.",
+                    "autoridad_detectada": "OPERATIVO",
+                    "red_flags": True,
+                    "motivo_red_flag": "Solicita desarrollo de App Móvil a la medida.",
+                },
+                "tactic": "REJECT_AND_REDIRECT",
+            },
+        ],
+    },
+    {
+        "name": "constructora_zenith",
+        "turns": [
+            {
+                "message": "Soy Ana, Directora de Finanzas de Constructora Zenith. Usamos 20 "
+                           "Excels y cerramos mes en 3 semanas.",
+                "scribe": {
+                    "empresa": "Constructora Zenith",
+                    "dolor_declarado": "Cierre de mes en 3 semanas con Excel.",
+                    "driver_estrategico": "ESCALABILIDAD_INSTITUCIONAL",
+                    "autoridad_detectada": "C_LEVEL",
+                    "stack_tecnologico": "EXCEL",
+                    "nodo_critico": "FINANZAS_GOBERNANZA",
+                    "red_flags": False,
+                },
+                "tactic": "ANCHOR_FOUNDATION_FEE",
+            },
+            {
+                "message": "Sí, sin problema. Me urge la junta porque el Consejo exige reportes "
+                           "automatizados para Q3. Mi correo es ana@zenith.mx",
+                "scribe": {"presupuesto_validado": True},
+                "tactic": "ALLOW_MEETING",
+            },
+        ],
+    },
+]
+
+_TURNS = {t["message"]: t for script in BENCH_SCRIPTS for t in script["turns"]}
+_LAST_MESSAGE_RE = re.compile(r'ÚLTIMO MENSAJE DEL USUARIO:\n"(.*)"', re.DOTALL)
+
+
+def _scribe_response(messages: list) -> dict:
+    msg = messages[-1]["content"].split(": ", 1)[-1]
+    return _TURNS.get(msg, {}).get("scribe", {})
+
+
+def _strategist_response(messages: list) -> dict:
+    match  = _LAST_MESSAGE_RE.search(messages[0]["content"])
+    tactic = _TURNS.get(match.group(1) if match else "", {}).get("tactic", "INVESTIGATE_DEEP")
+    return {"analisis_estrategico": "BENCH", "tactic": tactic,
+            "instructions_for_voice": f"Ejecuta {tactic}."}
+
+
+def _fused_response(messages: list) -> dict:
+    turn = _TURNS.get(messages[-1]["content"].split(": ", 1)[-1], {})
+    tactic = turn.get("tactic", "INVESTIGATE_DEEP")
+    return {"dossier": turn.get("scribe", {}), "analisis_estrategico": "BENCH",
+            "tactic": tactic, "instructions_for_voice": f"Ejecuta {tactic}."}
+
+
+# ==============================================================================
+# DOBLES DE PRUEBA INSTRUMENTADOS
+# ==============================================================================
+
+class TimedProvider:
+    """Envuelve un proveedor y registra la duración de cada llamada por agente."""
+
+    def __init__(self, inner, stage_times: dict):
+        self.inner       = inner
+        self.stage_times = stage_times
+
+    async def complete(self, agent: str, messages: list):
+        started = time.perf_counter()
+        try:
+            return await self.inner.complete(agent, messages)
+        finally:
+            self.stage_times[agent].append(time.perf_counter() - started)
+
+    async def stream(self, agent: str, messages: list):
+        started = time.perf_counter()
+        async for token in self.inner.stream(agent, messages):
+            yield token
+        self.stage_times[agent].append(time.perf_counter() - started)
+
+
+class StubSheet:
+    """Hoja simulada: cada llamada bloquea el hilo que la hace durante `latency` s."""
+
+    def __init__(self, latency: float, stage_times: dict):
+        self.latency     = latency
+        self.stage_times = stage_times
+        self.rows        = 0
+        self.updates     = 0
+
+    def append_rows(self, rows: list, **_):
+        started = time.perf_counter()
+        time.sleep(self.latency)
+        first = self.rows + 1
+        self.rows += len(rows)
+        self.stage_times["sheets"].append(time.perf_counter() - started)
+        return {"updates": {"updatedRange": f"Stub!A{first}:I{self.rows}"}}
+
+    def batch_update(self, data: list, **_):
+        started = time.perf_counter()
+        time.sleep(self.latency)
+        self.updates += len(data)
+        self.stage_times["sheets"].append(time.perf_counter() - started)
+
+    def get_all_values(self, **_):
+        return []
+
+
+# ==============================================================================
+# MEDICIÓN
+# ==============================================================================
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index   = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(values: list) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(max(values, default=0) * 1000, 2),
+    }
+
+
+async def monitor_loop_lag(samples: list, stop: asyncio.Event, interval: float = 0.01) -> None:
+    """Mide cuánto se retrasa un sleep corto: proxy directo del bloqueo del loop."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+
+async def run_prospect(http: httpx.AsyncClient, script: dict, endpoint: str,
+                       latencies: list, errors: list) -> None:
+    session_id = None
+    for turn in script["turns"]:
+        started = time.perf_counter()
+        try:
+            resp = await http.post(endpoint, json={"message": turn["message"],
+                                                   "session_id": session_id})
+            resp.raise_for_status()
+            if endpoint == "/chat":
+                session_id = resp.json()["session_id"]
+            else:
+                session_id = json.loads(resp.text.splitlines()[0])["session_id"]
+        except Exception as e:
+            errors.append(f"{script['name']}: {e}")
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_benchmark(args) -> dict:
+    stage_times = defaultdict(list)
+    latencies   = {
+        "scribe":     LatencyModel(args.scribe_ms, args.sigma),
+        "strategist": LatencyModel(args.strategist_ms, args.sigma),
+        "voice":      LatencyModel(args.voice_ms, args.sigma),
+        "fused":      LatencyModel(args.fused_ms, args.sigma),
+    }
+    fake = FakeProvider(
+        latencies=latencies,
+        responses={"scribe": _scribe_response, "strategist": _strategist_response,
+                   "fused": _fused_response},
+        seed=args.seed,
+        error_rate=args.error_rate,
+    )
+    main.llm      = TimedProvider(ResilientProvider(build_throttled(fake), seed=args.seed), stage_times)
+    if args.pipeline:
+        main.PIPELINE_MODE = args.pipeline
+    main.sheets.use(StubSheet(args.sheets_ms / 1000, stage_times))
+    main.sheets_writer.start()
+
+    request_times, errors, lag = [], [], []
+    stop      = asyncio.Event()
+    lag_task  = asyncio.create_task(monitor_loop_lag(lag, stop))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=main.app)
+
+    async def prospect(i: int):
+        async with semaphore:
+            await run_prospect(http, BENCH_SCRIPTS[i % len(BENCH_SCRIPTS)],
+                               args.endpoint, request_times, errors)
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        await asyncio.gather(*(prospect(i) for i in range(args.prospects)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await lag_task
+    main.sheets_writer.stop()
+
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("write_baseline", "compare", "tolerance", "min_delta_ms", "runs")},
+        "requests": len(request_times),
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(request_times) / elapsed, 2) if elapsed else 0.0,
+        "latency": summarize(request_times),
+        "event_loop_lag": summarize(lag),
+        "stages": {stage: summarize(times) for stage, times in sorted(stage_times.items())},
+    }
+
+
+def median_report(reports: list) -> dict:
+    """Mediana de cada métrica numérica entre corridas; lo demás, de la primera."""
+    def merge(values: list):
+        first = values[0]
+        if isinstance(first, dict):
+            return {key: merge([v[key] for v in values if key in v]) for key in first}
+        if isinstance(first, (int, float)) and not isinstance(first, bool):
+            return round(statistics.median(values), 2)
+        return first
+    return {**merge(reports), "config": reports[0]["config"]}
+
+
+def reset_state() -> None:
+    """Entre corridas: que la siguiente no herede caché del Perfilador ni índice de leads."""
+    if main.scribe_cache:
+        main.scribe_cache.clear()
+    if main.sheets_writer.index is not None:
+        main.sheets_writer.index = LeadIndex()
+
+
+def compare(report: dict, baseline: dict, tolerance: float, min_delta_ms: float = 50.0) -> list:
+    """
+    Lista de regresiones: métricas p95 que empeoran más que `tolerance` (relativo)
+    y más que `min_delta_ms` (absoluto, evita falsos positivos en valores pequeños).
+    """
+    regressions = []
+    pairs = [("latency", report["latency"], baseline["latency"]),
+             ("event_loop_lag", report["event_loop_lag"], baseline["event_loop_lag"])]
+    pairs += [(f"stages.{s}", report["stages"][s], baseline["stages"][s])
+              for s in report["stages"] if s in baseline.get("stages", {})]
+    for name, current, base in pairs:
+        delta = current["p95_ms"] - base["p95_ms"]
+        if delta > base["p95_ms"] * tolerance and delta > min_delta_ms:
+            regressions.append(f"{name}.p95_ms: {base['p95_ms']} → {current['p95_ms']}")
+    if report["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(
+            f"throughput_rps: {baseline['throughput_rps']} → {report['throughput_rps']}"
+        )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline /chat")
+    parser.add_argument("--prospects", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=25)
+    parser.add_argument("--endpoint", default="/chat", choices=["/chat", "/chat/stream"])
+    parser.add_argument("--scribe-ms", type=float, default=50.0)
+    parser.add_argument("--strategist-ms", type=float, default=50.0)
+    parser.add_argument("--voice-ms", type=float, default=80.0)
+    parser.add_argument("--fused-ms", type=float, default=70.0,
+                        help="latencia de la llamada fusionada Perfilador+Estratega")
+    parser.add_argument("--pipeline", choices=["sequential", "speculative", "fused"],
+                        help="sobrescribe PIPELINE_MODE")
+    parser.add_argument("--sigma", type=float, default=0.25, help="dispersión log-normal")
+    parser.add_argument("--sheets-ms", type=float, default=200.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fracción de llamadas LLM que fallan (ejercita reintentos)")
+    parser.add_argument("--runs", type=int, default=3, help="corridas; se reporta la mediana")
+    parser.add_argument("--write-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--min-delta-ms", type=float, default=50.0)
+    return parser.parse_args(argv)
+
+
+def main_cli(argv=None) -> int:
+    args    = parse_args(argv)
+    reports = []
+    for _ in range(max(1, args.runs)):
+        reset_state()
+        reports.append(asyncio.run(run_benchmark(args)))
+    report = median_report(reports)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2, ensure_ascii=False)
+            fh.write("\n")
+        print(f"Baseline escrito en {args.write_baseline}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        if baseline.get("config") != report["config"]:
+            print("Aviso: el baseline se midió con otra configuración; la comparación es orientativa.")
+        regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("REGRESIONES DETECTADAS:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("Sin regresiones frente al baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
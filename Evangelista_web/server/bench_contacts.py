@@ -0,0 +1,145 @@
+"""
+bench_contacts.py — Evangelista & Co.
+Benchmark del cazador de contactos (contacts.py) frente a la versión anterior.
+
+Corre un corpus de mensajes realistas etiquetados (con y sin datos de contacto,
+formatos mexicanos) y reporta:
+  - µs por mensaje (p50 y media) del extractor nuevo y del legado,
+  - aciertos: contactos esperados encontrados / totales, y falsos positivos.
+
+    python bench_contacts.py
+    python bench_contacts.py --iterations 20000 --max-us 20
+"""
+
+import argparse
+import json
+import re
+import statistics
+import sys
+import time
+
+from contacts import detect_contact_info
+
+# ==============================================================================
+# CORPUS: (mensaje, correos esperados, teléfonos esperados en E.164)
+# ==============================================================================
+
+CORPUS = [
+    ("Hola, buenas tardes", [], []),
+    ("Somos una textilera de 300 empleados y el inventario no cuadra desde hace 3 meses", [], []),
+    ("Usamos SAP B1 y 20 Excels para el cierre; tardamos 3 semanas", [], []),
+    ("El presupuesto de $35,000 MXN no es problema", [], []),
+    ("Soy la Directora de Finanzas de Grupo Zenith", [], []),
+    ("Facturamos 120 millones al año, 2023 fue el peor", [], []),
+    ("mi correo es Ana.Lopez@GrupoZenith.com.mx", ["ana.lopez@grupozenith.com.mx"], []),
+    ("ana@zenith.mx", ["ana@zenith.mx"], []),
+    ("Mi cel 5512345678", [], ["+525512345678"]),
+    ("Llámeme al (55) 1234-5678 por favor", [], ["+525512345678"]),
+    ("tel: 55 1234 5678", [], ["+525512345678"]),
+    ("+52 55 1234 5678", [], ["+525512345678"]),
+    ("+52 1 33 1234 5678 es mi whatsapp", [], ["+523312345678"]),
+    ("+5218112345678", [], ["+528112345678"]),
+    ("Escríbame por aquí https://wa.me/5215512345678", [], ["+525512345678"]),
+    ("https://api.whatsapp.com/send?phone=528112345678", [], ["+528112345678"]),
+    ("Mi número es 81-1234-5678 y mi correo jorge@aceros.com",
+     ["jorge@aceros.com"], ["+528112345678"]),
+    ("Correo: compras@transportesveloz.com, Tel. (81) 8123 4567",
+     ["compras@transportesveloz.com"], ["+528181234567"]),
+    ("Les dejo dos: ventas@logistica.mx y direccion@logistica.mx",
+     ["ventas@logistica.mx", "direccion@logistica.mx"], []),
+    ("Oficina 33 3615 2020, celular 33 1111 2222",
+     [], ["+523336152020", "+523311112222"]),
+    ("Nuestro folio SAP es 4500012345", [], ["+524500012345"]),   # ambigüedad aceptada
+    ("Somos 45 personas en 3 plantas", [], []),
+]
+
+
+def legacy_detect(text: str) -> dict:
+    """Implementación anterior: dos re.search sin precompilar, sólo la primera coincidencia."""
+    found = {}
+    email_match = re.search(r'[\w\.-]+@[\w\.-]+\.\w+', text)
+    if email_match:
+        found["email_detectado"] = email_match.group(0)
+    phone_match = re.search(r'\b\d{10}\b|\b\d{3}[-.\s]\d{3}[-.\s]\d{4}\b', text)
+    if phone_match:
+        found["telefono_detectado"] = phone_match.group(0)
+    return found
+
+
+def legacy_values(text: str):
+    found  = legacy_detect(text)
+    emails = [found["email_detectado"].lower()] if "email_detectado" in found else []
+    phones = []
+    if "telefono_detectado" in found:
+        digits = re.sub(r"\D", "", found["telefono_detectado"])
+        phones = ["+52" + digits[-10:]]
+    return emails, phones
+
+
+def new_values(text: str):
+    info = detect_contact_info(text)
+    return info.get("emails", []), info.get("telefonos", [])
+
+
+def accuracy(extract) -> dict:
+    expected = hits = false_positives = 0
+    for message, emails, phones in CORPUS:
+        got_emails, got_phones = extract(message)
+        wanted = set(emails) | set(phones)
+        got    = set(got_emails) | set(got_phones)
+        expected        += len(wanted)
+        hits            += len(wanted & got)
+        false_positives += len(got - wanted)
+    return {
+        "expected":        expected,
+        "found":           hits,
+        "recall":          round(hits / expected, 3) if expected else 1.0,
+        "false_positives": false_positives,
+    }
+
+
+def timing(func, iterations: int) -> dict:
+    """µs por mensaje: cada muestra recorre el corpus completo."""
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        for message, _, _ in CORPUS:
+            func(message)
+        samples.append((time.perf_counter() - started) * 1e6 / len(CORPUS))
+    return {
+        "p50_us":  round(statistics.median(samples), 2),
+        "mean_us": round(statistics.fmean(samples), 2),
+        "max_us":  round(max(samples), 2),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del extractor de contactos")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--max-us", type=float, default=0.0,
+                        help="falla si el p50 del extractor nuevo supera este valor")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv=None) -> int:
+    args   = parse_args(argv)
+    report = {
+        "messages": len(CORPUS),
+        "contacts": {
+            "accuracy": accuracy(new_values),
+            "timing":   timing(detect_contact_info, args.iterations),
+        },
+        "legacy": {
+            "accuracy": accuracy(legacy_values),
+            "timing":   timing(legacy_detect, args.iterations),
+        },
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.max_us and report["contacts"]["timing"]["p50_us"] > args.max_us:
+        print(f"REGRESIÓN: p50 {report['contacts']['timing']['p50_us']} µs > {args.max_us} µs")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
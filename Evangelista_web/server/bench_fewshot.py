@@ -0,0 +1,276 @@
+"""
+bench_fewshot.py — Evangelista & Co.
+Benchmark de la selección dinámica de few-shots del Perfilador (fewshot.py).
+
+Compara cada política de FEWSHOT contra la línea base de siempre (todos los casos
+del banco en cada prompt) sobre un set de turnos etiquetados que NO están en el
+banco:
+
+  - Tokens estimados del prompt del Perfilador y del fusionado (p50 / media).
+  - Latencia de ensamblado: selección (en frío, sin memo) + render, en µs.
+  - Cobertura de etiquetas: para cada turno, la mejor coincidencia entre las
+    etiquetas esperadas y las de algún caso enviado (proxy offline de qué tan
+    pertinente es lo que ve el modelo; la línea base marca el techo).
+  - Con --live (requiere GROQ_API_KEY): latencia real de la llamada, tokens de
+    prompt según `usage` y exactitud de extracción campo por campo frente a las
+    etiquetas.
+
+    python bench_fewshot.py
+    python bench_fewshot.py --k 1 --k 2 --k 3
+    python bench_fewshot.py --live --repeat 3 --out fewshot_report.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("SHEETS_OUTBOX", "memory")
+os.environ.setdefault("TACTIC_LOG_PATH", "")
+os.environ.setdefault("KNOWLEDGE_INDEX_PATH", "")
+
+import main  # noqa: E402
+from dossier import BOOL_FIELDS, ENUM_FIELDS, LeadDossier  # noqa: E402
+from fewshot import ExampleBank  # noqa: E402
+from prompt_budget import estimate_tokens  # noqa: E402
+from prompts import SCRIBE_EXAMPLES  # noqa: E402
+
+# ==============================================================================
+# TURNOS ETIQUETADOS (fuera del banco)
+# `state`: expediente antes del mensaje; `expected`: campos que debe dejar el
+# Perfilador (sólo los que tienen una respuesta inequívoca según el catálogo).
+# ==============================================================================
+
+EVAL_CASES = [
+    {
+        "message": "Soy el director general de una cadena de restaurantes. El costo de insumos "
+                   "se disparó y sospecho que los proveedores nos facturan de más.",
+        "state": {},
+        "expected": {"driver_estrategico": "RESCATE_FORENSE", "autoridad_detectada": "C_LEVEL",
+                     "nodo_critico": "COMPRAS_COSTOS", "red_flags": False},
+    },
+    {
+        "message": "Soy analista de sistemas y mi jefe me pidió buscar quién nos haga una página "
+                   "web para la empresa.",
+        "state": {},
+        "expected": {"autoridad_detectada": "OPERATIVO", "red_flags": True},
+    },
+    {
+        "message": "Tenemos tres almacenes y el stock de Microsip nunca coincide con el conteo "
+                   "físico. Soy el gerente de logística.",
+        "state": {},
+        "expected": {"driver_estrategico": "RESCATE_FORENSE", "autoridad_detectada": "GERENCIA",
+                     "stack_tecnologico": "ERP_LEGACY", "nodo_critico": "ALMACEN_INVENTARIO",
+                     "red_flags": False},
+    },
+    {
+        "message": "De acuerdo, podemos costearlo. ¿Cuándo nos vemos?",
+        "state": {"empresa": "Grupo Altamira", "driver_estrategico": "ESCALABILIDAD_INSTITUCIONAL",
+                  "autoridad_detectada": "C_LEVEL", "stack_tecnologico": "EXCEL",
+                  "nodo_critico": "FINANZAS_GOBERNANZA"},
+        "expected": {"empresa": "Grupo Altamira", "autoridad_detectada": "C_LEVEL",
+                     "presupuesto_validado": True, "red_flags": False},
+    },
+    {
+        "message": "Uf, eso está muy por encima de lo que pensábamos gastar.",
+        "state": {"empresa": "Grupo Altamira", "driver_estrategico": "ESCALABILIDAD_INSTITUCIONAL",
+                  "autoridad_detectada": "C_LEVEL", "stack_tecnologico": "EXCEL",
+                  "nodo_critico": "FINANZAS_GOBERNANZA"},
+        "expected": {"empresa": "Grupo Altamira", "presupuesto_validado": False, "red_flags": False},
+    },
+    {
+        "message": "Soy la CFO. Vamos a levantar capital el próximo año y los estados financieros "
+                   "salen con un mes de retraso porque todo vive en hojas de cálculo.",
+        "state": {},
+        "expected": {"driver_estrategico": "ESCALABILIDAD_INSTITUCIONAL", "autoridad_detectada": "C_LEVEL",
+                     "stack_tecnologico": "EXCEL", "nodo_critico": "FINANZAS_GOBERNANZA",
+                     "red_flags": False},
+    },
+    {
+        "message": "Soy dueño de una flotilla de 80 tractocamiones y sospecho robo de combustible: "
+                   "lo que cargamos no cuadra con los kilómetros recorridos.",
+        "state": {},
+        "expected": {"driver_estrategico": "RESCATE_FORENSE", "autoridad_detectada": "C_LEVEL",
+                     "nodo_critico": "PRODUCCION_LOGISTICA", "red_flags": False},
+    },
+    {
+        "message": "¿Me pueden mandar gratis un ejemplo de su reporte de auditoría para ver si "
+                   "nos sirve?",
+        "state": {},
+        "expected": {"red_flags": True},
+    },
+    {
+        "message": "Como CEO de una aseguradora ya tenemos HubSpot y un data warehouse; buscamos "
+                   "simulaciones Monte Carlo de riesgo para el Consejo.",
+        "state": {},
+        "expected": {"driver_estrategico": "ACOMPAÑAMIENTO_DIRECTIVO", "autoridad_detectada": "C_LEVEL",
+                     "stack_tecnologico": "NUBE_DESCONECTADA", "red_flags": False},
+    },
+    {
+        "message": "Las comisiones de los vendedores salen mal cada mes en Salesforce y ya se nos "
+                   "fueron dos de los mejores. Soy gerente comercial.",
+        "state": {},
+        "expected": {"autoridad_detectada": "GERENCIA", "stack_tecnologico": "NUBE_DESCONECTADA",
+                     "nodo_critico": "VENTAS_INGRESOS", "red_flags": False},
+    },
+    {
+        "message": "Facturamos unos 200 millones al año y somos 150 empleados.",
+        "state": {"empresa": "Textiles Omega", "driver_estrategico": "RESCATE_FORENSE",
+                  "autoridad_detectada": "C_LEVEL", "stack_tecnologico": "NUBE_DESCONECTADA",
+                  "nodo_critico": "ALMACEN_INVENTARIO"},
+        "expected": {"empresa": "Textiles Omega", "driver_estrategico": "RESCATE_FORENSE",
+                     "autoridad_detectada": "C_LEVEL", "stack_tecnologico": "NUBE_DESCONECTADA",
+                     "nodo_critico": "ALMACEN_INVENTARIO", "red_flags": False},
+    },
+    {
+        "message": "Soy estudiante y para mi clase de sistemas necesito entrevistar a una "
+                   "consultora, ¿me ayudan?",
+        "state": {},
+        "expected": {"autoridad_detectada": "OPERATIVO", "red_flags": True},
+    },
+]
+
+LABELED = set(ENUM_FIELDS) | set(BOOL_FIELDS)
+
+
+# ==============================================================================
+# MEDICIÓN
+# ==============================================================================
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] if ordered else 0.0
+
+
+def label_coverage(bank: ExampleBank, rendered: list, expected: dict) -> float:
+    """Mejor fracción de etiquetas esperadas que comparte algún caso enviado."""
+    labels = {k: v for k, v in expected.items() if k in LABELED}
+    if not labels or not rendered:
+        return 0.0
+    titles = {e.split("\n", 1)[0].split(" — ", 1)[1] for e in rendered}
+    best = 0.0
+    for example in bank.examples:
+        if example.title in titles:
+            agree = sum(1 for k, v in labels.items() if example.output.get(k) == v)
+            best  = max(best, agree / len(labels))
+    return best
+
+
+def assemble(assembler, bank: ExampleBank, case: dict, agent: str) -> str:
+    fixed = {"knowledge": "(sin fragmentos relevantes)"} if agent == "fused" else {}
+    return assembler.assemble(
+        fixed, history=[], dossier=case["state"], examples=bank.select(case["message"], case["state"]),
+    )
+
+
+def offline_report(bank: ExampleBank, repeat: int) -> dict:
+    tokens = {"scribe": [], "fused": []}
+    timings, coverage = [], []
+    for case in EVAL_CASES:
+        for agent, assembler in (("scribe", main.scribe_prompt), ("fused", main.fused_prompt)):
+            tokens[agent].append(estimate_tokens(assemble(assembler, bank, case, agent)))
+        for _ in range(repeat):
+            bank._cached.cache_clear()
+            started = time.perf_counter()
+            assemble(main.scribe_prompt, bank, case, "scribe")
+            timings.append((time.perf_counter() - started) * 1e6)
+        coverage.append(label_coverage(bank, bank.select(case["message"], case["state"]), case["expected"]))
+    return {
+        "prompt_tokens": {
+            agent: {"p50": percentile(values, 50), "mean": round(sum(values) / len(values), 1)}
+            for agent, values in tokens.items()
+        },
+        "assemble_us": {"p50": round(percentile(timings, 50), 1), "p95": round(percentile(timings, 95), 1)},
+        "label_coverage": round(sum(coverage) / len(coverage), 3),
+    }
+
+
+async def live_report(bank: ExampleBank, provider, repeat: int) -> dict:
+    """Llamadas reales al Perfilador: latencia, tokens de `usage` y exactitud por campo."""
+    latencies, prompt_tokens, hits, total, invalid = [], [], 0, 0, 0
+    per_field = {}
+    for case in EVAL_CASES:
+        system_prompt = assemble(main.scribe_prompt, bank, case, "scribe")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result  = await provider.complete("scribe", [
+                {"role": "system", "content": system_prompt},
+                {"role": "user",   "content": f"Mensaje nuevo del prospecto: {case['message']}"},
+            ])
+            latencies.append((time.perf_counter() - started) * 1000)
+            prompt_tokens.append(result.prompt_tokens)
+            try:
+                got = LeadDossier.from_dict(case["state"]).merge(json.loads(result.content)).to_dict()
+            except ValueError:
+                invalid += 1
+                got = {}
+            for name, value in case["expected"].items():
+                ok = got.get(name) == value
+                hits += ok
+                total += 1
+                field = per_field.setdefault(name, [0, 0])
+                field[0] += ok
+                field[1] += 1
+    return {
+        "latency_ms":    {"p50": round(percentile(latencies, 50), 1), "p95": round(percentile(latencies, 95), 1)},
+        "prompt_tokens": {"p50": percentile(prompt_tokens, 50),
+                          "mean": round(sum(prompt_tokens) / len(prompt_tokens), 1)},
+        "accuracy":      round(hits / total, 3) if total else 0.0,
+        "per_field":     {name: round(ok / n, 3) for name, (ok, n) in sorted(per_field.items())},
+        "invalid_json":  invalid,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de few-shots dinámicos del Perfilador")
+    parser.add_argument("--k", type=int, action="append",
+                        help="casos por prompt en modo dinámico (repetible; por defecto 1 y 2)")
+    parser.add_argument("--state-weight", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=50,
+                        help="repeticiones por turno (offline: ensamblado; --live: llamadas)")
+    parser.add_argument("--live", action="store_true", help="llama a Groq (GROQ_API_KEY)")
+    parser.add_argument("--out", metavar="PATH")
+    return parser.parse_args(argv)
+
+
+def main_cli(argv=None) -> int:
+    args     = parse_args(argv)
+    policies = [("all", ExampleBank.from_dicts(SCRIBE_EXAMPLES, mode="all"))]
+    for k in args.k or (1, 2):
+        policies.append((f"dynamic_k{k}", ExampleBank.from_dicts(
+            SCRIBE_EXAMPLES, mode="dynamic", k=k, state_weight=args.state_weight,
+        )))
+
+    provider = None
+    if args.live:
+        from llm import GroqProvider
+        api_key = os.getenv("GROQ_API_KEY")
+        if not api_key:
+            print("--live requiere GROQ_API_KEY.")
+            return 1
+        provider = GroqProvider(api_key)
+
+    report = {"cases": len(EVAL_CASES), "bank": len(SCRIBE_EXAMPLES), "policies": {}}
+    for name, bank in policies:
+        entry = offline_report(bank, 1 if args.live else args.repeat)
+        if provider:
+            entry["live"] = asyncio.run(live_report(bank, provider, args.repeat))
+        report["policies"][name] = entry
+
+    base = report["policies"]["all"]["prompt_tokens"]["scribe"]["mean"]
+    for name, entry in report["policies"].items():
+        entry["scribe_tokens_vs_all"] = round(entry["prompt_tokens"]["scribe"]["mean"] / base - 1, 3)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2, ensure_ascii=False)
+            fh.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,195 @@
+"""
+cache.py — Evangelista & Co.
+Caché direccionado por contenido para las extracciones del Perfilador.
+
+El Scribe corre a temperature=0.0 con response_format=json_object: la misma
+entrada (expediente, mensaje) produce la misma salida. Los aperturas repetitivas
+("hola", "cuánto cuesta") no necesitan pasar por el modelo 70B cada vez.
+
+La clave es un SHA-256 de:
+  - la huella del prompt + modelo + temperatura (cambiar PROMPT_SCRIBE o el modelo
+    invalida todo el caché automáticamente),
+  - el expediente normalizado (JSON con claves ordenadas),
+  - el historial acotado que ve el Perfilador (vacío en el primer turno),
+  - el mensaje normalizado (minúsculas, espacios colapsados).
+
+Backends: LRU en memoria con TTL (por defecto) o archivo SQLite.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from metrics import REGISTRY
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "evangelista_scribe_cache_total", "Consultas al caché del Perfilador.", ("result",))
+
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_message(text: str) -> str:
+    return _SPACES_RE.sub(" ", text).strip().casefold()
+
+
+def fingerprint(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """LRU acotado por entradas; cada entrada expira tras `ttl_seconds`."""
+
+    def __init__(self, max_entries: int = 2000, ttl_seconds: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """
+    Caché persistente en SQLite; compartible entre workers de la misma máquina.
+    Cada PRUNE_EVERY escrituras (y al abrir) borra lo vencido y, pasado
+    `max_entries`, lo más antiguo.
+    """
+
+    PRUNE_EVERY = 200
+
+    def __init__(self, path: str, ttl_seconds: float = 24 * 3600, max_entries: int = 2000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock   = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_created ON cache (created_at)")
+        self._conn.commit()
+        self.prune()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] + self.ttl_seconds < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+            self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self) -> int:
+        """Borra las entradas vencidas y las más antiguas por encima del tope."""
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            removed += self._conn.execute(
+                "DELETE FROM cache WHERE key IN"
+                " (SELECT key FROM cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            self._conn.commit()
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class ScribeCache:
+    """Fachada del caché: arma la clave y contabiliza hits/misses."""
+
+    def __init__(self, backend, prompt_text: str, model: str, temperature: float):
+        self.backend      = backend
+        self.prompt_hash  = fingerprint(prompt_text, model, repr(temperature))
+        self.hits         = 0
+        self.misses       = 0
+
+    def key(self, memory: dict, user_msg: str, history: list = ()) -> str:
+        dossier = json.dumps(memory, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        context = json.dumps(list(history), ensure_ascii=False, separators=(",", ":"))
+        return fingerprint(self.prompt_hash, dossier, context, normalize_message(user_msg))
+
+    def get(self, memory: dict, user_msg: str, history: list = ()) -> Optional[dict]:
+        value = self.backend.get(self.key(memory, user_msg, history))
+        if value is None:
+            self.misses += 1
+            CACHE_LOOKUPS.inc("miss")
+        else:
+            self.hits += 1
+            CACHE_LOOKUPS.inc("hit")
+        return value
+
+    def set(self, memory: dict, user_msg: str, value: dict, history: list = ()) -> None:
+        self.backend.set(self.key(memory, user_msg, history), value)
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+
+def build_scribe_cache(prompt_text: str, model: str, temperature: float) -> Optional[ScribeCache]:
+    """SCRIBE_CACHE=memory (por defecto) | sqlite | off; SCRIBE_CACHE_MAX aplica a ambos."""
+    kind = os.getenv("SCRIBE_CACHE", "memory").lower()
+    ttl  = float(os.getenv("SCRIBE_CACHE_TTL_SECONDS", str(24 * 3600)))
+    size = int(os.getenv("SCRIBE_CACHE_MAX", "2000"))
+    if kind == "off":
+        return None
+    if kind == "sqlite":
+        backend = SQLiteCache(os.getenv("SCRIBE_CACHE_PATH", "scribe_cache.db"), ttl_seconds=ttl, max_entries=size)
+    else:
+        backend = LRUCache(size, ttl_seconds=ttl)
+    return ScribeCache(backend, prompt_text, model, temperature)
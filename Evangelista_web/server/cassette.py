@@ -0,0 +1,506 @@
+"""
+cassette.py — Evangelista & Co.
+Casetes: grabación de turnos reales y replay offline, determinista y sin red.
+
+No había forma de reproducir una conversación de producción: cada corrida de
+`update_lead_memory`, `run_strategist` y `run_voice` sale a Groq. Ahora:
+
+  - Grabación (CASSETTE_RECORD=casetes.jsonl.gz): por turno contestado se anexa
+    una línea JSON con el estado de entrada (mensaje, historial, resumen,
+    expediente), cada llamada LLM (prompt renderizado, respuesta cruda, tokens,
+    duración) y el resultado (táctica, acción, expediente, respuesta) con los
+    tiempos por etapa. Append-only; con `.gz` se comprime en un solo flujo gzip
+    con flush por línea. Escribe un hilo propio: el event loop sólo encola.
+  - Replay (`python cassette.py replay casetes.jsonl.gz`): vuelve a correr /chat
+    en proceso por cada turno grabado, con el proveedor LLM sustituido por las
+    respuestas del casete y a velocidad real (--speed 1), acelerada (--speed 10)
+    o sin esperas (--speed 0). Reporta la deriva de táctica, acción y expediente,
+    los prompts que cambiaron (con un diff de ejemplo por agente) y el delta de
+    latencia por etapa frente a lo grabado.
+
+Las respuestas se sirven por agente en el orden grabado, aunque el prompt haya
+cambiado: la deriva que se mide es la del código (reglas, parseo, candados,
+clasificador), y el cambio de prompt se reporta aparte. Si el pipeline pide una
+llamada que no está en el turno (otro PIPELINE_MODE, caché del Perfilador al
+grabar) se busca el mismo prompt en todo el casete; si no aparece, la llamada
+falla y el pipeline toma su fallback, como en producción. Los aciertos de la
+caché del Perfilador se graban como llamadas instantáneas (`record_cached`).
+"""
+
+import argparse
+import asyncio
+import difflib
+import gzip
+import hashlib
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from llm import LLMProvider, LLMResult
+from metrics import REGISTRY
+
+CASSETTE_VERSION = 1
+
+CASSETTE_TURNS = REGISTRY.counter(
+    "evangelista_cassette_turns_total", "Turnos escritos al casete de grabación.", ("status",))
+
+_tape: ContextVar[Optional["Tape"]] = ContextVar("cassette_tape", default=None)
+
+
+def prompt_digest(messages: list) -> str:
+    payload = json.dumps(messages, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+# ==============================================================================
+# GRABACIÓN
+# ==============================================================================
+
+class Tape:
+    """Un turno: estado de entrada, llamadas LLM y resultado."""
+
+    def __init__(self, endpoint: str, state: dict):
+        self.endpoint = endpoint
+        self.state    = state
+        self.calls: List[dict] = []
+
+    def add_call(self, agent: str, messages: list, started: float, content: str = "",
+                 result: Optional[LLMResult] = None, error: Optional[BaseException] = None,
+                 first_token: Optional[float] = None) -> None:
+        call = {
+            "agent":  agent,
+            "digest": prompt_digest(messages),
+            "prompt": messages,
+            "ms":     round((time.perf_counter() - started) * 1000, 1),
+        }
+        if result is not None:
+            call.update(content=result.content, model=result.model,
+                        tokens=[result.prompt_tokens, result.completion_tokens])
+            if result.fallback:
+                call["fallback"] = True
+        else:
+            call["content"] = content
+        if first_token is not None:
+            call["first_ms"] = round((first_token - started) * 1000, 1)
+        if error is not None:
+            call["error"] = f"{type(error).__name__}: {error}"
+        self.calls.append(call)
+
+
+class RecordingProvider(LLMProvider):
+    """Anota cada llamada (prompt, respuesta y duración) en el casete del turno activo."""
+
+    def __init__(self, inner: LLMProvider):
+        self.inner   = inner
+        self.configs = inner.configs
+        self.name    = inner.name
+
+    async def complete(self, agent: str, messages: list, model: Optional[str] = None) -> LLMResult:
+        tape = _tape.get()
+        if tape is None:
+            return await self.inner.complete(agent, messages, model=model)
+        started = time.perf_counter()
+        try:
+            result = await self.inner.complete(agent, messages, model=model)
+        except Exception as e:
+            tape.add_call(agent, messages, started, error=e)
+            raise
+        tape.add_call(agent, messages, started, result=result)
+        return result
+
+    async def stream(self, agent: str, messages: list, model: Optional[str] = None) -> AsyncIterator[str]:
+        tape = _tape.get()
+        if tape is None:
+            async for token in self.inner.stream(agent, messages, model=model):
+                yield token
+            return
+        started, first, parts = time.perf_counter(), None, []
+        try:
+            async for token in self.inner.stream(agent, messages, model=model):
+                if first is None:
+                    first = time.perf_counter()
+                parts.append(token)
+                yield token
+        except Exception as e:
+            tape.add_call(agent, messages, started, "".join(parts), error=e, first_token=first)
+            raise
+        tape.add_call(agent, messages, started, "".join(parts), first_token=first)
+
+
+def record_cached(agent: str, content: str) -> None:
+    """
+    Respuesta servida desde caché (Perfilador): se graba como llamada instantánea
+    para que el replay, que corre sin caché, la encuentre en su lugar.
+    """
+    tape = _tape.get()
+    if tape is not None and not isinstance(tape, ReplayTape):
+        tape.calls.append({"agent": agent, "digest": None, "prompt": None,
+                           "ms": 0.0, "content": content, "cached": True})
+
+
+def record_calls(provider: LLMProvider) -> LLMProvider:
+    """Envuelve al proveedor sólo si hay casete configurado (CASSETTE_RECORD)."""
+    return RecordingProvider(provider) if os.getenv("CASSETTE_RECORD") else provider
+
+
+class CassetteRecorder:
+    """Escritor append-only del casete; serializa y escribe en un hilo propio."""
+
+    def __init__(self, path: str, sample: float = 1.0):
+        self.path    = path
+        self.sample  = sample
+        self.written = 0
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._lock   = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def begin(self, endpoint: str, state: dict) -> Optional[Tape]:
+        """Abre el casete del turno (None si el muestreo lo deja fuera)."""
+        sampled = self.sample >= 1.0 or random.random() < self.sample
+        tape    = Tape(endpoint, state) if sampled else None
+        _tape.set(tape)
+        return tape
+
+    def finish(self, tape: Tape, trace, status: str, result: dict) -> None:
+        entry = {
+            "v":         CASSETTE_VERSION,
+            "id":        trace.id,
+            "ts":        datetime.now().isoformat(timespec="seconds"),
+            "endpoint":  tape.endpoint,
+            "status":    status,
+            "state":     tape.state,
+            "calls":     list(tape.calls),
+            "result":    result,
+            "total_ms":  round((time.perf_counter() - trace.started) * 1000, 1),
+            "stages_ms": {k: round(v * 1000, 1) for k, v in trace.stages.items()},
+        }
+        self._ensure_thread()
+        self._queue.put(entry)
+        CASSETTE_TURNS.inc(status)
+
+    def _ensure_thread(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cassette", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "at", encoding="utf-8") as fh:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    return
+                try:
+                    fh.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+                    fh.flush()
+                    self.written += 1
+                except (TypeError, ValueError) as e:
+                    print(f"Error casete: {e}")
+
+    def stop(self) -> None:
+        """Drena lo encolado y cierra el archivo (apagado)."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+
+def build_recorder() -> Optional[CassetteRecorder]:
+    """CASSETTE_RECORD=ruta (.jsonl o .jsonl.gz; vacío = no grabar); CASSETTE_SAMPLE=1.0."""
+    path = os.getenv("CASSETTE_RECORD", "")
+    if not path:
+        return None
+    sample = float(os.getenv("CASSETTE_SAMPLE", "1.0"))
+    print(f"--- CASETE: grabando en {path} (muestreo {sample:.0%}) ---")
+    return CassetteRecorder(path, sample)
+
+
+def read_cassette(path: str) -> Iterator[dict]:
+    """Turnos del casete; tolera la última línea truncada de una grabación interrumpida."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as fh:
+        try:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("v") == CASSETTE_VERSION:
+                    yield entry
+        except EOFError:        # flujo gzip sin cerrar (proceso terminado a la mitad)
+            return
+
+
+# ==============================================================================
+# REPLAY
+# ==============================================================================
+
+class CassetteMiss(RuntimeError):
+    """El pipeline pidió una llamada que el casete no tiene."""
+
+
+class RecordedError(RuntimeError):
+    """La llamada grabada falló; se repite el fallo para que el pipeline tome su fallback."""
+
+
+class ReplayTape(Tape):
+    """Turno grabado en reproducción: sirve sus llamadas y recoge el resultado nuevo."""
+
+    def __init__(self, entry: dict):
+        super().__init__(entry["endpoint"], entry["state"])
+        self.entry   = entry
+        self.pending = defaultdict(deque)
+        for call in entry["calls"]:
+            self.pending[call["agent"]].append(call)
+        self.prompts: Dict[str, List[tuple]] = defaultdict(list)   # agente → [(grabado, nuevo)]
+        self.misses  = Counter()
+        self.waited  = 0.0
+        self.status: Optional[str] = None
+        self.result: Optional[dict] = None
+        self.total_ms  = 0.0
+        self.stages_ms: Dict[str, float] = {}
+
+
+class CassettePlayer(LLMProvider):
+    """
+    Proveedor de replay y sustituto del grabador en main: sirve las respuestas del
+    casete activo esperando lo que tardaron (entre `speed`) y recibe el resultado.
+    """
+
+    name = "cassette"
+
+    def __init__(self, entries: List[dict], speed: float = 1.0, configs=None):
+        super().__init__(configs)
+        self.speed    = speed
+        self.by_digest = {}
+        for entry in entries:
+            for call in entry["calls"]:
+                if "error" not in call and call["digest"]:
+                    self.by_digest.setdefault((call["agent"], call["digest"]), call)
+
+    def _take(self, agent: str, messages: list) -> dict:
+        tape = _tape.get()
+        if not isinstance(tape, ReplayTape):
+            raise CassetteMiss("sin casete activo")
+        digest = prompt_digest(messages)
+        if tape.pending[agent]:
+            call = tape.pending[agent].popleft()
+        elif (agent, digest) in self.by_digest:
+            call = self.by_digest[(agent, digest)]
+        else:
+            tape.misses[agent] += 1
+            raise CassetteMiss(f"{agent}: llamada no grabada")
+        if call["prompt"] is not None and call["digest"] != digest:
+            tape.prompts[agent].append((call["prompt"], messages))
+        return call
+
+    async def _wait(self, ms: float) -> None:
+        if self.speed > 0 and ms > 0:
+            delay = ms / 1000 / self.speed
+            _tape.get().waited += delay
+            await asyncio.sleep(delay)
+
+    async def complete(self, agent: str, messages: list, model: Optional[str] = None) -> LLMResult:
+        call = self._take(agent, messages)
+        await self._wait(call["ms"])
+        if "error" in call:
+            raise RecordedError(call["error"])
+        prompt_tokens, completion_tokens = call.get("tokens", (0, 0))
+        return LLMResult(
+            content=call["content"],
+            model=call.get("model", model or self.configs[agent].model),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            fallback=call.get("fallback", False),
+        )
+
+    async def stream(self, agent: str, messages: list, model: Optional[str] = None) -> AsyncIterator[str]:
+        call = self._take(agent, messages)
+        await self._wait(call.get("first_ms", call["ms"]))
+        if "error" in call and not call["content"]:
+            raise RecordedError(call["error"])
+        words = call["content"].split(" ")
+        rest  = (call["ms"] - call.get("first_ms", call["ms"])) / max(1, len(words) - 1)
+        for i, word in enumerate(words):
+            if i:
+                await self._wait(rest)
+            yield word if i == len(words) - 1 else word + " "
+        if "error" in call:
+            raise RecordedError(call["error"])
+
+    # --- interfaz de CassetteRecorder (main.recorder) ---
+
+    def begin(self, endpoint: str, state: dict) -> Optional[Tape]:
+        tape = _tape.get()
+        return tape if isinstance(tape, ReplayTape) else None
+
+    def finish(self, tape: ReplayTape, trace, status: str, result: dict) -> None:
+        tape.status    = status
+        tape.result    = result
+        tape.stages_ms = {k: v * 1000 for k, v in trace.stages.items()}
+
+
+def _summary(values: List[float]) -> dict:
+    ordered = sorted(values)
+    pick    = lambda pct: ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] if ordered else 0.0
+    return {"count": len(ordered), "p50_ms": round(pick(50), 1), "p95_ms": round(pick(95), 1)}
+
+
+def _prompt_diff(recorded: list, current: list, max_lines: int = 20) -> List[str]:
+    old  = "\n".join(m.get("content", "") for m in recorded).splitlines()
+    new  = "\n".join(m.get("content", "") for m in current).splitlines()
+    diff = [line for line in difflib.unified_diff(old, new, "grabado", "actual", n=0, lineterm="")
+            if not line.startswith("@@")]
+    return diff[:max_lines]
+
+
+def drift_report(tapes: List[ReplayTape], speed: float) -> dict:
+    """Deriva del replay frente a lo grabado: decisiones, prompts y latencia."""
+    drift  = Counter()
+    fields = Counter()
+    prompt_turns, prompt_examples = Counter(), {}
+    misses, unused = Counter(), Counter()
+    changes = []
+    latency = defaultdict(lambda: {"recorded": [], "replay": []})
+    # Con speed > 0 el replay espera ms/speed: se reescala para comparar en tiempo real
+    scale = speed if speed > 0 else 1.0
+
+    for tape in tapes:
+        entry, before, after = tape.entry, tape.entry["result"], tape.result or {}
+        change = {}
+        if tape.status != entry["status"]:
+            change["status"] = [entry["status"], tape.status]
+        for key in ("tactic", "action", "response"):
+            if before.get(key) != after.get(key):
+                change[key] = [before.get(key), after.get(key)] if key != "response" else True
+        old_dossier, new_dossier = before.get("dossier", {}), after.get("dossier", {})
+        changed = sorted(k for k in set(old_dossier) | set(new_dossier)
+                         if old_dossier.get(k) != new_dossier.get(k))
+        if changed:
+            change["dossier"] = {k: [old_dossier.get(k), new_dossier.get(k)] for k in changed}
+            fields.update(changed)
+        for key in change:
+            drift[key] += 1
+        if change:
+            changes.append({"id": entry["id"], "message": entry["state"]["message"][:80], **change})
+
+        for agent, pairs in tape.prompts.items():
+            prompt_turns[agent] += 1
+            if agent not in prompt_examples:
+                prompt_examples[agent] = _prompt_diff(*pairs[0])
+        misses.update(tape.misses)
+        unused.update({agent: len(calls) for agent, calls in tape.pending.items() if calls})
+
+        latency["total"]["recorded"].append(entry["total_ms"])
+        latency["total"]["replay"].append(tape.total_ms * scale)
+        for stage, ms in entry["stages_ms"].items():
+            latency[stage]["recorded"].append(ms)
+        for stage, ms in tape.stages_ms.items():
+            latency[stage]["replay"].append(ms * scale)
+
+    latency_report = {}
+    for stage, series in sorted(latency.items()):
+        recorded, replayed = _summary(series["recorded"]), _summary(series["replay"])
+        latency_report[stage] = {
+            "recorded": recorded,
+            "replay":   replayed,
+            "delta_p50_ms": round(replayed["p50_ms"] - recorded["p50_ms"], 1),
+            "delta_p95_ms": round(replayed["p95_ms"] - recorded["p95_ms"], 1),
+        }
+    return {
+        "turns":   len(tapes),
+        "speed":   speed,
+        "drift":   {**{k: drift[k] for k in ("status", "tactic", "action", "dossier", "response")},
+                    "dossier_fields": dict(fields)},
+        "prompts": {agent: {"turns": n, "example_diff": prompt_examples[agent]}
+                    for agent, n in sorted(prompt_turns.items())},
+        "calls":   {"missing": dict(misses), "unused": dict(unused)},
+        "latency": latency_report,
+        "changes": changes,
+    }
+
+
+async def replay(entries: List[dict], speed: float = 1.0, concurrency: int = 1,
+                 pipeline: Optional[str] = None) -> dict:
+    """Corre /chat en proceso por cada turno grabado y devuelve `drift_report`."""
+    import httpx
+    import main
+    from llm import InstrumentedProvider
+
+    player        = CassettePlayer(entries, speed)
+    main.llm      = InstrumentedProvider(player)     # tiempos por etapa como en producción
+    main.recorder = player
+    if pipeline:
+        main.PIPELINE_MODE = pipeline
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    transport = httpx.ASGITransport(app=main.app)
+
+    async def run(http, entry: dict) -> ReplayTape:
+        async with semaphore:
+            tape, state = ReplayTape(entry), entry["state"]
+            _tape.set(tape)
+            session_id = f"replay-{entry['id']}"
+            main.session_store.save(session_id, {
+                "history":   state["history"],
+                "summary":   state.get("summary", ""),
+                "lead_data": state["lead_data"],
+            })
+            started = time.perf_counter()
+            await http.post("/chat", json={"message": state["message"], "session_id": session_id})
+            tape.total_ms = (time.perf_counter() - started) * 1000
+            main.session_store.delete(session_id)
+            return tape
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=None) as http:
+        tapes = await asyncio.gather(*(asyncio.create_task(run(http, e)) for e in entries))
+    return drift_report(list(tapes), speed)
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay offline de casetes grabados.")
+    parser.add_argument("command", choices=["replay"])
+    parser.add_argument("cassette")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="1 = tiempo real, 10 = diez veces más rápido, 0 = sin esperas")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--pipeline", choices=["sequential", "speculative", "fused"],
+                        help="sobrescribe PIPELINE_MODE")
+    parser.add_argument("--out", metavar="PATH", help="escribe el reporte JSON")
+    parser.add_argument("--fail-on-drift", action="store_true",
+                        help="código de salida 1 si cambia alguna táctica, acción o expediente")
+    args = parser.parse_args(argv)
+
+    # Replay aislado: sin red, sin Sheets, sin re-grabar ni alimentar al clasificador
+    os.environ.update(LLM_PROVIDER="fake", CASSETTE_RECORD="", TACTIC_LOG_PATH="",
+                      SCRIBE_CACHE="off", SESSION_BACKEND="memory")
+    os.environ.pop("GOOGLE_CREDENTIALS", None)
+
+    entries = list(read_cassette(args.cassette))
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        print(f"{args.cassette}: sin turnos grabados.")
+        return 1
+    report = asyncio.run(replay(entries, args.speed, args.concurrency, args.pipeline))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2, ensure_ascii=False)
+            fh.write("\n")
+    drifted = any(report["drift"][k] for k in ("status", "tactic", "action", "dossier"))
+    return 1 if args.fail_on_drift and drifted else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -1,35 +1,37 @@
-import google.generativeai as genai
 import os
 from dotenv import load_dotenv
+from groq import Groq
+from llm import load_agent_configs
 
 # 1. Cargar tu llave del archivo .env
 load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
+api_key = os.getenv("GROQ_API_KEY")
 
 if not api_key:
-    print("ERROR: No se encontró la API KEY en el archivo .env")
+    print("ERROR: No se encontró GROQ_API_KEY en el archivo .env")
 else:
     print(f"✅ API KEY encontrada: {api_key[:5]}...*****")
-    
+
     try:
-        genai.configure(api_key=api_key)
-        
+        client = Groq(api_key=api_key)
+
         print("\n🔎 BUSCANDO MODELOS DISPONIBLES PARA TI...")
         print("------------------------------------------------")
-        
+
         # 2. Listar modelos
-        found = False
-        for m in genai.list_models():
-            # Solo queremos modelos que generen texto (chat)
-            if 'generateContent' in m.supported_generation_methods:
-                print(f"• {m.name}")
-                found = True
-        
-        if not found:
-            print("⚠️ No se encontraron modelos de texto. Verifica tu API Key.")
-            
+        available = sorted(m.id for m in client.models.list().data)
+        for model_id in available:
+            print(f"• {model_id}")
+
+        if not available:
+            print("⚠️ No se encontraron modelos. Verifica tu API Key.")
+
+        # 3. Verificar la configuración de cada agente
         print("------------------------------------------------")
-        print("COPIA EXACTAMENTE UNO DE LOS NOMBRES DE ARRIBA (ej: models/gemini-pro)")
+        print("CONFIGURACIÓN ACTUAL POR AGENTE (<AGENTE>_MODEL / <AGENTE>_TEMPERATURE):")
+        for agent, cfg in load_agent_configs().items():
+            status = "✅" if cfg.model in available else "❌ NO DISPONIBLE"
+            print(f"• {agent:<11} {cfg.model} (t={cfg.temperature}) {status}")
 
     except Exception as e:
-        print(f"\n❌ ERROR DE CONEXIÓN: {e}")
\ No newline at end of file
+        print(f"\n❌ ERROR DE CONEXIÓN: {e}")
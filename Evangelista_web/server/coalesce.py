@@ -0,0 +1,190 @@
+"""
+coalesce.py — Evangelista & Co.
+Coordinación de turnos por sesión: fusión de mensajes en ráfaga y cancelación
+de corridas reemplazadas o abandonadas.
+
+Antes, si el prospecto mandaba dos mensajes seguidos o cerraba la pestaña, cada
+petición corría Perfilador → Estratega → Vocero completos: cuota quemada y
+respuestas que podían llegar en desorden. Ahora, por sesión:
+
+  - Sólo hay un turno vivo. Un mensaje nuevo REEMPLAZA al turno en curso: lo
+    cancela (esté esperando cupo o a mitad de una llamada LLM) y hereda su texto,
+    así el mensaje anterior no se pierde: se contesta junto con el nuevo.
+  - Tras reemplazar a otro, el turno espera COALESCE_WINDOW_MS por si la ráfaga
+    sigue; un mensaje aislado arranca sin espera.
+  - Si el cliente se desconecta, el turno se cancela (`watch_disconnect`).
+  - El turno reemplazado responde 409 (o el evento `superseded` si su stream ya
+    estaba abierto); el último responde a todos los mensajes fusionados.
+
+La cancelación viaja como `asyncio.CancelledError` hasta la llamada al proveedor;
+admission y resilience ya devuelven su cupo y cancelan sus coberturas. Se cuenta
+en `evangelista_turns_cancelled_total{reason, stage}` y las fusiones en
+`evangelista_turns_coalesced_total`.
+"""
+
+import asyncio
+import os
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from metrics import REGISTRY
+
+TURNS_CANCELLED = REGISTRY.counter(
+    "evangelista_turns_cancelled_total",
+    "Turnos cancelados por reemplazo o desconexión, según la etapa en que iban.",
+    ("reason", "stage"))
+TURNS_COALESCED = REGISTRY.counter(
+    "evangelista_turns_coalesced_total",
+    "Mensajes fusionados en un turno posterior de la misma sesión.")
+
+_END = object()
+
+
+class TurnCancelled(Exception):
+    """El turno ya no debe responder: `reason` = superseded | disconnected."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Turn:
+    def __init__(self, coordinator: "TurnCoordinator", session_id: str,
+                 messages: List[str], debounce: bool):
+        self.coordinator = coordinator
+        self.session_id  = session_id
+        self.messages    = messages
+        self.debounce    = debounce
+        self.stage       = "debounce" if debounce else "queued"
+        self.reason: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self._cancelled  = asyncio.Event()
+
+    @property
+    def message(self) -> str:
+        """Texto a procesar: los mensajes fusionados, en orden de llegada."""
+        return "\n".join(self.messages)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str) -> None:
+        if self.reason is not None:
+            return
+        self.reason = reason
+        TURNS_CANCELLED.inc(reason, self.stage)
+        self._cancelled.set()
+        if self.task and not self.task.done():
+            self.task.cancel()
+
+    def check(self) -> None:
+        if self.reason is not None:
+            raise TurnCancelled(self.reason)
+
+    async def settle(self) -> None:
+        """Ventana de fusión (sólo si este turno reemplazó a otro)."""
+        if self.debounce and self.coordinator.window > 0:
+            try:
+                await asyncio.wait_for(self._cancelled.wait(), self.coordinator.window)
+            except asyncio.TimeoutError:
+                pass
+        self.check()
+        self.stage = "queued"
+
+    async def run(self, work: Awaitable):
+        """Ejecuta `work` como tarea cancelable por reemplazo o desconexión."""
+        self.check()
+        self.task = asyncio.ensure_future(work)
+        try:
+            result = await self.task
+        except asyncio.CancelledError:
+            if self.reason is not None and not _outer_cancelled():
+                raise TurnCancelled(self.reason) from None
+            raise
+        # Reemplazado justo al terminar: el turno nuevo ya heredó este mensaje
+        self.check()
+        return result
+
+    async def stream(self, tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+        """
+        Reenvía un stream de tokens desde una tarea propia: cancelarla corta la
+        llamada al proveedor aunque el consumidor esté esperando el siguiente token.
+        """
+        self.check()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def pump():
+            try:
+                async for token in tokens:
+                    queue.put_nowait(token)
+            except Exception as e:
+                queue.put_nowait(e)
+            finally:
+                queue.put_nowait(_END)
+
+        self.task = asyncio.ensure_future(pump())
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+            self.check()
+        finally:
+            if not self.task.done():
+                self.task.cancel()
+
+    async def watch_disconnect(self, receive: Callable[[], Awaitable[dict]]) -> None:
+        """Cancela el turno cuando el servidor ASGI reporta `http.disconnect`."""
+        while True:
+            message = await receive()
+            if message.get("type") == "http.disconnect":
+                self.cancel("disconnected")
+                return
+
+    def close(self) -> None:
+        self.coordinator._close(self)
+
+
+def _outer_cancelled() -> bool:
+    """¿La cancelación va dirigida a la tarea que espera (apagado, disconnect de Starlette)?"""
+    task = asyncio.current_task()
+    cancelling = getattr(task, "cancelling", None)     # Python 3.11+
+    return bool(cancelling and cancelling())
+
+
+class TurnCoordinator:
+    def __init__(self, window: float = 0.4, enabled: bool = True):
+        self.window  = window
+        self.enabled = enabled
+        self._active: Dict[str, Turn] = {}
+
+    def open(self, session_id: str, message: str) -> Turn:
+        """Registra el mensaje; si hay un turno vivo en la sesión, lo reemplaza y hereda su texto."""
+        previous = self._active.get(session_id) if self.enabled else None
+        if previous is not None:
+            previous.cancel("superseded")
+            TURNS_COALESCED.inc()
+            turn = Turn(self, session_id, previous.messages + [message], debounce=True)
+        else:
+            turn = Turn(self, session_id, [message], debounce=False)
+        if self.enabled:
+            self._active[session_id] = turn
+        return turn
+
+    def _close(self, turn: Turn) -> None:
+        if self._active.get(turn.session_id) is turn:
+            del self._active[turn.session_id]
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "window_s": self.window, "active_sessions": len(self._active)}
+
+
+def build_coordinator() -> TurnCoordinator:
+    """COALESCE=on (por defecto) | off; COALESCE_WINDOW_MS=400."""
+    return TurnCoordinator(
+        window=float(os.getenv("COALESCE_WINDOW_MS", "400")) / 1000,
+        enabled=os.getenv("COALESCE", "on").lower() != "off",
+    )
@@ -0,0 +1,108 @@
+"""
+contacts.py — Evangelista & Co.
+Cazador silencioso: extracción de correos, teléfonos y enlaces de WhatsApp.
+
+Corre en TODAS las peticiones antes de cualquier IA, así que debe costar
+microsegundos:
+  - un único patrón combinado, precompilado al importar, recorre el mensaje una
+    sola vez (`finditer`) y clasifica cada coincidencia por grupo nombrado;
+  - un filtro previo barato descarta los mensajes sin '@' ni bloques de 4
+    dígitos (la mayoría de los turnos conversacionales).
+
+Formatos mexicanos reconocidos: 10 dígitos, (55) 1234-5678, 55 1234 5678,
++52 55…, +52 1 55… (prefijo móvil antiguo), wa.me/52… y
+api.whatsapp.com/send?phone=52…
+
+Normalización: correos en minúsculas; teléfonos en E.164 (+52 y 10 dígitos
+para números nacionales). Los números que no se pueden normalizar con certeza se
+descartan en lugar de adivinar.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import List
+
+COUNTRY_CODE = "52"
+
+# Todas las alternativas arrancan en inicio de token: el lookbehind común descarta
+# de inmediato las posiciones a mitad de palabra, que son la mayoría del mensaje.
+CONTACT_RE = re.compile(
+    r"(?<![\w.%+-])(?:"
+    r"(?P<email>[\w.%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,})"
+    r"|(?P<whatsapp>(?:https?://)?(?:wa\.me/|(?:api\.)?whatsapp\.com/send/?\?phone=)\+?(?P<wa_digits>\d{8,15}))"
+    r"|(?P<phone>(?:\+\d{1,3}[\s.-]?(?:1[\s.-]?)?)?"
+    r"(?:\(\d{2,3}\)[\s.-]?|\d{2,3}[\s.-]?)\d{3,4}[\s.-]?\d{4}(?!\d))"
+    r")"
+)
+_NON_DIGITS_RE = re.compile(r"\D")
+# Todo teléfono termina en un bloque de 4 dígitos; todo correo lleva '@'
+_HAS_CANDIDATE_RE = re.compile(r"@|\d{4}")
+
+
+@dataclass(frozen=True)
+class ContactMatch:
+    kind:  str    # email | phone | whatsapp
+    value: str    # normalizado
+    raw:   str    # texto tal como lo escribió el prospecto
+    start: int
+    end:   int
+
+
+def normalize_phone(raw: str) -> str:
+    """E.164 o cadena vacía si el número es ambiguo."""
+    digits = _NON_DIGITS_RE.sub("", raw)
+    if len(digits) == 10:
+        return f"+{COUNTRY_CODE}{digits}"
+    if digits.startswith(COUNTRY_CODE):
+        national = digits[len(COUNTRY_CODE):]
+        if len(national) == 11 and national.startswith("1"):
+            national = national[1:]          # +52 1 …: prefijo móvil en desuso
+        if len(national) == 10:
+            return f"+{COUNTRY_CODE}{national}"
+    if raw.lstrip().startswith("+") and 8 <= len(digits) <= 15:
+        return f"+{digits}"
+    return ""
+
+
+def extract_contacts(text: str) -> List[ContactMatch]:
+    """Todas las coincidencias, normalizadas y sin duplicados, en orden de aparición."""
+    if not _HAS_CANDIDATE_RE.search(text):
+        return []
+    found = []
+    seen  = set()
+    for match in CONTACT_RE.finditer(text):
+        kind = match.lastgroup if match.lastgroup != "wa_digits" else "whatsapp"
+        if kind == "email":
+            value = match.group("email").lower()
+        elif kind == "whatsapp":
+            value = normalize_phone("+" + match.group("wa_digits"))
+        else:
+            value = normalize_phone(match.group("phone"))
+        if not value or (kind, value) in seen:
+            continue
+        seen.add((kind, value))
+        found.append(ContactMatch(kind, value, match.group(0), match.start(), match.end()))
+    return found
+
+
+def detect_contact_info(text: str) -> dict:
+    """Resumen para el expediente: {"emails": [...], "telefonos": [...]} (sólo lo encontrado)."""
+    info: dict = {}
+    for match in extract_contacts(text):
+        key = "emails" if match.kind == "email" else "telefonos"
+        values = info.setdefault(key, [])
+        if match.value not in values:
+            values.append(match.value)
+    return info
+
+
+def format_contact(info: dict) -> str:
+    """Texto plano para la columna de contacto del CRM."""
+    return ", ".join(info.get("emails", []) + info.get("telefonos", []))
+
+
+def strip_contacts(text: str) -> str:
+    """El mensaje sin los datos de contacto (para saber qué más dijo el prospecto)."""
+    if not _HAS_CANDIDATE_RE.search(text):
+        return text
+    return CONTACT_RE.sub(" ", text)
@@ -0,0 +1,105 @@
+"""
+conversation.py — Evangelista & Co.
+Memoria conversacional acotada: ventana rodante + resumen incremental.
+
+La sesión guarda sólo los últimos `window_messages` mensajes completos. Lo que sale
+de la ventana se condensa en un resumen compacto (una línea por mensaje, tope de
+caracteres), de modo que el tamaño de la sesión y de los prompts es constante sin
+importar cuánto dure la conversación. Los hechos duros del prospecto ya viven en el
+expediente del Perfilador; el resumen sólo preserva el hilo narrativo.
+
+Cada agente recibe su propio presupuesto de tokens vía `context()`.
+"""
+
+import os
+from typing import Dict, List
+
+from prompt_budget import estimate_tokens
+
+
+def message_text(message: dict) -> str:
+    parts = message.get("parts") or [message.get("content", "")]
+    return " ".join(str(p) for p in parts)
+
+
+SPEAKERS = {"user": "Prospecto", "model": "Socio Digital"}
+
+# Presupuesto de historial por agente (tokens estimados; 0 = sin historial)
+HISTORY_BUDGETS: Dict[str, int] = {
+    "scribe":     int(os.getenv("SCRIBE_HISTORY_TOKENS", "600")),
+    "strategist": int(os.getenv("STRATEGIST_HISTORY_TOKENS", "900")),
+    "fused":      int(os.getenv("FUSED_HISTORY_TOKENS", "900")),
+}
+
+
+class ConversationMemory:
+    def __init__(
+        self,
+        window_messages: int = 12,
+        summary_max_chars: int = 1500,
+        line_chars: int = 160,
+        message_chars: int = 1200,
+    ):
+        self.window_messages   = window_messages
+        self.summary_max_chars = summary_max_chars
+        self.line_chars        = line_chars
+        self.message_chars     = message_chars
+
+    def message(self, role: str, text: str) -> dict:
+        """Mensaje en el formato del cliente, con tope de longitud."""
+        if len(text) > self.message_chars:
+            text = text[:self.message_chars] + "…"
+        return {"role": role, "parts": [text]}
+
+    def _summary_line(self, message: dict) -> str:
+        text = " ".join(message_text(message).split())
+        if len(text) > self.line_chars:
+            text = text[:self.line_chars] + "…"
+        return f"- {SPEAKERS.get(message.get('role'), 'Sistema')}: {text}"
+
+    def compact(self, session: dict) -> None:
+        """
+        Mueve al resumen lo que excede la ventana. Se ejecuta después de enviar la
+        respuesta (fuera del camino crítico).
+        """
+        history = session.get("history", [])
+        if len(history) <= self.window_messages:
+            return
+        evicted = history[:-self.window_messages]
+        session["history"] = history[-self.window_messages:]
+
+        lines = [l for l in session.get("summary", "").split("\n") if l]
+        lines.extend(self._summary_line(m) for m in evicted)
+        while lines and len("\n".join(lines)) > self.summary_max_chars:
+            lines.pop(0)
+        session["summary"] = "\n".join(lines)
+
+    def context(self, history: List[dict], summary: str, budget_tokens: int) -> List[dict]:
+        """Mensajes más recientes que caben en el presupuesto, precedidos del resumen."""
+        if budget_tokens <= 0:
+            return []
+        selected = []
+        used     = 0
+        if summary:
+            summary_msg = {"role": "summary", "parts": [summary]}
+            used = estimate_tokens(summary)
+            if used > budget_tokens // 2:
+                # El resumen nunca se come más de la mitad del presupuesto
+                keep = budget_tokens // 2 * 4
+                summary_msg["parts"] = ["…" + summary[-keep:]]
+                used = budget_tokens // 2
+        for message in reversed(history):
+            cost = estimate_tokens(message_text(message)) + 4
+            if used + cost > budget_tokens:
+                break
+            selected.append(message)
+            used += cost
+        selected.reverse()
+        return ([summary_msg] if summary else []) + selected
+
+
+def build_conversation_memory() -> ConversationMemory:
+    return ConversationMemory(
+        window_messages=int(os.getenv("HISTORY_WINDOW_MESSAGES", "12")),
+        summary_max_chars=int(os.getenv("HISTORY_SUMMARY_CHARS", "1500")),
+    )
@@ -0,0 +1,216 @@
+"""
+dossier.py — Evangelista & Co.
+Expediente tipado del lead (LeadDossier).
+
+Antes el expediente era un dict libre: `updated[k] = v` con lo que devolviera el
+Perfilador (claves inventadas, "c-level" en minúsculas, "true" como cadena,
+`contacto` a veces dict), volcado tal cual en dos prompts, en la respuesta al
+cliente y en la fila de Sheets. Ahora:
+
+  - Los campos son fijos (dataclass con __slots__) y las dimensiones del
+    catálogo de PROMPT_SCRIBE son enums. Un valor fuera de catálogo no entra al
+    expediente: se conserva el anterior y se cuenta en
+    `evangelista_dossier_rejected_total{field}`.
+  - `merge` aplica la salida del Perfilador con coerción de tipos; `null` no
+    borra un dato ya capturado.
+  - `diff` compara campo por campo (modo especulativo, trazas).
+  - `compact` es la codificación para prompts y sesiones: omite nulos y valores
+    por defecto y el razonamiento interno del Perfilador.
+  - `to_dict` es la forma completa para el cliente.
+"""
+
+import json
+from dataclasses import dataclass, fields, replace
+from enum import Enum
+from typing import Dict, Iterable, Optional, Tuple
+
+from metrics import REGISTRY
+
+DOSSIER_REJECTED = REGISTRY.counter(
+    "evangelista_dossier_rejected_total",
+    "Valores del Perfilador descartados al validar el expediente.", ("field",))
+
+MAX_TEXT_CHARS = 300
+
+
+# ==============================================================================
+# CATÁLOGO (PROMPT_SCRIBE — CATÁLOGO DE DIMENSIONES)
+# ==============================================================================
+
+class Driver(str, Enum):
+    RESCATE_FORENSE             = "RESCATE_FORENSE"
+    ESCALABILIDAD_INSTITUCIONAL = "ESCALABILIDAD_INSTITUCIONAL"
+    ACOMPANAMIENTO_DIRECTIVO    = "ACOMPAÑAMIENTO_DIRECTIVO"
+    INDEFINIDO                  = "INDEFINIDO"
+
+
+class Authority(str, Enum):
+    C_LEVEL     = "C_LEVEL"
+    GERENCIA    = "GERENCIA"
+    OPERATIVO   = "OPERATIVO"
+    DESCONOCIDO = "DESCONOCIDO"
+
+
+class Stack(str, Enum):
+    EXCEL            = "EXCEL"
+    ERP_LEGACY       = "ERP_LEGACY"
+    NUBE_DESCONECTADA = "NUBE_DESCONECTADA"
+    DESCONOCIDO      = "DESCONOCIDO"
+
+
+class Node(str, Enum):
+    VENTAS_INGRESOS      = "VENTAS_INGRESOS"
+    ALMACEN_INVENTARIO   = "ALMACEN_INVENTARIO"
+    COMPRAS_COSTOS       = "COMPRAS_COSTOS"
+    PRODUCCION_LOGISTICA = "PRODUCCION_LOGISTICA"
+    FINANZAS_GOBERNANZA  = "FINANZAS_GOBERNANZA"
+    INDEFINIDO           = "INDEFINIDO"
+
+
+ENUM_FIELDS = {
+    "driver_estrategico":  Driver,
+    "autoridad_detectada": Authority,
+    "stack_tecnologico":   Stack,
+    "nodo_critico":        Node,
+}
+TEXT_FIELDS = ("empresa", "dolor_declarado", "motivo_red_flag", "contacto", "analisis_forense")
+BOOL_FIELDS = ("red_flags", "presupuesto_validado")
+
+# Claves externas (JSON del Perfilador / cliente) → atributo
+ALIASES = {"_analisis_forense": "analisis_forense"}
+# Razonamiento interno: viaja al cliente pero no a los prompts ni a la sesión
+INTERNAL_FIELDS = ("analisis_forense",)
+
+_TRUE  = {"true", "si", "sí", "yes", "1"}
+_FALSE = {"false", "no", "0"}
+
+
+def _enum_value(enum, value):
+    if isinstance(value, enum):
+        return value
+    key = str(value).strip().upper().replace("-", "_").replace(" ", "_")
+    try:
+        return enum(key)
+    except ValueError:
+        return enum.__members__.get(key)
+
+
+def _bool_value(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    return None
+
+
+def _text_value(value):
+    if isinstance(value, dict):         # legado: {"email_detectado": ..., ...}
+        value = ", ".join(str(v) for v in value.values() if v)
+    elif isinstance(value, (list, tuple)):
+        value = ", ".join(str(v) for v in value if v)
+    text = str(value).strip()
+    return text[:MAX_TEXT_CHARS] or None
+
+
+COERCE = {
+    **{name: (lambda v, enum=enum: _enum_value(enum, v)) for name, enum in ENUM_FIELDS.items()},
+    **{name: _bool_value for name in BOOL_FIELDS},
+    **{name: _text_value for name in TEXT_FIELDS},
+}
+
+
+# ==============================================================================
+# EXPEDIENTE
+# ==============================================================================
+
+@dataclass(slots=True)
+class LeadDossier:
+    empresa:              Optional[str]  = None
+    dolor_declarado:      Optional[str]  = None
+    driver_estrategico:   Driver         = Driver.INDEFINIDO
+    autoridad_detectada:  Authority      = Authority.DESCONOCIDO
+    stack_tecnologico:    Stack          = Stack.DESCONOCIDO
+    nodo_critico:         Node           = Node.INDEFINIDO
+    red_flags:            bool           = False
+    motivo_red_flag:      Optional[str]  = None
+    presupuesto_validado: Optional[bool] = None
+    contacto:             Optional[str]  = None
+    analisis_forense:     Optional[str]  = None
+
+    # --------------------------------------------------------------------------
+    # Construcción y fusión
+    # --------------------------------------------------------------------------
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "LeadDossier":
+        """Expediente desde la sesión o el `lead_data` legado del cliente."""
+        return cls().merge(data or {}, count_rejected=False)
+
+    def merge(self, data: dict, count_rejected: bool = True) -> "LeadDossier":
+        """
+        Nuevo expediente con `data` aplicado encima. `null` no borra datos; una
+        clave desconocida o un valor fuera de catálogo se descarta.
+        """
+        changes = {}
+        for key, value in data.items():
+            if value is None or value == "":
+                continue
+            name   = ALIASES.get(key, key)
+            coerce = COERCE.get(name)
+            parsed = coerce(value) if coerce else None
+            if parsed is None:
+                if count_rejected:
+                    DOSSIER_REJECTED.inc(name if coerce else "_unknown")
+                continue
+            changes[name] = parsed
+        return replace(self, **changes) if changes else self
+
+    def copy(self) -> "LeadDossier":
+        return replace(self)
+
+    # --------------------------------------------------------------------------
+    # Comparación
+    # --------------------------------------------------------------------------
+
+    def diff(self, other: "LeadDossier", names: Iterable[str] = None) -> Dict[str, Tuple]:
+        """{campo: (valor en other, valor aquí)} de los campos que difieren."""
+        names = names or FIELD_NAMES
+        return {
+            name: (getattr(other, name), getattr(self, name))
+            for name in names if getattr(self, name) != getattr(other, name)
+        }
+
+    # --------------------------------------------------------------------------
+    # Serialización
+    # --------------------------------------------------------------------------
+
+    def to_dict(self) -> dict:
+        """Forma completa (respuesta al cliente)."""
+        data = {name: _plain(getattr(self, name)) for name in FIELD_NAMES}
+        data["_analisis_forense"] = data.pop("analisis_forense")
+        return data
+
+    def compact(self) -> dict:
+        """Sólo lo que aporta: sin nulos, sin defaults, sin razonamiento interno."""
+        return {
+            name: _plain(value)
+            for name, default in DEFAULTS
+            if (value := getattr(self, name)) is not None and value != default
+        }
+
+    def encode(self) -> str:
+        """`compact` en JSON mínimo para prompts y claves de caché."""
+        return json.dumps(self.compact(), ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+def _plain(value):
+    return value.value if isinstance(value, Enum) else value
+
+
+FIELD_NAMES = tuple(f.name for f in fields(LeadDossier))
+DEFAULTS    = tuple(
+    (f.name, f.default) for f in fields(LeadDossier) if f.name not in INTERNAL_FIELDS
+)
@@ -0,0 +1,146 @@
+"""
+fewshot.py — Evangelista & Co.
+Banco de ejemplos few-shot del Perfilador con selección por similitud.
+
+Antes PROMPT_SCRIBE llevaba todos sus casos resueltos (la textilera con SAP,
+Transportes Veloz, Constructora Zenith…) completos en cada llamada, tratara el
+mensaje de lo que tratara, y el modo fusionado los heredaba. Ahora los casos viven
+estructurados en `prompts.SCRIBE_EXAMPLES` y al slot {examples} sólo entran los
+FEWSHOT_K más parecidos al turno:
+
+  - Texto: BM25 (el índice de knowledge.py) entre el mensaje del prospecto y el
+    título + contexto + mensaje de cada caso, normalizado contra el mejor.
+  - Estado: Jaccard entre los rasgos del expediente actual (`campo=valor` de
+    catálogo, `campo=*` para texto ya capturado) y los del expediente previo del
+    caso; un primer turno se parece a los casos de primer turno y un turno con
+    precio anclado, a los de validación de presupuesto.
+  - Puntaje = texto + FEWSHOT_STATE_WEIGHT × estado; los empates respetan el
+    orden del banco. Siempre entra al menos un caso: también enseña el formato.
+
+La selección es función de (mensaje, expediente), igual que la clave del caché del
+Perfilador; `digest` entra en la huella de ese caché para invalidarlo si cambia el
+banco o la política. FEWSHOT=dynamic (por defecto) | all (todos, como antes) | off.
+Comparación de tokens, latencia y exactitud: python bench_fewshot.py.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import FrozenSet, List, Sequence, Tuple
+
+from dossier import BOOL_FIELDS, ENUM_FIELDS, LeadDossier
+from knowledge import KnowledgeIndex
+from metrics import REGISTRY, current_trace
+from prompts import SCRIBE_EXAMPLES
+
+FEWSHOT_SELECTED = REGISTRY.counter(
+    "evangelista_fewshot_examples_total", "Ejemplos few-shot enviados al Perfilador.", ("example",))
+
+MODES = ("dynamic", "all", "off")
+
+
+@dataclass(frozen=True)
+class Example:
+    id:      str
+    title:   str
+    context: str
+    message: str
+    output:  dict
+    state:   dict = field(default_factory=dict)
+
+    def render(self, number: int) -> str:
+        return (
+            f"EJEMPLO {number} — {self.title}\n{self.context}\n"
+            f"Usuario: \"{self.message}\"\nSalida esperada:\n"
+            + json.dumps(self.output, ensure_ascii=False, indent=2)
+        )
+
+
+def features(dossier: dict) -> FrozenSet[str]:
+    """Rasgos comparables de un expediente compacto (sin razonamiento interno)."""
+    feats = set()
+    for name, value in dossier.items():
+        if name.startswith("_") or name == "analisis_forense" or value is None:
+            continue
+        if name in ENUM_FIELDS or name in BOOL_FIELDS:
+            feats.add(f"{name}={value}")
+        else:
+            feats.add(f"{name}=*")
+    return frozenset(feats)
+
+
+class ExampleBank:
+    def __init__(self, examples: Sequence[Example], mode: str = "dynamic", k: int = 2,
+                 state_weight: float = 0.5):
+        if mode not in MODES:
+            raise ValueError(f"FEWSHOT={mode!r}: usa uno de {MODES}")
+        self.examples     = list(examples)
+        self.mode         = mode
+        self.k            = max(1, k)
+        self.state_weight = state_weight
+        self.index = KnowledgeIndex.build(
+            [(e.title, f"{e.context} {e.message}") for e in self.examples],
+            top_k=len(self.examples), min_score=0.0,
+        )
+        self._features = [features(LeadDossier.from_dict(e.state).compact()) for e in self.examples]
+        payload = json.dumps([e.__dict__ for e in self.examples], ensure_ascii=False, sort_keys=True)
+        self.digest = hashlib.sha256(
+            f"{mode}:{self.k}:{state_weight}:{payload}".encode("utf-8")
+        ).hexdigest()[:16]
+        self._cached = lru_cache(maxsize=1024)(self._select)
+
+    @classmethod
+    def from_dicts(cls, entries: Sequence[dict], **options) -> "ExampleBank":
+        return cls([Example(**entry) for entry in entries], **options)
+
+    def select(self, message: str, dossier: dict) -> List[str]:
+        """Ejemplos renderizados para el slot {examples}, del más al menos parecido."""
+        if self.mode == "off" or not self.examples:
+            return []
+        if self.mode == "all":
+            ids = tuple(range(len(self.examples)))
+        else:
+            ids = self._cached(message, features(dossier))
+        for i in ids:
+            FEWSHOT_SELECTED.inc(self.examples[i].id)
+        trace = current_trace()
+        if trace:
+            trace.extra["fewshot"] = [self.examples[i].id for i in ids]
+        return [self.examples[i].render(n) for n, i in enumerate(ids, 1)]
+
+    def scores(self, message: str, feats: FrozenSet[str]) -> List[float]:
+        text = {chunk.id: score for score, chunk in self.index.search(message, k=len(self.examples))}
+        best = max(text.values(), default=0.0) or 1.0
+        scored = []
+        for i, example_feats in enumerate(self._features):
+            union = feats | example_feats
+            state = len(feats & example_feats) / len(union) if union else 1.0
+            scored.append(text.get(i, 0.0) / best + self.state_weight * state)
+        return scored
+
+    def _select(self, message: str, feats: FrozenSet[str]) -> Tuple[int, ...]:
+        scored = self.scores(message, feats)
+        return tuple(sorted(range(len(scored)), key=lambda i: (-scored[i], i))[:self.k])
+
+    def stats(self) -> dict:
+        info = self._cached.cache_info()
+        return {
+            "mode":       self.mode,
+            "examples":   len(self.examples),
+            "k":          self.k,
+            "cache_hits": info.hits,
+        }
+
+
+def build_example_bank() -> ExampleBank:
+    """FEWSHOT=dynamic | all | off; FEWSHOT_K=2; FEWSHOT_STATE_WEIGHT=0.5."""
+    bank = ExampleBank.from_dicts(
+        SCRIBE_EXAMPLES,
+        mode=os.getenv("FEWSHOT", "dynamic").lower(),
+        k=int(os.getenv("FEWSHOT_K", "2")),
+        state_weight=float(os.getenv("FEWSHOT_STATE_WEIGHT", "0.5")),
+    )
+    print(f"--- FEW-SHOT: {len(bank.examples)} casos ({bank.mode}, k={bank.k}) ---")
+    return bank
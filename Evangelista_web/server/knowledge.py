@@ -0,0 +1,320 @@
+"""
+knowledge.py — Evangelista & Co.
+Base de conocimiento recuperable (BM25) para el Estratega y el Vocero.
+
+Antes, la única forma de darle datos firmes a los agentes era escribirlos en
+prompts.py, y cada dato nuevo engordaba TODAS las peticiones. Ahora el corpus
+vive en `data:/knowledge.txt` y a cada prompt sólo entran los fragmentos
+relevantes para el mensaje actual, con un tope de tokens: el corpus puede crecer
+a miles de entradas sin que crezca el prompt.
+
+Formato del corpus (texto plano, UTF-8):
+  - Una línea `# Título` abre una sección; el título acompaña a sus fragmentos.
+  - Los párrafos (separados por línea en blanco) son las entradas. Un párrafo de
+    más de CHUNK_WORDS palabras se parte por oraciones.
+
+Índice:
+  - Invertido en memoria (término → [(fragmento, tf)]) con BM25 (k1=1.2, b=0.75).
+    El aporte BM25 de cada par término-fragmento se precalcula al cargar y cada
+    lista se ordena por aporte: una búsqueda sólo suma pesos de los términos del
+    mensaje y recorre a lo más `depth` entradas por término, así su costo no
+    crece con el corpus (los términos comunes aportan poco en su cola).
+  - Tokens sin acentos, en minúsculas, sin palabras vacías y con un plural
+    ingenuo recortado ("reportes" → "reporte").
+  - Se persiste en SQLite (KNOWLEDGE_INDEX_PATH) junto con el hash del corpus;
+    al arrancar se recarga si el corpus no cambió y se reconstruye si cambió.
+"""
+
+import hashlib
+import heapq
+import math
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+from prompt_budget import estimate_tokens
+
+KNOWLEDGE_LOOKUPS = REGISTRY.counter(
+    "evangelista_knowledge_lookups_total",
+    "Búsquedas en la base de conocimiento por resultado (hit, empty).", ("result",))
+KNOWLEDGE_CHUNKS = REGISTRY.gauge(
+    "evangelista_knowledge_chunks", "Fragmentos indexados en la base de conocimiento.")
+
+INDEX_VERSION = "1"          # cambia si cambia el tokenizador o el troceo
+CHUNK_WORDS   = 80
+K1, B         = 1.2, 0.75
+
+# Texto del slot {knowledge} cuando no hay nada pertinente
+EMPTY = "(sin fragmentos relevantes)"
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "..", "data:", "knowledge.txt")
+
+_WORD_RE     = re.compile(r"[a-z0-9]+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?;])\s+")
+_STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun con contra
+cual cuales cuando de del desde donde dos el ella ellas ellos en entre era eran es
+esa esas ese eso esos esta estan estas este esto estos fue fueron ha han hasta hay
+hola la las le les lo los mas me mi mis mucho muy ni no nos nuestra nuestro o os
+otra otro para pero poco por porque que quien se sea ser si sin sobre son su sus
+tambien te tiene tienen todo todos tu tus un una unas uno unos usted ustedes y ya yo
+the and of to in is for on with
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Términos normalizados del texto (mismo criterio para corpus y consultas)."""
+    text  = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode()
+    terms = []
+    for word in _WORD_RE.findall(text):
+        if len(word) < 2 or word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+@dataclass(frozen=True)
+class Chunk:
+    id:     int
+    title:  str
+    text:   str
+    tokens: int      # costo estimado en el prompt
+
+    def render(self) -> str:
+        return f"- [{self.title}] {self.text}" if self.title else f"- {self.text}"
+
+
+def split_corpus(text: str, chunk_words: int = CHUNK_WORDS) -> List[Tuple[str, str]]:
+    """[(título, texto)] a partir del corpus en bruto."""
+    entries = []
+    title   = ""
+    for block in re.split(r"\n\s*\n", text):
+        lines = []
+        for line in block.strip().splitlines():
+            if line.startswith("# "):
+                title = line[2:].strip()
+            elif line.strip():
+                lines.append(line.strip())
+        if not lines:
+            continue
+        words = " ".join(lines).split()
+        if len(words) <= chunk_words:
+            entries.append((title, " ".join(words)))
+            continue
+        current: List[str] = []
+        for sentence in _SENTENCE_RE.split(" ".join(words)):
+            sentence_words = sentence.split()
+            if current and len(current) + len(sentence_words) > chunk_words:
+                entries.append((title, " ".join(current)))
+                current = []
+            # Una oración más larga que el fragmento se corta por palabras
+            while len(sentence_words) > chunk_words:
+                entries.append((title, " ".join(sentence_words[:chunk_words])))
+                sentence_words = sentence_words[chunk_words:]
+            current.extend(sentence_words)
+        if current:
+            entries.append((title, " ".join(current)))
+    return entries
+
+
+# ==============================================================================
+# ÍNDICE
+# ==============================================================================
+
+class KnowledgeIndex:
+    def __init__(self, chunks: List[Chunk], postings: Dict[str, List[Tuple[int, int]]],
+                 lengths: List[int], digest: str = "", top_k: int = 3,
+                 max_tokens: int = 350, min_score: float = 1.0, depth: int = 1000):
+        self.chunks     = chunks
+        self.postings   = postings
+        self.digest     = digest
+        self.top_k      = top_k
+        self.max_tokens = max_tokens
+        self.min_score  = min_score
+        self.depth      = depth
+        self.source     = "built"
+
+        n     = len(chunks)
+        avgdl = (sum(lengths) / n) if n else 1.0
+        # Lo que no depende de la consulta se calcula una vez: término → (docs, pesos)
+        norm = [K1 * (1 - B + B * length / avgdl) for length in lengths]
+        self._impacts: Dict[str, Tuple[List[int], List[float]]] = {}
+        for term, docs in postings.items():
+            idf    = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            ranked = sorted(
+                ((doc, idf * tf * (K1 + 1) / (tf + norm[doc])) for doc, tf in docs),
+                key=lambda item: item[1], reverse=True,
+            )
+            self._impacts[term] = ([doc for doc, _ in ranked], [w for _, w in ranked])
+        # Estratega y Vocero consultan el mismo mensaje en el mismo turno
+        self._cached = lru_cache(maxsize=1024)(self._select)
+
+    @classmethod
+    def build(cls, entries: List[Tuple[str, str]], digest: str = "", **options) -> "KnowledgeIndex":
+        chunks, lengths = [], []
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc, (title, text) in enumerate(entries):
+            terms = tokenize(f"{title} {text}")
+            counts: Dict[str, int] = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc, tf))
+            chunk = Chunk(doc, title, text, 0)
+            chunks.append(replace(chunk, tokens=estimate_tokens(chunk.render())))
+            lengths.append(len(terms))
+        return cls(chunks, postings, lengths, digest, **options)
+
+    # --------------------------------------------------------------------------
+    # Consulta
+    # --------------------------------------------------------------------------
+
+    def search(self, query: str, k: Optional[int] = None) -> List[Tuple[float, Chunk]]:
+        """Los `k` fragmentos con mayor BM25 por encima de `min_score`."""
+        scores: Dict[int, float] = {}
+        get = scores.get
+        for term in set(tokenize(query)):
+            impacts = self._impacts.get(term)
+            if not impacts:
+                continue
+            docs, weights = impacts
+            for doc, weight in zip(islice(docs, self.depth), weights):
+                scores[doc] = get(doc, 0.0) + weight
+        best = heapq.nlargest(k or self.top_k, scores.items(), key=lambda item: item[1])
+        return [(score, self.chunks[doc]) for doc, score in best if score >= self.min_score]
+
+    def retrieve(self, query: str) -> Tuple[Tuple[int, ...], str]:
+        """(ids, texto para el slot {knowledge}) respetando `max_tokens`."""
+        ids, text = self._cached(query)
+        KNOWLEDGE_LOOKUPS.inc("hit" if ids else "empty")
+        return ids, text
+
+    def _select(self, query: str) -> Tuple[Tuple[int, ...], str]:
+        lines, ids, used = [], [], 0
+        for _, chunk in self.search(query):
+            if used + chunk.tokens > self.max_tokens:
+                continue
+            lines.append(chunk.render())
+            ids.append(chunk.id)
+            used += chunk.tokens
+        return tuple(ids), "\n".join(lines) or EMPTY
+
+    # --------------------------------------------------------------------------
+    # Persistencia
+    # --------------------------------------------------------------------------
+
+    def save(self, path: str) -> None:
+        conn = sqlite3.connect(path)
+        try:
+            with conn:
+                conn.executescript(
+                    "DROP TABLE IF EXISTS meta; DROP TABLE IF EXISTS chunks;"
+                    " DROP TABLE IF EXISTS postings;"
+                    " CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+                    " CREATE TABLE chunks (id INTEGER PRIMARY KEY, title TEXT NOT NULL,"
+                    "  text TEXT NOT NULL, tokens INTEGER NOT NULL, length INTEGER NOT NULL);"
+                    " CREATE TABLE postings (term TEXT NOT NULL, doc INTEGER NOT NULL,"
+                    "  tf INTEGER NOT NULL);"
+                )
+                lengths = [0] * len(self.chunks)
+                for docs in self.postings.values():
+                    for doc, tf in docs:
+                        lengths[doc] += tf
+                conn.execute("INSERT INTO meta VALUES ('digest', ?)", (self.digest,))
+                conn.executemany(
+                    "INSERT INTO chunks VALUES (?, ?, ?, ?, ?)",
+                    [(c.id, c.title, c.text, c.tokens, lengths[c.id]) for c in self.chunks],
+                )
+                conn.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?)",
+                    [(term, doc, tf) for term, docs in self.postings.items() for doc, tf in docs],
+                )
+        finally:
+            conn.close()
+
+    @classmethod
+    def load(cls, path: str, digest: str, **options) -> Optional["KnowledgeIndex"]:
+        """Índice persistido si corresponde a `digest`; None si falta o está viejo."""
+        if not os.path.exists(path):
+            return None
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'digest'").fetchone()
+            if not row or row[0] != digest:
+                return None
+            chunks, lengths = [], []
+            for doc, title, text, tokens, length in conn.execute(
+                "SELECT id, title, text, tokens, length FROM chunks ORDER BY id"
+            ):
+                chunks.append(Chunk(doc, title, text, tokens))
+                lengths.append(length)
+            postings: Dict[str, List[Tuple[int, int]]] = {}
+            for term, doc, tf in conn.execute("SELECT term, doc, tf FROM postings ORDER BY rowid"):
+                postings.setdefault(term, []).append((doc, tf))
+        except sqlite3.DatabaseError:
+            return None
+        finally:
+            conn.close()
+        index = cls(chunks, postings, lengths, digest, **options)
+        index.source = "loaded"
+        return index
+
+    def stats(self) -> dict:
+        info = self._cached.cache_info()
+        return {
+            "chunks":     len(self.chunks),
+            "terms":      len(self.postings),
+            "source":     self.source,
+            "top_k":      self.top_k,
+            "max_tokens": self.max_tokens,
+            "cache_hits": info.hits,
+        }
+
+
+def build_knowledge() -> Optional[KnowledgeIndex]:
+    """
+    KNOWLEDGE=on (por defecto) | off. Corpus en KNOWLEDGE_PATH; índice persistido
+    en KNOWLEDGE_INDEX_PATH (vacío = sólo en memoria).
+    """
+    if os.getenv("KNOWLEDGE", "on").lower() == "off":
+        return None
+    corpus_path = os.getenv("KNOWLEDGE_PATH", DEFAULT_CORPUS)
+    index_path  = os.getenv("KNOWLEDGE_INDEX_PATH", "knowledge_index.db")
+    options = {
+        "top_k":      int(os.getenv("KNOWLEDGE_TOP_K", "3")),
+        "max_tokens": int(os.getenv("KNOWLEDGE_MAX_TOKENS", "350")),
+        "min_score":  float(os.getenv("KNOWLEDGE_MIN_SCORE", "1.0")),
+        "depth":      int(os.getenv("KNOWLEDGE_POSTINGS_DEPTH", "1000")),
+    }
+    started = time.perf_counter()
+    try:
+        with open(corpus_path, "rb") as fh:
+            raw = fh.read()
+    except OSError as e:
+        print(f"--- CONOCIMIENTO: corpus no disponible ({e}) ---")
+        raw = b""
+    digest = hashlib.sha256(
+        f"{INDEX_VERSION}:{CHUNK_WORDS}:".encode() + raw
+    ).hexdigest()
+
+    index = KnowledgeIndex.load(index_path, digest, **options) if index_path else None
+    if index is None:
+        index = KnowledgeIndex.build(split_corpus(raw.decode("utf-8", "replace")), digest, **options)
+        if index_path and index.chunks:
+            try:
+                index.save(index_path)
+            except sqlite3.DatabaseError as e:
+                print(f"Error guardando índice de conocimiento: {e}")
+    KNOWLEDGE_CHUNKS.set(value=len(index.chunks))
+    print(f"--- CONOCIMIENTO: {len(index.chunks)} fragmentos ({index.source}, "
+          f"{(time.perf_counter() - started) * 1000:.0f} ms) ---")
+    return index
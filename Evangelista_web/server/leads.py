@@ -0,0 +1,110 @@
+"""
+leads.py — Evangelista & Co.
+Índice de deduplicación para las filas de DB_Leads_Evangelista.
+
+Antes cada evento (contacto rescatado, agenda desbloqueada, fallo crítico) añadía
+una fila nueva: un mismo prospecto terminaba repartido en varias. Ahora cada fila
+lleva en la columna I sus claves de lead:
+
+    session:<id>|ana@zenith.mx|+525512345678
+
+y este índice (clave → número de fila) permite a SheetsWriter actualizar la fila
+existente en lugar de anexar otra. El índice vive en memoria y se calienta con
+una sola lectura de la hoja al conectar, así que sobrevive reinicios del worker.
+
+Fusión: un evento de menor rango (CALIFICADO > CONTACTO_RESCATADO > ERROR) no
+modifica la fila; uno de igual o mayor rango la actualiza, pero una celda vacía o
+"N/A" nunca pisa un dato ya capturado. Una fila de ERROR se reemplaza completa
+cuando llegan datos reales del lead.
+"""
+
+import re
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from contacts import extract_contacts
+
+KEY_COLUMN    = 9       # columna I
+TAG_COLUMN    = 6       # índice 0-based de la etiqueta (columna G)
+KEY_SEPARATOR = "|"
+EMPTY_CELLS   = ("", "N/A", "Error")
+TAG_PRIORITY  = {"ERROR": 0, "CONTACTO_RESCATADO": 1, "CALIFICADO": 2}
+
+_RANGE_START_RE = re.compile(r"![A-Z]+(\d+)")
+
+
+def lead_keys(session_id: Optional[str], memory) -> List[str]:
+    """Claves normalizadas del lead: sesión + cada correo/teléfono del expediente (LeadDossier)."""
+    keys = [f"session:{session_id}"] if session_id else []
+    if memory is not None and memory.contacto:
+        keys.extend(match.value for match in extract_contacts(memory.contacto))
+    return list(dict.fromkeys(keys))
+
+
+def merge_rows(current: list, new: list) -> list:
+    """Fila resultante de aplicar `new` sobre `current`."""
+    width  = max(len(current), len(new))
+    current = list(current) + [""] * (width - len(current))
+    new     = list(new) + [""] * (width - len(new))
+    old_tag = TAG_PRIORITY.get(current[TAG_COLUMN], -1)
+    new_tag = TAG_PRIORITY.get(new[TAG_COLUMN], -1)
+    if new_tag < old_tag:
+        return current      # un evento de menor rango no toca una fila más avanzada
+    if old_tag == TAG_PRIORITY["ERROR"] and new_tag > old_tag:
+        return new          # la fila de fallo sólo traía diagnóstico, no datos del lead
+    return [old if str(cell) in EMPTY_CELLS else cell for old, cell in zip(current, new)]
+
+
+def appended_start_row(response) -> Optional[int]:
+    """Primera fila escrita por append_rows (de `updates.updatedRange`)."""
+    try:
+        match = _RANGE_START_RE.search(response["updates"]["updatedRange"])
+    except (KeyError, TypeError):
+        return None
+    return int(match.group(1)) if match else None
+
+
+class LeadIndex:
+    """Clave de lead → (fila, valores). Lo usa sólo el hilo de SheetsWriter."""
+
+    def __init__(self):
+        self._rows: Dict[str, int]    = {}
+        self._values: Dict[int, list] = {}
+        self._lock = threading.Lock()
+        self.warmed = False
+
+    def warm(self, sheet) -> int:
+        """Carga claves y valores existentes con una sola lectura de la hoja."""
+        rows = sheet.get_all_values()
+        with self._lock:
+            for number, values in enumerate(rows, start=1):
+                if len(values) < KEY_COLUMN or not values[KEY_COLUMN - 1]:
+                    continue
+                self._remember(values[KEY_COLUMN - 1].split(KEY_SEPARATOR), number, values)
+            self.warmed = True
+        print(f"--- ÍNDICE DE LEADS: {len(self._values)} filas ---")
+        return len(self._values)
+
+    def lookup(self, keys: Iterable[str]) -> Optional[int]:
+        with self._lock:
+            for key in keys:
+                if key in self._rows:
+                    return self._rows[key]
+        return None
+
+    def values(self, number: int) -> list:
+        with self._lock:
+            return list(self._values.get(number, []))
+
+    def remember(self, keys: Iterable[str], number: int, values: list) -> None:
+        with self._lock:
+            self._remember(keys, number, values)
+
+    def _remember(self, keys: Iterable[str], number: int, values: list) -> None:
+        for key in keys:
+            if key:
+                self._rows[key] = number
+        self._values[number] = list(values)
+
+    def __len__(self) -> int:
+        return len(self._values)
@@ -0,0 +1,353 @@
+"""
+llm.py — Evangelista & Co.
+Capa de proveedores LLM para los tres agentes.
+
+Cada agente (scribe, strategist, voice) tiene su propio modelo y temperatura,
+configurables por variables de entorno sin tocar código:
+
+    SCRIBE_MODEL=llama-3.1-8b-instant
+    VOICE_TEMPERATURE=0.5
+
+Proveedores:
+  - GroqProvider: producción (AsyncGroq).
+  - FakeProvider: determinista, en proceso y sin red. Latencias configurables y
+    JSON enlatado para Perfilador y Estratega. Pensado para benchmarks y pruebas
+    de carga de la app FastAPI.
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional
+
+from metrics import current_trace, observe_stage
+
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+AGENTS        = ("scribe", "strategist", "voice", "fused")
+
+
+# ==============================================================================
+# CONFIGURACIÓN POR AGENTE
+# ==============================================================================
+
+@dataclass
+class AgentConfig:
+    model:       str
+    temperature: float
+    json_mode:   bool
+
+
+AGENT_DEFAULTS = {
+    "scribe":     AgentConfig(DEFAULT_MODEL, 0.0, True),
+    "strategist": AgentConfig(DEFAULT_MODEL, 0.2, True),
+    "voice":      AgentConfig(DEFAULT_MODEL, 0.6, False),
+    "fused":      AgentConfig(DEFAULT_MODEL, 0.1, True),    # Perfilador + Estratega (PIPELINE_MODE=fused)
+}
+
+
+def load_agent_configs() -> Dict[str, AgentConfig]:
+    """Aplica overrides <AGENTE>_MODEL / <AGENTE>_TEMPERATURE sobre los defaults."""
+    configs = {}
+    for agent, default in AGENT_DEFAULTS.items():
+        prefix = agent.upper()
+        configs[agent] = AgentConfig(
+            model=os.getenv(f"{prefix}_MODEL", os.getenv("LLM_MODEL", default.model)),
+            temperature=float(os.getenv(f"{prefix}_TEMPERATURE", default.temperature)),
+            json_mode=default.json_mode,
+        )
+    return configs
+
+
+@dataclass
+class LLMResult:
+    content:           str
+    model:             str
+    prompt_tokens:     int = 0
+    completion_tokens: int = 0
+    fallback:          bool = False    # respondió el modelo de respaldo (breaker abierto)
+
+
+@dataclass
+class StreamUsage:
+    """Tokens de un stream: el proveedor de adentro los reporta al terminar."""
+    prompt_tokens:     int = 0
+    completion_tokens: int = 0
+
+
+# Los streams sólo emiten texto y pasan por varias capas (admisión, resiliencia,
+# casete); el uso viaja aparte, en el contador que abrió InstrumentedProvider.
+_stream_usage: ContextVar[Optional[StreamUsage]] = ContextVar("stream_usage", default=None)
+
+
+def report_stream_usage(prompt_tokens: int, completion_tokens: int) -> None:
+    """Lo llama el proveedor real al final de un stream."""
+    usage = _stream_usage.get()
+    if usage is not None:
+        usage.prompt_tokens     += prompt_tokens
+        usage.completion_tokens += completion_tokens
+
+
+# ==============================================================================
+# PROVEEDORES
+# ==============================================================================
+
+class LLMProvider:
+    """Interfaz común: una completion entera o un stream de tokens."""
+
+    name = "base"
+
+    def __init__(self, configs: Optional[Dict[str, AgentConfig]] = None):
+        self.configs = configs or load_agent_configs()
+
+    async def complete(self, agent: str, messages: list, model: Optional[str] = None) -> LLMResult:
+        """`model` reemplaza al modelo configurado del agente (modelo de respaldo)."""
+        raise NotImplementedError
+
+    def stream(self, agent: str, messages: list, model: Optional[str] = None) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+
+class GroqProvider(LLMProvider):
+    name = "groq"
+
+    def __init__(self, api_key: str, configs: Optional[Dict[str, AgentConfig]] = None,
+                 max_retries: int = 2):
+        super().__init__(configs)
+        self.api_key     = api_key
+        self.max_retries = max_retries     # 0 cuando ResilientProvider gestiona los reintentos
+        self._client     = None
+
+    @property
+    def client(self):
+        """AsyncGroq se crea en la primera llamada, no al importar."""
+        if self._client is None:
+            from groq import AsyncGroq
+            self._client = AsyncGroq(api_key=self.api_key, max_retries=self.max_retries)
+        return self._client
+
+    def _params(self, agent: str, messages: list, model: Optional[str] = None) -> dict:
+        cfg    = self.configs[agent]
+        params = {"model": model or cfg.model, "messages": messages, "temperature": cfg.temperature}
+        if cfg.json_mode:
+            params["response_format"] = {"type": "json_object"}
+        return params
+
+    async def complete(self, agent: str, messages: list, model: Optional[str] = None) -> LLMResult:
+        comp  = await self.client.chat.completions.create(**self._params(agent, messages, model))
+        usage = getattr(comp, "usage", None)
+        return LLMResult(
+            content=comp.choices[0].message.content,
+            model=model or self.configs[agent].model,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        )
+
+    async def stream(self, agent: str, messages: list, model: Optional[str] = None) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            **self._params(agent, messages, model), stream=True,
+            extra_body={"stream_options": {"include_usage": True}},
+        )
+        usage = None
+        async for chunk in stream:
+            # El último chunk trae el uso (`usage`, o `x_groq.usage` en Groq)
+            usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+        if usage is not None:
+            report_stream_usage(usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+
+@dataclass
+class LatencyModel:
+    """Latencia log-normal: mediana en ms y dispersión sigma (0 = constante)."""
+    median_ms: float = 0.0
+    sigma:     float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.median_ms / 1000
+        return rng.lognormvariate(math.log(self.median_ms), self.sigma) / 1000
+
+
+FAKE_RESPONSES = {
+    "scribe": {
+        "_analisis_forense": "FAKE: expediente sin cambios relevantes.",
+        "empresa": None,
+        "dolor_declarado": None,
+        "driver_estrategico": "INDEFINIDO",
+        "autoridad_detectada": "DESCONOCIDO",
+        "stack_tecnologico": "DESCONOCIDO",
+        "nodo_critico": "INDEFINIDO",
+        "red_flags": False,
+        "motivo_red_flag": None,
+        "presupuesto_validado": None,
+    },
+    "strategist": {
+        "analisis_estrategico": "FAKE: Camino B, Regla 3.",
+        "tactic": "INVESTIGATE_DEEP",
+        "instructions_for_voice": "Pregunta por el nombre de la firma y el nodo de pérdida.",
+    },
+    "fused": {
+        "dossier": {
+            "_analisis_forense": "FAKE: expediente sin cambios relevantes.",
+            "driver_estrategico": "INDEFINIDO",
+            "autoridad_detectada": "DESCONOCIDO",
+            "stack_tecnologico": "DESCONOCIDO",
+            "nodo_critico": "INDEFINIDO",
+            "red_flags": False,
+        },
+        "analisis_estrategico": "FAKE: Camino B, Regla 3.",
+        "tactic": "INVESTIGATE_DEEP",
+        "instructions_for_voice": "Pregunta por el nombre de la firma y el nodo de pérdida.",
+    },
+    "voice": (
+        "Esa falta de confianza en reportes es uno de los síntomas más costosos que vemos. "
+        "¿Qué área de su operación concentra hoy la mayor fuga de capital?"
+    ),
+}
+
+
+class FakeProvider(LLMProvider):
+    """
+    Proveedor determinista sin red. `responses` admite, por agente, un valor fijo
+    (dict → JSON, str → texto) o un callable(messages) que devuelva ese valor.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        configs: Optional[Dict[str, AgentConfig]] = None,
+        latencies: Optional[Dict[str, LatencyModel]] = None,
+        responses: Optional[dict] = None,
+        seed: int = 0,
+        token_delay_ms: float = 0.0,
+        error_rate: float = 0.0,
+    ):
+        super().__init__(configs)
+        self.latencies      = latencies or {}
+        self.responses      = {**FAKE_RESPONSES, **(responses or {})}
+        self.token_delay_ms = token_delay_ms
+        self.error_rate     = error_rate       # fracción de llamadas que fallan (pruebas de resiliencia)
+        self._rng           = random.Random(seed)
+
+    def _content(self, agent: str, messages: list) -> str:
+        value = self.responses[agent]
+        if callable(value):
+            value = value(messages)
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+    async def _wait(self, agent: str) -> None:
+        delay = self.latencies.get(agent, LatencyModel()).sample(self._rng)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise ConnectionError(f"fake: error inyectado ({agent})")
+
+    async def complete(self, agent: str, messages: list, model: Optional[str] = None) -> LLMResult:
+        await self._wait(agent)
+        content = self._content(agent, messages)
+        prompt  = sum(len(m.get("content", "")) for m in messages)
+        return LLMResult(
+            content=content,
+            model=f"fake/{model or self.configs[agent].model}",
+            prompt_tokens=prompt // 4,
+            completion_tokens=len(content) // 4,
+        )
+
+    async def stream(self, agent: str, messages: list, model: Optional[str] = None) -> AsyncIterator[str]:
+        await self._wait(agent)
+        content = self._content(agent, messages)
+        words   = content.split(" ")
+        for i, word in enumerate(words):
+            if self.token_delay_ms:
+                await asyncio.sleep(self.token_delay_ms / 1000)
+            yield word if i == len(words) - 1 else word + " "
+        report_stream_usage(sum(len(m.get("content", "")) for m in messages) // 4, len(content) // 4)
+
+
+class InstrumentedProvider(LLMProvider):
+    """Envuelve un proveedor y anota duración y tokens de cada agente en la traza activa."""
+
+    def __init__(self, inner: LLMProvider):
+        self.inner   = inner
+        self.configs = inner.configs
+        self.name    = inner.name
+
+    def _record(self, agent: str, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        trace   = current_trace()
+        if trace:
+            trace.add_stage(agent, elapsed)
+        else:
+            observe_stage(agent, elapsed)
+
+    async def complete(self, agent: str, messages: list, model: Optional[str] = None) -> LLMResult:
+        started = time.perf_counter()
+        try:
+            result = await self.inner.complete(agent, messages, model=model)
+        finally:
+            self._record(agent, started)
+        trace = current_trace()
+        if trace:
+            trace.add_tokens(agent, result.prompt_tokens, result.completion_tokens)
+        return result
+
+    async def stream(self, agent: str, messages: list, model: Optional[str] = None) -> AsyncIterator[str]:
+        started = time.perf_counter()
+        usage   = StreamUsage()
+        _stream_usage.set(usage)
+        try:
+            async for token in self.inner.stream(agent, messages, model=model):
+                yield token
+        finally:
+            self._record(agent, started)
+            trace = current_trace()
+            if trace and (usage.prompt_tokens or usage.completion_tokens):
+                trace.add_tokens(agent, usage.prompt_tokens, usage.completion_tokens)
+
+
+def parse_latencies(spec: str) -> Dict[str, LatencyModel]:
+    """'scribe=800:0.3,voice=1200' → {agente: LatencyModel(mediana, sigma)}."""
+    latencies = {}
+    for item in filter(None, (p.strip() for p in spec.split(","))):
+        agent, _, value = item.partition("=")
+        median, _, sigma = value.partition(":")
+        latencies[agent.strip()] = LatencyModel(float(median), float(sigma or 0))
+    return latencies
+
+
+def build_provider() -> Optional[LLMProvider]:
+    """
+    LLM_PROVIDER=groq (por defecto) | fake, con control de admisión (admission.py)
+    por dentro de la capa resiliente (resilience.py) para que cada intento y cada
+    hedge pague su cupo, grabación opcional a casete (cassette.py) e instrumentado.
+    None si Groq no tiene API key.
+    """
+    from admission import build_throttled    # los tres módulos importan este
+    from cassette import record_calls
+    from resilience import build_resilient
+
+    kind = os.getenv("LLM_PROVIDER", "groq").lower()
+    if kind == "fake":
+        print("--- LLM FAKE (sin red) ---")
+        return InstrumentedProvider(record_calls(build_resilient(build_throttled(FakeProvider(
+            latencies=parse_latencies(os.getenv("FAKE_LLM_LATENCY_MS", "")),
+            seed=int(os.getenv("FAKE_LLM_SEED", "0")),
+            token_delay_ms=float(os.getenv("FAKE_LLM_TOKEN_DELAY_MS", "0")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+        )))))
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        return None
+    return InstrumentedProvider(record_calls(build_resilient(build_throttled(
+        GroqProvider(api_key, max_retries=0)
+    ))))
@@ -1,23 +1,91 @@
 import os
+import hmac
 import json
-import re
-from fastapi import FastAPI, HTTPException
+import time
+import uuid
+import asyncio
+from typing import Optional
+from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from groq import AsyncGroq
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, PrivateAttr
+from contextlib import asynccontextmanager
 from datetime import datetime
-from prompts import PROMPT_SCRIBE, PROMPT_STRATEGIST, PROMPT_VOICE
+from prompts import FUSED_TEMPLATE, PROMPT_SCRIBE, SCRIBE_TEMPLATE, STRATEGIST_TEMPLATE, VOICE_TEMPLATE
+from sheets_queue import SheetsWriter
+from sheets_connector import SheetsConnector
+from leads import LeadIndex, lead_keys
+from outbox import build_outbox
+from llm import build_provider
+from cache import build_scribe_cache
+from metrics import REGISTRY, SHEETS_PENDING, current_trace, record_fallback, start_trace
+from sessions import build_session_store
+from conversation import HISTORY_BUDGETS, build_conversation_memory
+from prompt_budget import PromptAssembler
+from rules import build_rules_engine
+from contacts import detect_contact_info, format_contact
+from admission import AdmissionRejected, build_admission
+from coalesce import TurnCancelled, build_coordinator
+from cassette import build_recorder, record_cached
+from dossier import LeadDossier
+from fewshot import build_example_bank
+from knowledge import EMPTY as KNOWLEDGE_EMPTY, build_knowledge
+from tactic_model import MODEL_DECISIONS, TACTICS, build_tactic_log, build_tactic_model, featurize
 
 # ==============================================================================
 # 1. INFRAESTRUCTURA & CONEXIONES
+# Nada aquí toca la red al importar: Sheets conecta en segundo plano desde el
+# lifespan y el cliente de Groq se crea en la primera llamada.
 # ==============================================================================
 
-api_key            = os.getenv("GROQ_API_KEY")
 google_creds_json  = os.getenv("GOOGLE_CREDENTIALS")
 
-app = FastAPI()
+# Proveedor LLM (LLM_PROVIDER=groq | fake); modelo y temperatura por agente
+llm = build_provider()
+
+# Banco de ejemplos del Perfilador: a cada prompt sólo entran los casos más
+# parecidos al mensaje y al expediente (FEWSHOT=dynamic | all | off)
+fewshot = build_example_bank()
+
+# Caché del Perfilador (temperature=0.0 → misma entrada, misma salida); la
+# selección de ejemplos es parte del prompt, así que su huella entra en la clave
+scribe_cache = build_scribe_cache(
+    PROMPT_SCRIBE + fewshot.digest, llm.configs["scribe"].model, llm.configs["scribe"].temperature,
+) if llm else None
+
+# Conexión perezosa a DB_Leads_Evangelista con reconexión automática
+sheets = SheetsConnector(
+    google_creds_json,
+    sheet_name=os.getenv("SHEETS_NAME", "DB_Leads_Evangelista"),
+)
+
+# Escritura write-behind: cada fila se registra primero en una bandeja local
+# durable y un hilo la drena a la hoja en lotes, con reintentos sin pérdida.
+# Con SHEETS_UPSERT activo, cada lead ocupa una sola fila que se actualiza en sitio.
+sheets_writer = SheetsWriter(
+    get_sheet=lambda: sheets.sheet,
+    outbox=build_outbox() if sheets.enabled else None,
+    batch_size=int(os.getenv("SHEETS_BATCH_SIZE", "20")),
+    flush_interval=float(os.getenv("SHEETS_FLUSH_SECONDS", "2.0")),
+    on_failure=sheets.mark_broken,
+    index=LeadIndex() if os.getenv("SHEETS_UPSERT", "1") == "1" else None,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sheets_writer.start()
+    connector = asyncio.create_task(sheets.run())
+    yield
+    connector.cancel()
+    # Flush de apagado fuera del event loop
+    await asyncio.to_thread(sheets_writer.stop)
+    if recorder:
+        await asyncio.to_thread(recorder.stop)
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,29 +95,70 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-client = AsyncGroq(api_key=api_key) if api_key else None
 
-sheet_db = None
-try:
-    if google_creds_json:
-        creds_dict = json.loads(google_creds_json)
-        scope      = ["https://spreadsheets.google.com/feeds",
-                      "https://www.googleapis.com/auth/drive"]
-        creds      = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client_gs  = gspread.authorize(creds)
-        try:
-            sheet_db = client_gs.open("DB_Leads_Evangelista").sheet1
-            print("--- CONEXIÓN EXITOSA A GOOGLE SHEETS ---")
-        except Exception as e:
-            print(f"Error hoja: {e}")
-except Exception as e:
-    print(f"Error Google: {e}")
+# Control de admisión: turnos en vuelo acotados, cola justa por sesión y rechazo
+# rápido (429/503) cuando la espera no cabe; el LLM trae sus propias compuertas
+admission = build_admission()
+
+# Un turno vivo por sesión: los mensajes en ráfaga se fusionan y las corridas
+# reemplazadas o abandonadas se cancelan (COALESCE, COALESCE_WINDOW_MS)
+coordinator = build_coordinator()
+
+# Historial y expediente canónicos viven en el servidor, indexados por sesión
+session_store = build_session_store()
+
+# Ventana rodante + resumen incremental: prompts acotados aunque la charla sea larga
+conversation = build_conversation_memory()
+
+# Base de conocimiento (data:/knowledge.txt): índice BM25; a los prompts del
+# Estratega y del Vocero sólo entran los fragmentos relevantes del mensaje
+knowledge = build_knowledge()
+
+# Clasificador local de tácticas (TACTIC_MODEL=off | shadow | on) y registro
+# opt-in (TACTIC_LOG_PATH) de las decisiones del LLM con que se entrena
+# (python tactic_model.py train); sólo rasgos, sin mensaje ni contacto
+tactic_model, TACTIC_MODE = build_tactic_model()
+tactic_log = build_tactic_log()
+_log_writes: set = set()     # escrituras en vuelo (referencia para que no las recolecte el GC)
+
+# Casetes: turnos grabados (entrada, prompts, respuestas crudas, tiempos) para
+# replay offline con `python cassette.py replay` (CASSETTE_RECORD=ruta)
+recorder = build_recorder()
+
+# Presupuesto de tokens por prompt completo; al excederlo se recorta el
+# historial antiguo y, en último caso, los few-shots
+scribe_prompt = PromptAssembler(
+    "scribe", SCRIBE_TEMPLATE,
+    budget=int(os.getenv("SCRIBE_PROMPT_TOKENS", "4000")),
+    history_slot="history", dossier_slot="lead_state", examples_slot="examples",
+    optional_sections=("# FEW-SHOT EXAMPLES (In-Context Learning)",),
+)
+strategist_prompt = PromptAssembler(
+    "strategist", STRATEGIST_TEMPLATE,
+    budget=int(os.getenv("STRATEGIST_PROMPT_TOKENS", "4000")),
+    history_slot="history", dossier_slot="lead_data",
+)
+fused_prompt = PromptAssembler(
+    "fused", FUSED_TEMPLATE,
+    budget=int(os.getenv("FUSED_PROMPT_TOKENS", "6000")),
+    history_slot="history", dossier_slot="lead_state", examples_slot="examples",
+    optional_sections=("# FEW-SHOT EXAMPLES (In-Context Learning)",),
+)
+voice_prompt = PromptAssembler(
+    "voice", VOICE_TEMPLATE,
+    budget=int(os.getenv("VOICE_PROMPT_TOKENS", "3500")),
+    optional_sections=("# FEW-SHOT EXAMPLES",),
+)
 
 
 class ChatRequest(BaseModel):
-    message:   str
-    history:   list = []
-    lead_data: dict = {}
+    message:    str
+    session_id: Optional[str] = None
+    history:    list = []     # legado: sólo se usa para sembrar una sesión nueva
+    lead_data:  dict = {}     # legado: ídem
+
+    _summary: str = PrivateAttr(default="")   # resumen de lo que salió de la ventana
+    _dossier: LeadDossier = PrivateAttr(default_factory=LeadDossier)   # expediente validado
 
 
 # ==============================================================================
@@ -57,197 +166,933 @@ class ChatRequest(BaseModel):
 # Prompts importados desde prompts.py
 # ==============================================================================
 
-async def update_lead_memory(current_memory: dict, user_msg: str) -> dict:
-    """Agente 1 — Perfilador Forense. Extrae y actualiza el expediente del lead."""
-    if not client:
+def knowledge_for(user_msg: str) -> str:
+    """Fragmentos del corpus para el slot {knowledge} (mismo resultado en todo el turno)."""
+    if not knowledge:
+        return KNOWLEDGE_EMPTY
+    ids, text = knowledge.retrieve(user_msg)
+    trace = current_trace()
+    if trace:
+        trace.extra["knowledge"] = list(ids)
+    return text
+
+
+def lookup_scribe_cache(state: dict, user_msg: str, history: list) -> Optional[dict]:
+    """Una sola consulta al caché del Perfilador por turno (cuenta hit/miss y la graba)."""
+    if not scribe_cache:
+        return None
+    new_data = scribe_cache.get(state, user_msg, history)
+    trace    = current_trace()
+    if trace:
+        trace.extra["scribe_cache"] = "hit" if new_data is not None else "miss"
+    if new_data is not None and recorder:
+        record_cached("scribe", json.dumps(new_data, ensure_ascii=False))
+    return new_data
+
+
+async def update_lead_memory(current_memory: LeadDossier, user_msg: str, history: list = None,
+                             cached: Optional[dict] = None, use_cache: bool = True) -> LeadDossier:
+    """
+    Agente 1 — Perfilador Forense. Extrae y actualiza el expediente del lead.
+    `cached`: salida ya obtenida del caché por quien llama; `use_cache=False`
+    cuando quien llama ya consultó el caché y falló.
+    """
+    if not llm:
         return current_memory
+    history = history or []
     try:
-        history_str   = json.dumps(current_memory.get("_history_snapshot", []))
-        lead_state_str = json.dumps(current_memory)
-        system_prompt  = (
-            PROMPT_SCRIBE
-            .replace("{history}", history_str)
-            .replace("{lead_state}", lead_state_str)
-        )
-        completion = await client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
+        state    = current_memory.compact()
+        new_data = cached
+        if new_data is None and use_cache:
+            new_data = lookup_scribe_cache(state, user_msg, history)
+        if new_data is None:
+            system_prompt = scribe_prompt.assemble(
+                {}, history=history, dossier=state, examples=fewshot.select(user_msg, state),
+            )
+            completion = await llm.complete("scribe", [
                 {"role": "system", "content": system_prompt},
                 {"role": "user",   "content": f"Mensaje nuevo del prospecto: {user_msg}"}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.0,
-        )
-        new_data = json.loads(completion.choices[0].message.content)
-        updated  = current_memory.copy()
-        for k, v in new_data.items():
-            if v is not None:
-                updated[k] = v
-        return updated
+            ])
+            new_data = json.loads(completion.content)
+            if scribe_cache and not completion.fallback:   # no cachear respuestas degradadas
+                scribe_cache.set(state, user_msg, new_data, history)
+        return apply_profile(current_memory, new_data)
+    except AdmissionRejected:
+        raise
     except Exception as e:
         print(f"Error Scribe: {e}")
+        record_fallback("scribe")
         return current_memory
 
 
-def detect_contact_info(text: str) -> dict:
-    """Cazador silencioso: extrae email y teléfono por regex aunque la IA falle."""
-    found = {}
-    email_match = re.search(r'[\w\.-]+@[\w\.-]+\.\w+', text)
-    if email_match:
-        found["email_detectado"] = email_match.group(0)
-    phone_match = re.search(r'\b\d{10}\b|\b\d{3}[-.\s]\d{3}[-.\s]\d{4}\b', text)
-    if phone_match:
-        found["telefono_detectado"] = phone_match.group(0)
-    return found
+def apply_profile(current_memory: LeadDossier, new_data: dict) -> LeadDossier:
+    """Valida la salida del Perfilador sobre el expediente y anota los cambios en la traza."""
+    updated = current_memory.merge(new_data)
+    trace   = current_trace()
+    if trace:
+        trace.extra["dossier_changes"] = sorted(
+            name for name in updated.diff(current_memory) if name != "analisis_forense"
+        )
+    return updated
 
 
-async def save_to_sheets(memory: dict, manual_tag: str = None) -> None:
-    if not sheet_db:
+async def save_to_sheets(memory: LeadDossier, manual_tag: str = None, session_id: str = None) -> None:
+    if not sheets.enabled:
         return
     try:
-        contacto = memory.get("contacto", "")
-        if isinstance(contacto, dict):
-            contacto = str(contacto)
         tag = manual_tag or "CALIFICADO"
         row = [
             datetime.now().strftime("%Y-%m-%d %H:%M"),
-            memory.get("empresa", "N/A"),
-            f"{memory.get('dolor_declarado', 'N/A')} | {contacto}",
-            memory.get("stack_tecnologico", "N/A"),
-            "SI" if memory.get("presupuesto_validado") else "NO",
-            memory.get("driver_estrategico", "N/A"),
+            memory.empresa or "N/A",
+            f"{memory.dolor_declarado or 'N/A'} | {memory.contacto or ''}",
+            memory.stack_tecnologico.value,
+            "SI" if memory.presupuesto_validado else "NO",
+            memory.driver_estrategico.value,
             tag,
             "WEB",
         ]
-        sheet_db.append_row(row)
+        await asyncio.to_thread(sheets_writer.enqueue, row, keys=lead_keys(session_id, memory))
     except Exception as e:
         print(f"Error Sheets: {e}")
 
 
-async def run_strategist(history: list, user_msg: str, memory: dict) -> dict:
-    """Agente 2 — Estratega. Determina la táctica e instrucciones para el Vocero."""
-    history_str = json.dumps(history[-6:])          # últimos 6 turnos
-    lead_str    = json.dumps(memory)
-    system_prompt = (
-        PROMPT_STRATEGIST
-        .replace("{history}",   history_str)
-        .replace("{lead_data}", lead_str)
-        .replace("{last_message}", user_msg)
+async def run_strategist(history: list, user_msg: str, memory: LeadDossier) -> dict:
+    """
+    Agente 2 — Estratega. Determina la táctica e instrucciones para el Vocero.
+    Con TACTIC_MODEL=on, el clasificador local responde primero los casos claros.
+    """
+    estrategia, lesson = await consult_strategist(history, user_msg, memory)
+    if lesson:
+        learn_tactic(*lesson)
+    return estrategia
+
+
+async def consult_strategist(history: list, user_msg: str, memory: LeadDossier) -> tuple:
+    """
+    Como run_strategist, pero sin registrar la decisión: devuelve (estrategia,
+    lección), donde la lección son los argumentos de `learn_tactic` o None. La vía
+    especulativa sólo aprende de la táctica que termina usando.
+    """
+    prediction = tactic_model.predict(memory, user_msg) if tactic_model else None
+    if prediction:
+        trace = current_trace()
+        if trace:
+            trace.extra["tactic_model"] = {
+                "tactic": prediction.tactic, "confidence": round(prediction.confidence, 3),
+            }
+        if TACTIC_MODE == "on" and tactic_model.confident(prediction):
+            MODEL_DECISIONS.inc("answered")
+            return prediction.strategy(), None
+        if TACTIC_MODE == "on":
+            MODEL_DECISIONS.inc("deferred")
+
+    system_prompt = strategist_prompt.assemble(
+        {"last_message": user_msg, "knowledge": knowledge_for(user_msg)},
+        history=history, dossier=memory.compact(),
     )
     try:
-        comp = await client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "system", "content": system_prompt}],
-            response_format={"type": "json_object"},
-            temperature=0.2,
-        )
-        return json.loads(comp.choices[0].message.content)
+        comp = await llm.complete("strategist", [{"role": "system", "content": system_prompt}])
+        estrategia = json.loads(comp.content)
+        # Sólo tácticas del Módulo III: una salida rara no llega a métricas ni al Vocero
+        tactic = str(estrategia.get("tactic") or "").strip().upper()
+        if tactic not in TACTICS:
+            raise ValueError(f"táctica fuera de catálogo: {tactic[:40]!r}")
+        estrategia["tactic"] = tactic
+    except AdmissionRejected:
+        raise
     except Exception as e:
         print(f"Error Strategist: {e}")
-        return {
-            "tactic": "INVESTIGATE_DEEP",
-            "instructions_for_voice": (
-                "El sistema tuvo un error interno. Pide disculpas con brevedad "
-                "y solicita al prospecto que describa su problema operativo principal."
-            ),
-        }
+        record_fallback("strategist")
+        return fallback_strategy(), None
+    if comp.fallback:        # el modelo de respaldo no es buen maestro
+        return estrategia, None
+    return estrategia, (memory, user_msg, estrategia["tactic"], "strategist", prediction)
+
+
+def learn_tactic(memory: LeadDossier, user_msg: str, tactic: Optional[str], source: str,
+                 prediction=None) -> None:
+    """
+    Registra la decisión del LLM para entrenar el clasificador y mide su acuerdo.
+    El commit de SQLite va a un hilo: el turno no lo espera.
+    """
+    if prediction is not None:
+        MODEL_DECISIONS.inc("agree" if prediction.tactic == tactic else "disagree")
+    if tactic_log and tactic in TACTICS:
+        write = asyncio.ensure_future(
+            asyncio.to_thread(tactic_log.record, featurize(memory, user_msg), tactic, source)
+        )
+        _log_writes.add(write)
+        write.add_done_callback(_log_written)
+
+
+def _log_written(write: asyncio.Future) -> None:
+    _log_writes.discard(write)
+    if not write.cancelled() and write.exception():
+        print(f"Error registro de tácticas: {write.exception()}")
+
+
+def fallback_strategy() -> dict:
+    """Táctica segura cuando el Estratega (o el modo fusionado) no respondió."""
+    return {
+        "tactic": "INVESTIGATE_DEEP",
+        "instructions_for_voice": (
+            "El sistema tuvo un error interno. Pide disculpas con brevedad "
+            "y solicita al prospecto que describa su problema operativo principal."
+        ),
+    }
+
+
+def build_voice_prompt(user_msg: str, tactic: str, instructions: str) -> str:
+    return voice_prompt.assemble({
+        "knowledge":              knowledge_for(user_msg),
+        "tactic":                 tactic,
+        "instructions_for_voice": instructions,
+        "last_message":           user_msg,
+        "history":                "",   # historial ya incluido en contexto del sistema
+    })
 
 
 async def run_voice(user_msg: str, tactic: str, instructions: str) -> str:
     """Agente 3 — Vocero. Redacta el mensaje final visible para el cliente."""
-    system_prompt = (
-        PROMPT_VOICE
-        .replace("{tactic}",               tactic)
-        .replace("{instructions_for_voice}", instructions)
-        .replace("{last_message}",          user_msg)
-        .replace("{history}",              "")   # historial ya incluido en contexto del sistema
-    )
+    system_prompt = build_voice_prompt(user_msg, tactic, instructions)
     try:
-        comp = await client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "system", "content": system_prompt}],
-            temperature=0.6,
-        )
-        return comp.choices[0].message.content
-    except Exception:
+        comp = await llm.complete("voice", [{"role": "system", "content": system_prompt}])
+        return comp.content
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        print(f"Error Voice: {e}")
+        record_fallback("voice")
         return "Un momento, estamos ajustando los servidores de análisis."
 
 
+async def run_voice_stream(user_msg: str, tactic: str, instructions: str):
+    """Agente 3 — Vocero en modo streaming. Emite los tokens conforme llegan del proveedor."""
+    system_prompt = build_voice_prompt(user_msg, tactic, instructions)
+    emitted = False
+    try:
+        async for delta in llm.stream("voice", [{"role": "system", "content": system_prompt}]):
+            emitted = True
+            yield delta
+    except AdmissionRejected:
+        raise       # se decide antes del primer token
+    except Exception as e:
+        print(f"Error Voice stream: {e}")
+        record_fallback("voice")
+        if not emitted:
+            yield "Un momento, estamos ajustando los servidores de análisis."
+
+
 # ==============================================================================
-# 3. ENDPOINT PRINCIPAL
+# 3. ENDPOINTS
 # ==============================================================================
 
-@app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
-    if not client:
-        raise HTTPException(status_code=500, detail="GROQ_API_KEY no configurada.")
+FALLBACK_RESPONSE = (
+    "Interrupción técnica momentánea. Para no perder el avance de su "
+    "diagnóstico, escriba su correo electrónico y número de teléfono ahora. "
+    "Un Socio Senior lo contactará en los próximos 10 minutos."
+)
+
+BUSY_RESPONSE = (
+    "En este momento atendemos un volumen alto de diagnósticos. Su avance está "
+    "guardado: reenvíe su mensaje en unos segundos para continuar."
+)
+
+# Respuesta de la petición reemplazada: el turno siguiente contesta ambos mensajes
+SUPERSEDED_DETAIL = "Mensaje fusionado con uno más reciente de la misma sesión."
+
+
+async def session_io(method, *args):
+    """Operación del almacén de sesiones: en un hilo si el backend toca disco (SQLite)."""
+    if session_store.blocking:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+
+async def load_session(request: ChatRequest) -> str:
+    """Resuelve la sesión y rellena history/lead_data desde el almacén del servidor."""
+    session_id = request.session_id = request.session_id or uuid.uuid4().hex
+    session    = await session_io(session_store.get, session_id)
+    if session is not None:
+        request.history   = list(session["history"])
+        request.lead_data = dict(session["lead_data"])
+        request._summary  = session.get("summary", "")
+    request._dossier = LeadDossier.from_dict(request.lead_data)
+    # El mensaje actual forma parte del historial que ven los agentes
+    request.history = request.history + [conversation.message("user", request.message)]
+    return session_id
+
+
+def history_for(agent: str, request: ChatRequest, include_current: bool = True) -> list:
+    """Resumen + turnos recientes que caben en el presupuesto del agente."""
+    history = request.history if include_current else request.history[:-1]
+    return conversation.context(history, request._summary, HISTORY_BUDGETS[agent])
+
+
+async def store_turn(session_id: str, request: ChatRequest, lead_data: LeadDossier, response: str) -> int:
+    """
+    Persiste el turno completo (mensaje + respuesta) y el expediente actualizado.
+    Se llama ANTES de cerrar el turno: un mensaje siguiente que llegue justo
+    después ya carga esta sesión y no la pisa con una copia vieja. Devuelve el
+    largo del historial guardado (versión para `compact_session`).
+    """
+    history = request.history + [conversation.message("model", response)]
+    try:
+        await session_io(session_store.save, session_id, {
+            "history":   history,
+            "summary":   request._summary,
+            "lead_data": lead_data.compact(),
+        })
+    except Exception as e:
+        print(f"Error Sesiones: {e}")
+    return len(history)
+
+
+async def compact_session(session_id: str, history_len: int) -> None:
+    """
+    Mueve al resumen lo que excede la ventana, fuera del camino crítico. Lectura
+    y escritura son una sola `update` del almacén; si otro turno ya guardó encima
+    (el largo no coincide), no hace nada: esa sesión se compactará en su turno.
+    """
+    if history_len <= conversation.window_messages:
+        return
+
+    def compact(session: Optional[dict]) -> Optional[dict]:
+        if session is None or len(session.get("history", [])) != history_len:
+            return None
+        conversation.compact(session)
+        return session
+
+    try:
+        await session_io(session_store.update, session_id, compact)
+    except Exception as e:
+        print(f"Error Sesiones: {e}")
+
 
-    memory_backup = dict(request.lead_data) if request.lead_data else {}
+def add_contact(current, contact: dict) -> str:
+    """Anexa los datos detectados al campo `contacto` del expediente sin duplicarlos."""
+    current = current if isinstance(current, str) else (str(current) if current else "")
+    extra   = [v for v in format_contact(contact).split(", ") if v and v not in current]
+    return ", ".join(([current] if current else []) + extra)
 
-    # — NIVEL 0: CAZADOR SILENCIOSO —
-    # Captura email/teléfono por regex ANTES de cualquier llamada a la IA.
+
+async def rescue_contact(request: ChatRequest) -> LeadDossier:
+    """Nivel 0 — Cazador silencioso. Captura email/teléfono ANTES de cualquier IA."""
+    memory_backup = request._dossier
     emergency_contact = detect_contact_info(request.message)
     if emergency_contact:
         print(f"CONTACTO DE EMERGENCIA DETECTADO: {emergency_contact}")
-        memory_backup.setdefault("contacto", "")
-        memory_backup["contacto"] += f" {emergency_contact}"
-        await save_to_sheets(memory_backup, manual_tag="CONTACTO_RESCATADO")
+        memory_backup = request._dossier = memory_backup.merge(
+            {"contacto": add_contact(memory_backup.contacto, emergency_contact)}
+        )
+        await save_to_sheets(memory_backup, manual_tag="CONTACTO_RESCATADO", session_id=request.session_id)
+    return memory_backup
+
+
+# PIPELINE_MODE=sequential (por defecto) | speculative | fused
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "sequential").lower()
+
+# Campos del expediente que deciden la cascada de tácticas del Estratega (Módulo III)
+STRATEGY_FIELDS = (
+    "red_flags",
+    "autoridad_detectada",
+    "empresa",
+    "dolor_declarado",
+    "presupuesto_validado",
+)
+
+FUSED_TURNS = REGISTRY.counter(
+    "evangelista_fused_total",
+    "Turnos del modo fusionado por desenlace (ok, cache, partial, invalid, error).",
+    ("outcome",))
+
+
+# Reglas deterministas que resuelven la táctica sin el Estratega (FAST_RULES)
+fast_rules = build_rules_engine()
+
+
+async def decide_tactic(history: list, user_msg: str, memory: LeadDossier, contact: dict) -> dict:
+    """Vía rápida de reglas; si ninguna aplica, decide el Estratega."""
+    estrategia = fast_rules.match(user_msg, memory, contact)
+    if estrategia:
+        return estrategia
+    return await run_strategist(history, user_msg, memory)
+
+
+async def profile_and_strategize(request: ChatRequest, contact: dict,
+                                 cached: Optional[dict] = None, use_cache: bool = True) -> tuple:
+    """Modo secuencial: Perfilador → Estratega."""
+    # 1. PERFILADO — actualiza el expediente del lead
+    new_memory = await update_lead_memory(
+        request._dossier, request.message, history_for("scribe", request, include_current=False),
+        cached=cached, use_cache=use_cache,
+    )
+
+    # 2. ESTRATEGIA — decide la táctica
+    estrategia = await decide_tactic(
+        history_for("strategist", request), request.message, new_memory, contact,
+    )
+    return estrategia, new_memory
+
 
+def discard(task: asyncio.Task) -> None:
+    """Descarta una tarea especulativa: la cancela o, si ya terminó, recoge su excepción."""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()     # evita "Task exception was never retrieved"
+
+
+async def profile_and_strategize_speculative(request: ChatRequest, contact: dict) -> tuple:
+    """
+    Modo especulativo: el Estratega arranca en paralelo con el Perfilador usando el
+    expediente anterior. Sólo se re-ejecuta si el Perfilador cambió algún campo de
+    STRATEGY_FIELDS; de lo contrario se reutiliza la táctica especulada.
+
+    Las reglas de la vía rápida mandan igual que en modo secuencial: si una ya
+    aplica al expediente anterior no se especula, y una que aplique al nuevo
+    gana sobre la táctica especulada. Una especulación descartada no se registra
+    en el log de tácticas: su expediente ya no es el del turno.
+    """
+    started     = time.perf_counter()
+    old_memory  = request._dossier
+    strategist_history = history_for("strategist", request)
+    speculative = None
+    if not fast_rules.first(request.message, old_memory, contact):
+        speculative = asyncio.create_task(
+            consult_strategist(strategist_history, request.message, old_memory)
+        )
     try:
-        # 1. PERFILADO — actualiza el expediente del lead
-        new_memory = await update_lead_memory(request.lead_data, request.message)
-
-        # 2. ESTRATEGIA — decide la táctica
-        estrategia = await run_strategist(request.history, request.message, new_memory)
-
-        # Hard Lock: no desbloquear agenda si el presupuesto no está validado
-        if estrategia.get("tactic") == "ALLOW_MEETING":
-            if not new_memory.get("presupuesto_validado"):
-                estrategia["tactic"] = "ANCHOR_FOUNDATION_FEE"
-                estrategia["instructions_for_voice"] = (
-                    "El cliente quiere agendar pero NO ha validado $35,000 MXN. "
-                    "Ancla el precio del Foundation y haz la pregunta de cierre."
-                )
-
-        # 3. AUDITORÍA SILENCIOSA
-        silent_audit = {"action": "CONTINUE"}
-        if estrategia.get("tactic") == "ALLOW_MEETING":
-            silent_audit = {"action": "UNLOCK_CALENDLY"}
-            await save_to_sheets(new_memory)
-
-        # 4. VOZ — genera la respuesta final
-        respuesta = await run_voice(
-            user_msg=request.message,
-            tactic=estrategia.get("tactic", "INVESTIGATE_DEEP"),
-            instructions=estrategia.get("instructions_for_voice", ""),
+        new_memory = await update_lead_memory(
+            old_memory, request.message, history_for("scribe", request, include_current=False),
         )
+    except BaseException:
+        if speculative:
+            discard(speculative)
+        raise
+    scribe_ms = (time.perf_counter() - started) * 1000
+
+    changed    = list(new_memory.diff(old_memory, STRATEGY_FIELDS))
+    estrategia = fast_rules.match(request.message, new_memory, contact)
+    hit        = estrategia is None and speculative is not None and not changed
+    if hit:
+        estrategia, lesson = await speculative
+        if lesson:
+            learn_tactic(*lesson)
+    else:
+        if speculative:
+            discard(speculative)
+        if estrategia is None:
+            estrategia = await run_strategist(strategist_history, request.message, new_memory)
+
+    speculation = {
+        "hit":            hit,
+        "speculated":     speculative is not None,
+        "changed_fields": changed,
+        "scribe_ms":      round(scribe_ms, 1),
+        "total_ms":       round((time.perf_counter() - started) * 1000, 1),
+    }
+    trace = current_trace()
+    if trace:
+        trace.extra["speculation"] = speculation   # viaja en el log JSON de la petición
+    else:
+        print(json.dumps({"event": "speculative_strategy", **speculation}))
+    return estrategia, new_memory
+
+
+def parse_fused(content: str) -> tuple:
+    """
+    (datos del expediente, estrategia) de una completion fusionada. Cada parte es
+    None si no cumple el esquema: el expediente debe ser un objeto y la estrategia
+    traer una táctica del Módulo III con instrucciones para el Vocero.
+    """
+    data = json.loads(content)
+    if not isinstance(data, dict):
+        return None, None
+    dossier = data.get("dossier")
+    if not isinstance(dossier, dict):
+        dossier = None
+    tactic       = str(data.get("tactic") or "").strip().upper()
+    instructions = data.get("instructions_for_voice")
+    if tactic not in TACTICS or not isinstance(instructions, str) or not instructions.strip():
+        return dossier, None
+    return dossier, {
+        "analisis_estrategico":   data.get("analisis_estrategico"),
+        "tactic":                 tactic,
+        "instructions_for_voice": instructions.strip(),
+    }
+
+
+async def profile_and_strategize_fused(request: ChatRequest, contact: dict) -> tuple:
+    """
+    Modo fusionado: Perfilador y Estratega en una sola completion JSON que devuelve
+    el expediente y la táctica. Ahorra una ida y vuelta al proveedor y un prompt.
+
+      - Si la caché del Perfilador acierta, el expediente sale gratis y basta con
+        el Estratega: se usa la vía secuencial (una llamada igualmente). El caché
+        se consulta una sola vez por turno y sólo lo llena el Perfilador: su clave
+        es el prompt del Perfilador, así que la salida fusionada no entra en él.
+      - Expediente válido pero táctica fuera de esquema → sólo se repite el Estratega.
+      - Expediente fuera de esquema o JSON roto → turno secuencial completo.
+      - Error del proveedor → expediente anterior y táctica segura, como el secuencial.
+
+    Las reglas deterministas se evalúan sobre el expediente nuevo igual que en
+    `decide_tactic`, y el Hard Lock de plan_turn aplica sin cambios.
+    """
+    old_memory = request._dossier
+    state      = old_memory.compact()
+    scribe_history = history_for("scribe", request, include_current=False)
+    trace = current_trace()
+    cached = lookup_scribe_cache(state, request.message, scribe_history)
+    if cached is not None:
+        FUSED_TURNS.inc("cache")
+        if trace:
+            trace.extra["fused"] = "cache"
+        return await profile_and_strategize(request, contact, cached=cached)
+
+    system_prompt = fused_prompt.assemble(
+        {"knowledge": knowledge_for(request.message)}, history=history_for("fused", request, include_current=False), dossier=state,
+        examples=fewshot.select(request.message, state),
+    )
+    try:
+        completion = await llm.complete("fused", [
+            {"role": "system", "content": system_prompt},
+            {"role": "user",   "content": f"Mensaje nuevo del prospecto: {request.message}"}
+        ])
+        new_data, estrategia = parse_fused(completion.content)
+    except AdmissionRejected:
+        raise
+    except ValueError as e:        # JSON roto (json.JSONDecodeError)
+        print(f"Error Fused (formato): {e}")
+        new_data, estrategia = None, None
+    except Exception as e:
+        print(f"Error Fused: {e}")
+        FUSED_TURNS.inc("error")
+        if trace:
+            trace.extra["fused"] = "error"
+        record_fallback("fused")
+        return fallback_strategy(), old_memory
+
+    if new_data is None:
+        outcome = "invalid"
+        estrategia, new_memory = await profile_and_strategize(request, contact, use_cache=False)
+    else:
+        new_memory = apply_profile(old_memory, new_data)
+        rule = fast_rules.match(request.message, new_memory, contact)
+        if rule:
+            outcome, estrategia = "ok", rule
+        elif estrategia is None:
+            outcome = "partial"
+            estrategia = await run_strategist(
+                history_for("strategist", request), request.message, new_memory,
+            )
+        else:
+            outcome = "ok"
+            if not completion.fallback:
+                learn_tactic(new_memory, request.message, estrategia["tactic"], "fused")
+    FUSED_TURNS.inc(outcome)
+    if trace:
+        trace.extra["fused"] = outcome
+    return estrategia, new_memory
+
+
+async def plan_turn(request: ChatRequest) -> tuple:
+    """Perfilado + Estrategia + Auditoría. Devuelve (estrategia, memoria, silent_audit)."""
+    contact    = detect_contact_info(request.message)
+    estrategia = fast_rules.match(request.message, request._dossier, contact, before_scribe=True)
+    if estrategia:
+        # Turno determinista: ni Perfilador ni Estratega
+        new_memory = request._dossier
+        if contact:
+            new_memory = new_memory.merge({"contacto": add_contact(new_memory.contacto, contact)})
+    elif PIPELINE_MODE == "speculative":
+        estrategia, new_memory = await profile_and_strategize_speculative(request, contact)
+    elif PIPELINE_MODE == "fused" and llm:
+        estrategia, new_memory = await profile_and_strategize_fused(request, contact)
+    else:
+        estrategia, new_memory = await profile_and_strategize(request, contact)
+
+    # Hard Lock: no desbloquear agenda si el presupuesto no está validado
+    if estrategia.get("tactic") == "ALLOW_MEETING":
+        if not new_memory.presupuesto_validado:
+            estrategia["tactic"] = "ANCHOR_FOUNDATION_FEE"
+            estrategia["instructions_for_voice"] = (
+                "El cliente quiere agendar pero NO ha validado $35,000 MXN. "
+                "Ancla el precio del Foundation y haz la pregunta de cierre."
+            )
+
+    trace = current_trace()
+    if trace:
+        trace.set_tactic(estrategia.get("tactic", "INVESTIGATE_DEEP"))
+
+    # 3. AUDITORÍA SILENCIOSA
+    silent_audit = {"action": "CONTINUE"}
+    if estrategia.get("tactic") == "ALLOW_MEETING":
+        silent_audit = {"action": "UNLOCK_CALENDLY"}
+        await save_to_sheets(new_memory, session_id=request.session_id)
+    if tactic_model:
+        # Calificación del lead (0–100) que vetting-gate.js pasa a unlockCalendly
+        silent_audit["score"] = tactic_model.score(new_memory, request.message)
+
+    return estrategia, new_memory, silent_audit
+
+
+async def log_critical_failure(request: ChatRequest, memory_backup: LeadDossier, error: Exception) -> None:
+    """Protocolo de blindaje: deja rastro del fallo en Sheets."""
+    print(f"ERROR CRÍTICO: {error}")
+    if not sheets.enabled:
+        return
+    row = [
+        datetime.now().strftime("%Y-%m-%d %H:%M"),
+        memory_backup.empresa or "Error",
+        f"FALLO SISTEMA | Msg: {request.message}",
+        "N/A", "NO", "CRITICAL", "ERROR", "WEB",
+    ]
+    try:
+        await asyncio.to_thread(sheets_writer.enqueue, row, keys=lead_keys(request.session_id, memory_backup))
+    except Exception as e:
+        # Último recurso: que al menos quede en el log
+        print(f"Error bandeja de Sheets: {e} | {row}")
+
+
+def overloaded(trace, error: AdmissionRejected) -> JSONResponse:
+    """Rechazo rápido del control de admisión: 429/503 con Retry-After."""
+    trace.extra["admission"] = {"scope": error.scope, "reason": error.reason}
+    trace.finish("rejected")
+    return JSONResponse(
+        {"detail": BUSY_RESPONSE, "reason": error.reason, "retry_after": error.headers["Retry-After"]},
+        status_code=error.status,
+        headers=error.headers,
+    )
+
+
+def cancelled(trace, error: TurnCancelled, session_id: str) -> Response:
+    """Turno reemplazado por un mensaje más nuevo (409) o abandonado por el cliente (499)."""
+    trace.extra["cancelled"] = error.reason
+    trace.finish("cancelled")
+    if error.reason == "superseded":
+        return JSONResponse(
+            {"detail": SUPERSEDED_DETAIL, "reason": "superseded", "session_id": session_id},
+            status_code=409,
+        )
+    return Response(status_code=499)    # nadie leerá la respuesta
+
+
+def adopt_turn(request: ChatRequest, turn) -> LeadDossier:
+    """
+    Turno fusionado: se procesan todos los mensajes pendientes de la sesión y se
+    conservan los contactos que ya rescataron las peticiones reemplazadas.
+    """
+    if len(turn.messages) > 1:
+        request.message = turn.message
+        request.history = request.history[:-1] + [conversation.message("user", request.message)]
+        contact = detect_contact_info("\n".join(turn.messages[:-1]))
+        if contact:
+            request._dossier = request._dossier.merge(
+                {"contacto": add_contact(request._dossier.contacto, contact)}
+            )
+    return request._dossier
+
+
+def begin_tape(endpoint: str, request: ChatRequest):
+    """Casete del turno (grabación o replay); None si no se está grabando."""
+    if not recorder:
+        return None
+    return recorder.begin(endpoint, {
+        "message":   request.message,
+        "history":   request.history[:-1],
+        "summary":   request._summary,
+        "lead_data": request._dossier.compact(),
+        "pipeline":  PIPELINE_MODE,
+    })
+
+
+def finish_tape(tape, trace, status: str, memory: LeadDossier, silent_audit: dict, response: str) -> None:
+    if tape:
+        recorder.finish(tape, trace, status, {
+            "tactic":   trace.tactic,
+            "action":   silent_audit.get("action"),
+            "dossier":  memory.compact(),
+            "response": response,
+        })
+
+
+@app.post("/chat")
+async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks, http_request: Request):
+    if not llm:
+        raise HTTPException(status_code=500, detail="GROQ_API_KEY no configurada.")
+
+    trace         = start_trace("/chat")
+    session_id    = await load_session(request)
+    turn          = coordinator.open(session_id, request.message)   # reemplaza al turno en curso
+    memory_backup = await rescue_contact(request)   # el contacto se captura aun saturados
+    watcher       = asyncio.ensure_future(turn.watch_disconnect(http_request.receive))
+    tape          = None
+
+    try:
+        await turn.settle()
+        memory_backup = adopt_turn(request, turn)
+        tape          = begin_tape("/chat", request)
+        new_memory, silent_audit, respuesta = await turn.run(answer_turn(request, turn))
+        stored = await store_turn(session_id, request, new_memory, respuesta)
+        background_tasks.add_task(compact_session, session_id, stored)
+        trace.finish("ok")
+        finish_tape(tape, trace, "ok", new_memory, silent_audit, respuesta)
 
         return {
             "response":          respuesta,
             "silent_audit":      silent_audit,
-            "updated_lead_data": new_memory,
+            "updated_lead_data": new_memory.to_dict(),
+            "session_id":        session_id,
         }
 
-    except Exception as e:
-        print(f"ERROR CRÍTICO: {e}")
-        # Protocolo de blindaje: guardar lo que hay y pedir datos de contacto
-        try:
-            if sheet_db:
-                sheet_db.append_row([
-                    datetime.now().strftime("%Y-%m-%d %H:%M"),
-                    memory_backup.get("empresa", "Error"),
-                    f"FALLO SISTEMA | Msg: {request.message}",
-                    "N/A", "NO", "CRITICAL", "ERROR", "WEB",
-                ])
-        except Exception:
-            pass
+    except TurnCancelled as e:
+        return cancelled(trace, e, session_id)
+
+    except AdmissionRejected as e:
+        return overloaded(trace, e)
 
+    except Exception as e:
+        await log_critical_failure(request, memory_backup, e)
+        stored = await store_turn(session_id, request, memory_backup, FALLBACK_RESPONSE)
+        background_tasks.add_task(compact_session, session_id, stored)
+        trace.finish("error")
+        finish_tape(tape, trace, "error", memory_backup, {"action": "CONTINUE"}, FALLBACK_RESPONSE)
         return {
-            "response": (
-                "Interrupción técnica momentánea. Para no perder el avance de su "
-                "diagnóstico, escriba su correo electrónico y número de teléfono ahora. "
-                "Un Socio Senior lo contactará en los próximos 10 minutos."
-            ),
+            "response":          FALLBACK_RESPONSE,
             "silent_audit":      {"action": "CONTINUE"},
-            "updated_lead_data": memory_backup,
+            "updated_lead_data": memory_backup.to_dict(),
+            "session_id":        session_id,
         }
+
+    finally:
+        watcher.cancel()
+        turn.close()
+
+
+async def answer_turn(request: ChatRequest, turn) -> tuple:
+    """Admisión + Perfilado/Estrategia + Voz. Corre como tarea cancelable del turno."""
+    ticket = await admission.enter(request.session_id)
+    try:
+        turn.stage = "pipeline"
+        estrategia, new_memory, silent_audit = await plan_turn(request)
+
+        # 4. VOZ — genera la respuesta final (o la plantilla de la vía rápida)
+        turn.stage = "voice"
+        respuesta = estrategia.get("reply") or await run_voice(
+            user_msg=request.message,
+            tactic=estrategia.get("tactic", "INVESTIGATE_DEEP"),
+            instructions=estrategia.get("instructions_for_voice", ""),
+        )
+        return new_memory, silent_audit, respuesta
+    finally:
+        ticket.release()
+
+
+def _ndjson(event: dict) -> bytes:
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def _single(text: str):
+    """Respuesta plantilla como un único evento token."""
+    yield text
+
+
+def _busy_events(error: AdmissionRejected):
+    """Rechazo a mitad del stream (el estado HTTP ya salió): evento error con el aviso."""
+    yield _ndjson({
+        "type":        "error",
+        "status":      error.status,
+        "retry_after": error.headers["Retry-After"],
+        "detail":      BUSY_RESPONSE,
+    })
+    yield _ndjson({"type": "done"})
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Variante streaming de /chat (NDJSON, un evento por línea):
+      {"type": "meta",  "session_id": "...", "silent_audit": {...}, "updated_lead_data": {...}}
+      {"type": "token", "content": "..."}   (n veces)
+      {"type": "done"}
+    Con el servicio saturado responde 429/503 antes de abrir el stream; si el
+    rechazo llega ya abierto, emite {"type": "error", "status": ..., "retry_after": ...,
+    "detail": "..."} (sin tokens: el cliente muestra `detail` y reintenta).
+    Si un mensaje más nuevo de la sesión lo reemplaza: 409 antes de abrir, o
+    {"type": "superseded"} + done ya abierto. La desconexión del cliente la
+    detecta Starlette y cancela el generador (y con él la llamada en curso).
+    """
+    if not llm:
+        raise HTTPException(status_code=500, detail="GROQ_API_KEY no configurada.")
+
+    session_id    = await load_session(request)
+    turn          = coordinator.open(session_id, request.message)
+    memory_backup = await rescue_contact(request)
+    try:
+        await turn.settle()
+        memory_backup = adopt_turn(request, turn)
+        ticket = await admission.enter(session_id)
+    except TurnCancelled as e:
+        turn.close()
+        return cancelled(start_trace("/chat/stream"), e, session_id)
+    except AdmissionRejected as e:
+        turn.close()
+        return overloaded(start_trace("/chat/stream"), e)
+    if turn.cancelled:      # reemplazado mientras esperaba cupo
+        ticket.release()
+        turn.close()
+        return cancelled(start_trace("/chat/stream"), TurnCancelled(turn.reason), session_id)
+
+    async def events():
+        trace = start_trace("/chat/stream")
+        tape  = begin_tape("/chat/stream", request)
+        if ticket.waited:
+            trace.add_stage("admission", ticket.waited)
+        try:
+            try:
+                turn.stage = "pipeline"
+                estrategia, new_memory, silent_audit = await turn.run(plan_turn(request))
+            except TurnCancelled as e:
+                for event in _cancelled_events(trace, e):
+                    yield event
+                return
+            except AdmissionRejected as e:
+                trace.extra["admission"] = {"scope": e.scope, "reason": e.reason}
+                trace.finish("rejected")
+                for event in _busy_events(e):
+                    yield event
+                return
+            except Exception as e:
+                await log_critical_failure(request, memory_backup, e)
+                stored = await store_turn(session_id, request, memory_backup, FALLBACK_RESPONSE)
+                trace.finish("error")
+                finish_tape(tape, trace, "error", memory_backup, {"action": "CONTINUE"}, FALLBACK_RESPONSE)
+                yield _ndjson({
+                    "type":              "meta",
+                    "session_id":        session_id,
+                    "silent_audit":      {"action": "CONTINUE"},
+                    "updated_lead_data": memory_backup.to_dict(),
+                })
+                yield _ndjson({"type": "token", "content": FALLBACK_RESPONSE})
+                turn.close()
+                yield _ndjson({"type": "done"})
+                await compact_session(session_id, stored)
+                return
+
+            # El cliente recibe la auditoría antes del primer token del Vocero
+            yield _ndjson({
+                "type":              "meta",
+                "session_id":        session_id,
+                "silent_audit":      silent_audit,
+                "updated_lead_data": new_memory.to_dict(),
+            })
+            tokens = []
+            turn.stage = "voice"
+            if estrategia.get("reply"):
+                voice = _single(estrategia["reply"])
+            else:
+                voice = turn.stream(run_voice_stream(
+                    user_msg=request.message,
+                    tactic=estrategia.get("tactic", "INVESTIGATE_DEEP"),
+                    instructions=estrategia.get("instructions_for_voice", ""),
+                ))
+            try:
+                async for token in voice:
+                    tokens.append(token)
+                    yield _ndjson({"type": "token", "content": token})
+                turn.check()
+            except TurnCancelled as e:
+                for event in _cancelled_events(trace, e):
+                    yield event
+                return
+            except AdmissionRejected as e:
+                trace.extra["admission"] = {"scope": e.scope, "reason": e.reason}
+                trace.finish("rejected")
+                for event in _busy_events(e):
+                    yield event
+                return
+            trace.finish("ok")
+            finish_tape(tape, trace, "ok", new_memory, silent_audit, "".join(tokens))
+            # Sesión guardada y turno cerrado antes de `done`: el cliente puede
+            # mandar el siguiente mensaje en cuanto lo lee sin reemplazar a éste
+            stored = await store_turn(session_id, request, new_memory, "".join(tokens))
+            turn.close()
+            yield _ndjson({"type": "done"})
+            await compact_session(session_id, stored)
+        except asyncio.CancelledError:
+            turn.cancel("disconnected")     # Starlette cortó el stream: el cliente se fue
+            trace.extra["cancelled"] = turn.reason
+            trace.finish("cancelled")
+            raise
+        finally:
+            turn.close()
+            ticket.release()
+
+    return StreamingResponse(
+        events(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(_abandon_stream, turn, ticket),   # por si el stream nunca arranca
+    )
+
+
+def _cancelled_events(trace, error: TurnCancelled):
+    """Turno cancelado con el stream abierto: sólo el reemplazo tiene a quién avisarle."""
+    trace.extra["cancelled"] = error.reason
+    trace.finish("cancelled")
+    if error.reason == "superseded":
+        yield _ndjson({"type": "superseded"})
+        yield _ndjson({"type": "done"})
+
+
+def _abandon_stream(turn, ticket) -> None:
+    turn.close()
+    ticket.release()
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Exposición en formato de texto de Prometheus."""
+    SHEETS_PENDING.set(value=await asyncio.to_thread(sheets_writer.outbox.depth))
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+@app.get("/admin/outbox")
+async def outbox_status(x_admin_token: Optional[str] = Header(default=None)):
+    """Profundidad y salud de la bandeja de salida hacia Sheets. Sin ADMIN_TOKEN no existe."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Token de administración inválido.")
+    stats = await asyncio.to_thread(sheets_writer.stats)
+    return {"sheets": sheets.status(), "outbox": stats}
+
+
+@app.get("/healthz")
+async def liveness():
+    """Liveness: el proceso y su event loop responden."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness: listo si hay proveedor LLM. Sheets caído sólo degrada (las filas esperan en cola)."""
+    sheets_status = sheets.status()
+    pending = await asyncio.to_thread(sheets_writer.outbox.depth)
+    ready = llm is not None
+    body  = {
+        "status": "ready" if ready else "not_ready",
+        "llm":    {"provider": llm.name if llm else None},
+        "sheets": {**sheets_status, "pending_rows": pending},
+        "admission": admission.stats(),
+        "knowledge": knowledge.stats() if knowledge else None,
+        "fewshot":   fewshot.stats(),
+        "coalesce":  coordinator.stats(),
+    }
+    if ready and sheets.enabled and sheets_status["state"] != SheetsConnector.CONNECTED:
+        body["status"] = "degraded"
+    return JSONResponse(body, status_code=200 if ready else 503)
@@ -0,0 +1,256 @@
+"""
+metrics.py — Evangelista & Co.
+Instrumentación por petición y exposición estilo Prometheus.
+
+Cada petición a /chat abre una traza (RequestTrace) que acumula la duración de
+cada etapa (scribe, strategist, voice, sheets…), el uso de tokens que reporta el
+proveedor, reintentos, fallbacks tomados y la táctica elegida. Al cerrarse:
+  - se vuelca a los contadores/histogramas globales (`GET /metrics`), y
+  - se imprime como una línea JSON en el log.
+
+La traza activa viaja en un ContextVar, así que los agentes la alcanzan con
+`current_trace()` sin cambiar sus firmas.
+"""
+
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# ==============================================================================
+# REGISTRO DE MÉTRICAS (formato de exposición de texto de Prometheus)
+# ==============================================================================
+
+def _escape(value) -> str:
+    """Escapado de valores de etiqueta del formato de texto de Prometheus."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.label_names = name, help_text, labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.label_names, labels)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.help, self.label_names = name, help_text, labels
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}     # labels -> [conteos…, suma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, *labels: str, value: float) -> None:
+        with self._lock:
+            series = self._series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            for bound, count in zip(self.buckets, series):
+                le = _labels(self.label_names, labels, f'le="{bound}"')
+                yield f"{self.name}_bucket{le} {count}"
+            inf = _labels(self.label_names, labels, 'le="+Inf"')
+            yield f"{self.name}_bucket{inf} {series[-1]}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {series[-2]}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {series[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter(
+    "evangelista_requests_total", "Peticiones de chat atendidas.", ("endpoint", "status"))
+REQUEST_SECONDS = REGISTRY.histogram(
+    "evangelista_request_duration_seconds", "Latencia total por petición.", ("endpoint",))
+STAGE_SECONDS = REGISTRY.histogram(
+    "evangelista_stage_duration_seconds", "Duración de cada etapa del pipeline.", ("stage",))
+TOKENS = REGISTRY.counter(
+    "evangelista_llm_tokens_total", "Tokens consumidos por agente.", ("agent", "kind"))
+RETRIES = REGISTRY.counter(
+    "evangelista_retries_total", "Reintentos por etapa.", ("stage",))
+FALLBACKS = REGISTRY.counter(
+    "evangelista_fallbacks_total", "Fallbacks tomados por etapa.", ("stage",))
+TACTICS = REGISTRY.counter(
+    "evangelista_tactic_total", "Tácticas elegidas por el Estratega.", ("tactic",))
+SHEETS_PENDING = REGISTRY.gauge(
+    "evangelista_sheets_pending_rows", "Filas en cola para Google Sheets.")
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Para etapas fuera de una petición (p. ej. el hilo de Sheets)."""
+    STAGE_SECONDS.observe(stage, value=seconds)
+
+
+# ==============================================================================
+# TRAZA POR PETICIÓN
+# ==============================================================================
+
+class RequestTrace:
+    def __init__(self, endpoint: str):
+        self.id        = uuid.uuid4().hex[:12]
+        self.endpoint  = endpoint
+        self.started   = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.tokens: Dict[str, Dict[str, int]] = {}
+        self.retries: Dict[str, int] = {}
+        self.fallbacks = []
+        self.tactic: Optional[str] = None
+        self.extra: Dict[str, object] = {}
+        self._finished = False
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - started)
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        STAGE_SECONDS.observe(name, value=seconds)
+
+    def add_tokens(self, agent: str, prompt: int, completion: int) -> None:
+        usage = self.tokens.setdefault(agent, {"prompt": 0, "completion": 0})
+        usage["prompt"] += prompt
+        usage["completion"] += completion
+        TOKENS.inc(agent, "prompt", amount=prompt)
+        TOKENS.inc(agent, "completion", amount=completion)
+
+    def add_retry(self, stage: str) -> None:
+        self.retries[stage] = self.retries.get(stage, 0) + 1
+        RETRIES.inc(stage)
+
+    def add_fallback(self, stage: str) -> None:
+        self.fallbacks.append(stage)
+        FALLBACKS.inc(stage)
+
+    def set_tactic(self, tactic: str) -> None:
+        self.tactic = tactic
+
+    def finish(self, status: str = "ok") -> dict:
+        if self._finished:
+            return {}
+        self._finished = True
+        total = time.perf_counter() - self.started
+        REQUESTS.inc(self.endpoint, status)
+        REQUEST_SECONDS.observe(self.endpoint, value=total)
+        if self.tactic:
+            TACTICS.inc(self.tactic)
+        record = {
+            "event":     "chat_request",
+            "trace_id":  self.id,
+            "endpoint":  self.endpoint,
+            "status":    status,
+            "total_ms":  round(total * 1000, 1),
+            "stages_ms": {k: round(v * 1000, 1) for k, v in self.stages.items()},
+            "tokens":    self.tokens,
+            "retries":   self.retries,
+            "fallbacks": self.fallbacks,
+            "tactic":    self.tactic,
+            **self.extra,
+        }
+        print(json.dumps(record, ensure_ascii=False))
+        return record
+
+
+_current: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def start_trace(endpoint: str) -> RequestTrace:
+    trace = RequestTrace(endpoint)
+    _current.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current.get()
+
+
+def record_fallback(stage: str) -> None:
+    """Anota un fallback en la traza activa (o sólo en el contador si no hay traza)."""
+    trace = current_trace()
+    if trace:
+        trace.add_fallback(stage)
+    else:
+        FALLBACKS.inc(stage)
+
+
+def record_retry(stage: str) -> None:
+    trace = current_trace()
+    if trace:
+        trace.add_retry(stage)
+    else:
+        RETRIES.inc(stage)
@@ -0,0 +1,242 @@
+"""
+outbox.py — Evangelista & Co.
+Bandeja de salida local para los eventos de lead destinados a Google Sheets.
+
+Cada fila se escribe PRIMERO aquí y después un drenador (SheetsWriter) la
+replica a la hoja. Si Google cae, o el proceso se reinicia, las filas siguen en
+la bandeja y se envían al volver; la latencia de /chat ya no depende de Google.
+
+Semántica:
+  - `append` registra el evento (clave de lead + fila) con un id creciente.
+  - `peek` devuelve los más antiguos sin marcar; `ack` los marca como enviados
+    (marca de entrega) y `fail` registra el intento fallido. Un evento no se
+    reenvía tras su `ack`. Si el proceso muere entre el envío y el `ack`, el
+    evento se repite, pero las filas llevan claves de lead (upsert) y repetirlas
+    no duplica nada.
+  - Un evento que acumula `max_attempts` intentos fallidos pasa a la cola muerta
+    (dead letter): sale de la cabeza para no frenar al resto, pero no se borra.
+    `stats` lo cuenta y `requeue_dead` lo devuelve a la cola.
+  - Los enviados se purgan pasado `retention_seconds`.
+
+Los métodos son síncronos (SQLite): desde el event loop se llaman con
+`asyncio.to_thread`.
+
+Backends:
+  - SQLiteOutbox: archivo SQLite en modo WAL (por defecto). Sobrevive reinicios.
+  - MemoryOutbox: deque acotada, sin durabilidad (benchmarks, pruebas).
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+
+Entry = Tuple[int, list, list]      # (id, claves, fila)
+
+
+class MemoryOutbox:
+    """Deque acotada; si se llena descarta el evento más antiguo."""
+
+    durable = False
+
+    def __init__(self, max_pending: int = 1000, max_attempts: int = 20):
+        self.max_pending  = max_pending
+        self.max_attempts = max_attempts
+        self._items: deque = deque()
+        self._dead: deque  = deque(maxlen=max_pending)
+        self._attempts: dict = {}
+        self._lock    = threading.Lock()
+        self._next_id = 1
+        self.sent     = 0
+        self.dropped  = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    def append(self, keys: list, row: list) -> None:
+        with self._lock:
+            if len(self._items) >= self.max_pending:
+                dropped = self._items.popleft()
+                self.dropped += 1
+                print(f"Sheets cola llena, fila descartada: {dropped[2]}")
+            self._items.append((self._next_id, list(keys), list(row), time.time()))
+            self._next_id += 1
+
+    def peek(self, limit: int) -> List[Entry]:
+        with self._lock:
+            return [(i, keys, row) for i, keys, row, _ in list(self._items)[:limit]]
+
+    def ack(self, ids: List[int]) -> None:
+        done = set(ids)
+        with self._lock:
+            self._items = deque(item for item in self._items if item[0] not in done)
+            for i in done:
+                self._attempts.pop(i, None)
+            self.sent += len(done)
+
+    def fail(self, ids: List[int], error: str) -> List[int]:
+        """Registra el intento; devuelve los ids que pasaron a la cola muerta."""
+        with self._lock:
+            self.failures  += 1
+            self.last_error = error
+            dead = []
+            for i in ids:
+                self._attempts[i] = self._attempts.get(i, 0) + 1
+                if self._attempts[i] >= self.max_attempts:
+                    dead.append(i)
+            if dead:
+                exhausted = set(dead)
+                self._dead.extend(item for item in self._items if item[0] in exhausted)
+                self._items = deque(item for item in self._items if item[0] not in exhausted)
+                for i in dead:
+                    self._attempts.pop(i, None)
+            return dead
+
+    def requeue_dead(self) -> int:
+        with self._lock:
+            revived = len(self._dead)
+            self._items = deque(sorted([*self._items, *self._dead]))
+            self._dead.clear()
+            return revived
+
+    def depth(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> dict:
+        with self._lock:
+            oldest = self._items[0][3] if self._items else None
+        return {
+            "backend":      "memory",
+            "pending":      len(self._items),
+            "oldest_age_s": round(time.time() - oldest, 1) if oldest else 0.0,
+            "sent":         self.sent,
+            "dropped":      self.dropped,
+            "dead":         len(self._dead),
+            "failures":     self.failures,
+            "last_error":   self.last_error,
+        }
+
+
+class SQLiteOutbox:
+    """Registro append-only en SQLite (WAL). `sent_at` es la marca de entrega."""
+
+    durable = True
+
+    def __init__(self, path: str, retention_seconds: float = 7 * 24 * 3600, max_attempts: int = 20):
+        self.path              = path
+        self.retention_seconds = retention_seconds
+        self.max_attempts      = max_attempts
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " keys TEXT NOT NULL, row TEXT NOT NULL,"
+            " created_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " last_error TEXT, sent_at REAL, dead_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (sent_at, dead_at, id)"
+        )
+        self._conn.commit()
+
+    def append(self, keys: list, row: list) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO outbox (keys, row, created_at) VALUES (?, ?, ?)",
+                (json.dumps(keys), json.dumps(row, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def peek(self, limit: int) -> List[Entry]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, keys, row FROM outbox WHERE sent_at IS NULL AND dead_at IS NULL"
+                " ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [(i, json.loads(keys), json.loads(row)) for i, keys, row in rows]
+
+    def ack(self, ids: List[int]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET sent_at = ? WHERE id = ?", [(now, i) for i in ids]
+            )
+            if now - self._last_purge > 600:
+                self._conn.execute(
+                    "DELETE FROM outbox WHERE sent_at < ?", (now - self.retention_seconds,)
+                )
+                self._last_purge = now
+            self._conn.commit()
+
+    def fail(self, ids: List[int], error: str) -> List[int]:
+        """Registra el intento; devuelve los ids que pasaron a la cola muerta."""
+        self.last_error = error
+        marks = ",".join("?" * len(ids))
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?",
+                [(error[:500], i) for i in ids],
+            )
+            dead = [i for (i,) in self._conn.execute(
+                f"SELECT id FROM outbox WHERE id IN ({marks}) AND attempts >= ?",
+                (*ids, self.max_attempts),
+            )]
+            if dead:
+                self._conn.executemany(
+                    "UPDATE outbox SET dead_at = ? WHERE id = ?", [(time.time(), i) for i in dead]
+                )
+            self._conn.commit()
+        return dead
+
+    def requeue_dead(self) -> int:
+        with self._lock:
+            revived = self._conn.execute(
+                "UPDATE outbox SET dead_at = NULL, attempts = 0 WHERE dead_at IS NOT NULL"
+            ).rowcount
+            self._conn.commit()
+        return revived
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE sent_at IS NULL AND dead_at IS NULL"
+            ).fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending, oldest, attempts = self._conn.execute(
+                "SELECT COUNT(*), MIN(created_at), MAX(attempts) FROM outbox"
+                " WHERE sent_at IS NULL AND dead_at IS NULL"
+            ).fetchone()
+            sent, dead = self._conn.execute(
+                "SELECT COUNT(sent_at), COUNT(dead_at) FROM outbox"
+            ).fetchone()
+        return {
+            "backend":      "sqlite",
+            "path":         self.path,
+            "pending":      pending,
+            "oldest_age_s": round(time.time() - oldest, 1) if oldest else 0.0,
+            "max_attempts": attempts or 0,
+            "sent":         sent,
+            "dead":         dead,
+            "last_error":   self.last_error,
+        }
+
+
+def build_outbox():
+    """SHEETS_OUTBOX=sqlite (por defecto) | memory; SHEETS_MAX_ATTEMPTS antes de la cola muerta."""
+    kind         = os.getenv("SHEETS_OUTBOX", "sqlite").lower()
+    max_attempts = int(os.getenv("SHEETS_MAX_ATTEMPTS", "20"))
+    if kind == "memory":
+        return MemoryOutbox(int(os.getenv("SHEETS_MAX_PENDING", "1000")), max_attempts=max_attempts)
+    path = os.getenv("SHEETS_OUTBOX_PATH", "sheets_outbox.db")
+    print(f"--- BANDEJA DE SALIDA DE SHEETS: {path} ---")
+    return SQLiteOutbox(path, max_attempts=max_attempts)
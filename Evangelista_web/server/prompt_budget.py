@@ -0,0 +1,151 @@
+"""
+prompt_budget.py — Evangelista & Co.
+Ensamblado de prompts consciente del presupuesto de tokens.
+
+`estimate_tokens` aproxima el tokenizador BPE de Llama sin red ni dependencias:
+cada palabra cuesta ~1 token por cada 4 caracteres (mínimo 1) y cada signo de
+puntuación cuenta como un token. Es lo bastante fiel para decidir recortes; el
+conteo exacto lo reporta el proveedor en `usage`.
+
+`PromptAssembler` renderiza la plantilla de un agente y, si excede su presupuesto,
+recorta en orden de menor a mayor valor:
+  1. los turnos más antiguos del historial (el resumen y los últimos se conservan),
+  2. los ejemplos few-shot seleccionados, del menos al más parecido (fewshot.py);
+     sin ninguno se usa la variante sin su sección,
+  3. las secciones opcionales del prompt (few-shot examples).
+El expediente no se recorta: llega ya compacto (`LeadDossier.compact()` omite el
+razonamiento interno, nulos y defaults) y todo lo que queda decide la táctica.
+El resultado (tokens estimados, presupuesto, recortes) se anota en la traza.
+"""
+
+import json
+import re
+from typing import Iterable, List, Optional
+
+from metrics import REGISTRY, current_trace
+from templates import PromptTemplate
+
+PROMPT_TOKENS = REGISTRY.histogram(
+    "evangelista_prompt_tokens_estimated", "Tokens estimados del prompt por agente.", ("agent",),
+    buckets=(250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 12000, 16000),
+)
+PROMPT_TRIMS = REGISTRY.counter(
+    "evangelista_prompt_trims_total", "Recortes aplicados para respetar el presupuesto.",
+    ("agent", "kind"))
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    tokens = 0
+    for match in _TOKEN_RE.finditer(text):
+        length = match.end() - match.start()
+        tokens += (length + 3) // 4 if length > 1 else 1
+    return tokens
+
+
+class PromptAssembler:
+    def __init__(
+        self,
+        agent: str,
+        template: PromptTemplate,
+        budget: int,
+        history_slot: Optional[str] = None,
+        dossier_slot: Optional[str] = None,
+        optional_sections: Iterable[str] = (),
+        min_history: int = 2,
+        examples_slot: Optional[str] = None,
+    ):
+        self.agent         = agent
+        self.budget        = budget
+        self.history_slot  = history_slot
+        self.dossier_slot  = dossier_slot
+        self.examples_slot = examples_slot
+        self.min_history   = min_history
+
+        # Variantes precompiladas: completa, luego sin cada sección opcional (acumulativo)
+        self.variants: List[tuple] = [(template, None)]
+        for heading in optional_sections:
+            template = template.without_section(heading)
+            self.variants.append((template, heading))
+        # El costo de la parte estática de cada variante se calcula una sola vez
+        self._static_tokens = [
+            sum(estimate_tokens(part) for part in variant.static_segments)
+            for variant, _ in self.variants
+        ]
+        # Primera variante cuya sección de ejemplos ya no está (None si no hay tal)
+        self._bare = next(
+            (i for i, (variant, _) in enumerate(self.variants) if examples_slot not in variant.slots),
+            None,
+        ) if examples_slot else None
+
+    def assemble(self, fixed: dict, history: Optional[list] = None,
+                 dossier: Optional[dict] = None, examples: Optional[list] = None) -> str:
+        """
+        Renderiza con `fixed` (slots intocables) + expediente + historial y ejemplos
+        (ya renderizados, del más al menos parecido) recortables.
+        """
+        history  = list(history or [])
+        dossier  = dict(dossier or {})
+        examples = list(examples or [])
+        dropped  = []
+        variant  = self._bare if self._bare is not None and not examples else 0
+        # Lo fijo se mide una sola vez; en cada paso sólo se re-mide lo recortable
+        fixed_tokens = sum(estimate_tokens(v) for v in fixed.values())
+
+        def render_values() -> dict:
+            values = dict(fixed)
+            if self.history_slot:
+                values[self.history_slot] = json.dumps(history)
+            if self.dossier_slot:
+                # Codificación compacta: sin espacios ni escapes \uXXXX de los acentos
+                values[self.dossier_slot] = json.dumps(dossier, ensure_ascii=False, separators=(",", ":"))
+            if self.examples_slot:
+                values[self.examples_slot] = "\n\n".join(examples)
+            return values
+
+        def cost(values: dict) -> int:
+            slots     = self.variants[variant][0].slots
+            trimmable = sum(
+                estimate_tokens(values[slot])
+                for slot in (self.history_slot, self.dossier_slot, self.examples_slot)
+                if slot and slot in slots
+            )
+            return self._static_tokens[variant] + fixed_tokens + trimmable
+
+        values = render_values()
+        tokens = cost(values)
+        while tokens > self.budget:
+            oldest = 1 if history and history[0].get("role") == "summary" else 0
+            if len(history) - oldest > self.min_history:
+                del history[oldest]
+                dropped.append("history:1")
+                PROMPT_TRIMS.inc(self.agent, "history")
+            elif examples and self.examples_slot in self.variants[variant][0].slots:
+                examples.pop()
+                dropped.append("examples:1")
+                PROMPT_TRIMS.inc(self.agent, "examples")
+                if not examples and self._bare is not None:
+                    variant = max(variant, self._bare)
+            elif variant + 1 < len(self.variants):
+                variant += 1
+                dropped.append("section:" + self.variants[variant][1])
+                PROMPT_TRIMS.inc(self.agent, "section")
+            else:
+                break
+            values = render_values()
+            tokens = cost(values)
+
+        self._report(tokens, dropped)
+        template = self.variants[variant][0]
+        return template.render(**{slot: values[slot] for slot in template.slots})
+
+    def _report(self, tokens: int, dropped: list) -> None:
+        PROMPT_TOKENS.observe(self.agent, value=tokens)
+        trace = current_trace()
+        if trace:
+            trace.extra.setdefault("prompt_budget", {})[self.agent] = {
+                "tokens":  tokens,
+                "budget":  self.budget,
+                "dropped": dropped,
+            }
@@ -102,78 +102,196 @@ Regla sagrada. Inversión piso del Foundation: $35,000 MXN.
 - empresa (string|null): Nombre exacto de la organización.
 - dolor_declarado (string|null): Resumen ≤15 palabras del dolor operativo.
 
-# FEW-SHOT EXAMPLES (In-Context Learning)
-
-EJEMPLO 1 — Urgencia C-Level con SAP
-Historial: [Socio Digital preguntó qué problema los trajo hoy]
-Usuario: "Soy el dueño de una textilera en Puebla. Llevo 3 meses notando que mi
-inventario físico no cuadra con lo que dice SAP. Sospecho robo de material pero
-sistemas dice que todo está bien."
-Salida esperada:
-{
-  "_analisis_forense": "OBSERVE: 'dueño' → autoridad C_LEVEL. 'Textilera' → sector manufactura. '3 meses' → urgencia sostenida. 'SAP' → NUBE_DESCONECTADA. Descuadre físico vs sistema → ALMACEN_INVENTARIO. REASON: Dueño con sospecha de fuga activa = RESCATE_FORENSE con alta certeza. No menciona nombre de empresa ni precio aún. SCORE: todos los campos inferibles excepto empresa y presupuesto.",
-  "empresa": null,
-  "dolor_declarado": "Descuadre inventario físico vs SAP; sospecha robo de material.",
-  "driver_estrategico": "RESCATE_FORENSE",
-  "autoridad_detectada": "C_LEVEL",
-  "stack_tecnologico": "NUBE_DESCONECTADA",
-  "nodo_critico": "ALMACEN_INVENTARIO",
-  "red_flags": false,
-  "motivo_red_flag": null,
-  "presupuesto_validado": null
-}
-
-EJEMPLO 2 — Red Flag operativa (app móvil)
-Historial: [Socio Digital preguntó qué problema los trajo hoy]
-Usuario: "Hola, soy auxiliar de rrhh en transportes veloz. Mi jefe me pidió
-cotizar una app móvil para que choferes registren asistencia en android."
-Salida esperada:
-{
-  "_analisis_forense": "OBSERVE: 'auxiliar de rrhh' → OPERATIVO sin poder de firma. 'Transportes Veloz' → empresa identificada. Solicita 'app móvil android' → desarrollo de software a la medida. REASON: Red flag doble: perfil operativo + solicitud de app. Evangelista & Co. no es dev shop. SCORE: red_flags activado inmediatamente.",
-  "empresa": "Transportes Veloz",
-  "dolor_declarado": "Control de asistencia de choferes mediante app móvil.",
-  "driver_estrategico": "INDEFINIDO",
-  "autoridad_detectada": "OPERATIVO",
-  "stack_tecnologico": "DESCONOCIDO",
-  "nodo_critico": "PRODUCCION_LOGISTICA",
-  "red_flags": true,
-  "motivo_red_flag": "Solicita desarrollo de App Móvil a la medida (servicio no ofrecido).",
-  "presupuesto_validado": null
-}
-
-EJEMPLO 3 — Presupuesto validado (Directora de Finanzas)
-Historial previo: Ana, Directora de Finanzas de Constructora Zenith, explicó que usan
-20 Excels y cierran mes en 3 semanas. Socio Digital ancló el precio de $35,000 MXN.
-Usuario: "Sí, sin problema. Me urge la junta porque el Consejo exige reportes
-automatizados para Q3."
-Salida esperada:
-{
-  "_analisis_forense": "OBSERVE: Confirma 'sin problema' → validación explícita del presupuesto. 'Directora de Finanzas' → C_LEVEL. '20 Excels, cierre 3 semanas' → EXCEL. Presión del Consejo = ESCALABILIDAD_INSTITUCIONAL. REASON: presupuesto_validado cambia a true. SCORE: lead completamente calificado.",
-  "empresa": "Constructora Zenith",
-  "dolor_declarado": "Cierre de mes en 3 semanas con Excel; Consejo exige automatización Q3.",
-  "driver_estrategico": "ESCALABILIDAD_INSTITUCIONAL",
-  "autoridad_detectada": "C_LEVEL",
-  "stack_tecnologico": "EXCEL",
-  "nodo_critico": "FINANZAS_GOBERNANZA",
-  "red_flags": false,
-  "motivo_red_flag": null,
-  "presupuesto_validado": true
-}
-
 # OUTPUT FORMAT (STRICT)
 Tu respuesta debe ser EXCLUSIVAMENTE un objeto JSON válido.
 Empieza con { y termina con }. Sin markdown, sin texto adicional.
 
+# FEW-SHOT EXAMPLES (In-Context Learning)
+Casos resueltos parecidos al turno actual: referencia de razonamiento y de formato.
+
+{examples}
+
+# TURNO ACTUAL
 HISTORIAL DE LA CONVERSACIÓN:
 {history}
 
-ESTADO ANTERIOR DEL LEAD:
+ESTADO ANTERIOR DEL LEAD (campos ausentes = null o valor por defecto):
 {lead_state}
 
 Genera el JSON actualizado ahora:
 """
 
 
+# ==============================================================================
+# BANCO DE EJEMPLOS DEL PERFILADOR
+# Casos resueltos para el slot {examples} de PROMPT_SCRIBE (y del modo fusionado).
+# A cada prompt entran sólo los más parecidos al mensaje y al expediente
+# (fewshot.py). `state` es el expediente ANTES del mensaje; `output`, la salida
+# esperada del Perfilador.
+# ==============================================================================
+
+SCRIBE_EXAMPLES = (
+    {
+        "id": "textilera_sap",
+        "title": "Urgencia C-Level con SAP",
+        "context": "Historial: [Socio Digital preguntó qué problema los trajo hoy]",
+        "message": "Soy el dueño de una textilera en Puebla. Llevo 3 meses notando que mi "
+                   "inventario físico no cuadra con lo que dice SAP. Sospecho robo de material "
+                   "pero sistemas dice que todo está bien.",
+        "state": {},
+        "output": {
+            "_analisis_forense": "OBSERVE: 'dueño' → autoridad C_LEVEL. 'Textilera' → sector manufactura. '3 meses' → urgencia sostenida. 'SAP' → NUBE_DESCONECTADA. Descuadre físico vs sistema → ALMACEN_INVENTARIO. REASON: Dueño con sospecha de fuga activa = RESCATE_FORENSE con alta certeza. No menciona nombre de empresa ni precio aún. SCORE: todos los campos inferibles excepto empresa y presupuesto.",
+            "empresa": None,
+            "dolor_declarado": "Descuadre inventario físico vs SAP; sospecha robo de material.",
+            "driver_estrategico": "RESCATE_FORENSE",
+            "autoridad_detectada": "C_LEVEL",
+            "stack_tecnologico": "NUBE_DESCONECTADA",
+            "nodo_critico": "ALMACEN_INVENTARIO",
+            "red_flags": False,
+            "motivo_red_flag": None,
+            "presupuesto_validado": None,
+        },
+    },
+    {
+        "id": "transportes_veloz_app",
+        "title": "Red Flag operativa (app móvil)",
+        "context": "Historial: [Socio Digital preguntó qué problema los trajo hoy]",
+        "message": "Hola, soy auxiliar de rrhh en transportes veloz. Mi jefe me pidió cotizar "
+                   "una app móvil para que choferes registren asistencia en android.",
+        "state": {},
+        "output": {
+            "_analisis_forense": "OBSERVE: 'auxiliar de rrhh' → OPERATIVO sin poder de firma. 'Transportes Veloz' → empresa identificada. Solicita 'app móvil android' → desarrollo de software a la medida. REASON: Red flag doble: perfil operativo + solicitud de app. Evangelista & Co. no es dev shop. SCORE: red_flags activado inmediatamente.",
+            "empresa": "Transportes Veloz",
+            "dolor_declarado": "Control de asistencia de choferes mediante app móvil.",
+            "driver_estrategico": "INDEFINIDO",
+            "autoridad_detectada": "OPERATIVO",
+            "stack_tecnologico": "DESCONOCIDO",
+            "nodo_critico": "PRODUCCION_LOGISTICA",
+            "red_flags": True,
+            "motivo_red_flag": "Solicita desarrollo de App Móvil a la medida (servicio no ofrecido).",
+            "presupuesto_validado": None,
+        },
+    },
+    {
+        "id": "zenith_presupuesto",
+        "title": "Presupuesto validado (Directora de Finanzas)",
+        "context": "Historial previo: Ana, Directora de Finanzas de Constructora Zenith, explicó "
+                   "que usan 20 Excels y cierran mes en 3 semanas. Socio Digital ancló el precio "
+                   "de $35,000 MXN.",
+        "message": "Sí, sin problema. Me urge la junta porque el Consejo exige reportes "
+                   "automatizados para Q3.",
+        "state": {
+            "empresa": "Constructora Zenith",
+            "dolor_declarado": "Cierre de mes en 3 semanas con Excel.",
+            "driver_estrategico": "ESCALABILIDAD_INSTITUCIONAL",
+            "autoridad_detectada": "C_LEVEL",
+            "stack_tecnologico": "EXCEL",
+            "nodo_critico": "FINANZAS_GOBERNANZA",
+        },
+        "output": {
+            "_analisis_forense": "OBSERVE: Confirma 'sin problema' → validación explícita del presupuesto. 'Directora de Finanzas' → C_LEVEL. '20 Excels, cierre 3 semanas' → EXCEL. Presión del Consejo = ESCALABILIDAD_INSTITUCIONAL. REASON: presupuesto_validado cambia a true. SCORE: lead completamente calificado.",
+            "empresa": "Constructora Zenith",
+            "dolor_declarado": "Cierre de mes en 3 semanas con Excel; Consejo exige automatización Q3.",
+            "driver_estrategico": "ESCALABILIDAD_INSTITUCIONAL",
+            "autoridad_detectada": "C_LEVEL",
+            "stack_tecnologico": "EXCEL",
+            "nodo_critico": "FINANZAS_GOBERNANZA",
+            "red_flags": False,
+            "motivo_red_flag": None,
+            "presupuesto_validado": True,
+        },
+    },
+    {
+        "id": "distribuidora_aspel",
+        "title": "Gerencia con ERP legacy (compras duplicadas)",
+        "context": "Historial: [Socio Digital preguntó qué problema los trajo hoy]",
+        "message": "Soy gerente de compras en una distribuidora de abarrotes. Usamos Aspel SAE "
+                   "desde 2010 y este año descubrimos facturas de proveedores pagadas dos veces.",
+        "state": {},
+        "output": {
+            "_analisis_forense": "OBSERVE: 'gerente de compras' → GERENCIA, eficienta su área. 'Aspel SAE desde 2010' → ERP_LEGACY. 'Facturas pagadas dos veces' → fuga de flujo de caja en COMPRAS_COSTOS. REASON: Pago duplicado = hemorragia activa de capital → RESCATE_FORENSE. No da nombre de empresa ni habla de precio. SCORE: empresa y presupuesto quedan en null.",
+            "empresa": None,
+            "dolor_declarado": "Pagos duplicados a proveedores con Aspel SAE.",
+            "driver_estrategico": "RESCATE_FORENSE",
+            "autoridad_detectada": "GERENCIA",
+            "stack_tecnologico": "ERP_LEGACY",
+            "nodo_critico": "COMPRAS_COSTOS",
+            "red_flags": False,
+            "motivo_red_flag": None,
+            "presupuesto_validado": None,
+        },
+    },
+    {
+        "id": "hilados_regateo",
+        "title": "Presupuesto rechazado (regateo)",
+        "context": "Historial previo: el dueño de Hilados del Valle describió descuadres de "
+                   "inventario contra SAP. Socio Digital ancló el precio de $35,000 MXN.",
+        "message": "Es caro, no tenemos ese presupuesto ahorita. ¿No tienen algo más económico?",
+        "state": {
+            "empresa": "Hilados del Valle",
+            "dolor_declarado": "Descuadre inventario físico vs SAP.",
+            "driver_estrategico": "RESCATE_FORENSE",
+            "autoridad_detectada": "C_LEVEL",
+            "stack_tecnologico": "NUBE_DESCONECTADA",
+            "nodo_critico": "ALMACEN_INVENTARIO",
+        },
+        "output": {
+            "_analisis_forense": "OBSERVE: 'Es caro', 'no tenemos ese presupuesto' → rechazo explícito del precio piso. Pide opción 'más económica' → regateo. REASON: presupuesto_validado cambia a false. El resto del expediente se conserva: nada en el mensaje lo corrige. SCORE: sin red flag; regatear no es extraer conocimiento gratis.",
+            "empresa": "Hilados del Valle",
+            "dolor_declarado": "Descuadre inventario físico vs SAP.",
+            "driver_estrategico": "RESCATE_FORENSE",
+            "autoridad_detectada": "C_LEVEL",
+            "stack_tecnologico": "NUBE_DESCONECTADA",
+            "nodo_critico": "ALMACEN_INVENTARIO",
+            "red_flags": False,
+            "motivo_red_flag": None,
+            "presupuesto_validado": False,
+        },
+    },
+    {
+        "id": "farmacias_consejo",
+        "title": "Acompañamiento directivo (empresa madura)",
+        "context": "Historial: [Socio Digital preguntó qué problema los trajo hoy]",
+        "message": "Soy socio fundador de Farmacias del Bajío, 40 sucursales. Ya tenemos Power BI "
+                   "y Salesforce, pero el Consejo quiere simular escenarios antes de decidir "
+                   "aperturas y entender por qué perdemos clientes frecuentes.",
+        "state": {},
+        "output": {
+            "_analisis_forense": "OBSERVE: 'socio fundador' → C_LEVEL. 'Farmacias del Bajío, 40 sucursales' → empresa madura identificada. 'Power BI y Salesforce' → herramientas modernas, NUBE_DESCONECTADA. 'Simular escenarios para el Consejo' → ACOMPAÑAMIENTO_DIRECTIVO. 'Perdemos clientes frecuentes' → VENTAS_INGRESOS. REASON: Sin crisis; buscan inteligencia de alto nivel. SCORE: presupuesto aún no discutido.",
+            "empresa": "Farmacias del Bajío",
+            "dolor_declarado": "Simular aperturas para el Consejo y frenar fuga de clientes frecuentes.",
+            "driver_estrategico": "ACOMPAÑAMIENTO_DIRECTIVO",
+            "autoridad_detectada": "C_LEVEL",
+            "stack_tecnologico": "NUBE_DESCONECTADA",
+            "nodo_critico": "VENTAS_INGRESOS",
+            "red_flags": False,
+            "motivo_red_flag": None,
+            "presupuesto_validado": None,
+        },
+    },
+    {
+        "id": "estudiante_tesis",
+        "title": "Red Flag (estudiante pide asesoría gratis)",
+        "context": "Historial: [Socio Digital preguntó qué problema los trajo hoy]",
+        "message": "Soy estudiante de ingeniería industrial y mi tesis es sobre gobernanza de "
+                   "datos. ¿Me pueden explicar cómo hacen sus auditorías y pasarme una plantilla?",
+        "state": {},
+        "output": {
+            "_analisis_forense": "OBSERVE: 'estudiante', 'mi tesis' → OPERATIVO sin poder de decisión. Pide explicación de la metodología y una plantilla → extraer conocimiento sin compromiso. REASON: Red flag: estudiante haciendo tarea + asesoría gratuita. No hay empresa ni dolor operativo. SCORE: red_flags true; resto en null o DESCONOCIDO.",
+            "empresa": None,
+            "dolor_declarado": None,
+            "driver_estrategico": "INDEFINIDO",
+            "autoridad_detectada": "OPERATIVO",
+            "stack_tecnologico": "DESCONOCIDO",
+            "nodo_critico": "INDEFINIDO",
+            "red_flags": True,
+            "motivo_red_flag": "Estudiante solicita metodología y plantillas gratis para su tesis.",
+            "presupuesto_validado": None,
+        },
+    },
+)
+
+
 # ==============================================================================
 # AGENTE 2 — ESTRATEGA MAESTRO (THE CHIEF STRATEGY OFFICER)
 # Temperatura recomendada: 0.2
@@ -213,12 +331,12 @@ CAMINO A → ¿Estamos en una situación de rechazo o escalamiento de autoridad?
 CAMINO B → ¿Necesitamos más información del prospecto antes de decidir?
 CAMINO C → ¿El lead está listo para anclar precio o desbloquear agenda?
 
-Elige el camino más apropiado según el expediente forense `{lead_data}`, luego
-ejecuta las reglas en cascada del Módulo III.
+Elige el camino más apropiado según el EXPEDIENTE FORENSE (al final de este
+documento), luego ejecuta las reglas en cascada del Módulo III.
 
 # MÓDULO I: LECTURA DEL EXPEDIENTE FORENSE
 
-Analiza `{lead_data}` bajo esta óptica:
+Analiza el EXPEDIENTE FORENSE bajo esta óptica:
 
 ## Driver Estratégico:
 - RESCATE_FORENSE → Rudo, forense, urgente. Promesa: "Detener la hemorragia ahora."
@@ -302,10 +420,13 @@ Empieza con { y termina con }. Sin markdown, sin texto adicional.
   "instructions_for_voice": "<Instrucciones hiper-detalladas para el Vocero. Incluir: tono exacto, metáfora a usar (del Módulo II), y la última oración o pregunta con la que debe cerrar. Máximo 5 oraciones.>"
 }
 
+BASE DE CONOCIMIENTO (fragmentos recuperados para este mensaje; hechos verificados):
+{knowledge}
+
 HISTORIAL DE LA CONVERSACIÓN:
 {history}
 
-EXPEDIENTE FORENSE (del Perfilador):
+EXPEDIENTE FORENSE (del Perfilador; campos ausentes = null o valor por defecto):
 {lead_data}
 
 ÚLTIMO MENSAJE DEL USUARIO:
@@ -416,14 +537,6 @@ inversión necesito entender mejor su operación. ¿Qué desafío concreto lo tr
 - Usa guiones (-) solo si listas fases o entregables.
 - Los C-Levels escanean; no leen párrafos.
 
-# INSTRUCCIONES DEL ESTRATEGA (Tu comandante)
-
-El Agente 2 te envió una orden táctica. Ejecútala a la perfección.
-
-TÁCTICA A EJECUTAR: "{tactic}"
-INSTRUCCIONES ESPECÍFICAS PARA TI:
-"{instructions_for_voice}"
-
 # FEW-SHOT EXAMPLES
 
 EJEMPLO 1 — Discovery con anchoring (INVESTIGATE_DEEP)
@@ -468,6 +581,21 @@ modelo de servicio distinto al nuestro.
 Quedamos a sus órdenes cuando su organización necesite gobernar los datos que esa
 operación genera."
 
+# BASE DE CONOCIMIENTO (Fragmentos recuperados para este mensaje)
+
+Hechos verificados de Evangelista & Co. Úsalos sólo si responden a lo que el
+cliente dijo; no los recites ni inventes datos que no estén aquí o en el catálogo.
+
+{knowledge}
+
+# INSTRUCCIONES DEL ESTRATEGA (Tu comandante)
+
+El Agente 2 te envió una orden táctica. Ejecútala a la perfección.
+
+TÁCTICA A EJECUTAR: "{tactic}"
+INSTRUCCIONES ESPECÍFICAS PARA TI:
+"{instructions_for_voice}"
+
 # EJECUCIÓN
 
 Basado en todo lo anterior, redacta el mensaje final que leerá el usuario.
@@ -481,3 +609,93 @@ HISTORIAL RECIENTE:
 
 REDACTA TU RESPUESTA FINAL:
 """
+
+
+# ==============================================================================
+# AGENTES 1+2 FUSIONADOS — PERFILADOR + ESTRATEGA EN UNA SOLA LLAMADA
+# Temperatura recomendada: 0.1
+# response_format: json_object
+# Rol: Actualiza el expediente y decide la táctica en la misma completion
+# (PIPELINE_MODE=fused). Se arma con los cuerpos de PROMPT_SCRIBE y
+# PROMPT_STRATEGIST, sin sus formatos de salida ni sus slots.
+# ==============================================================================
+
+def _body(prompt: str, output_heading: str) -> str:
+    """Doctrina del prompt: todo lo anterior a su sección de formato de salida."""
+    return prompt[:prompt.index(output_heading)].strip()
+
+
+PROMPT_FUSED = (
+    r"""
+# MODO FUSIONADO (dos roles, un solo JSON)
+Ejecutas en orden los dos roles internos del Vetting Gate:
+PARTE 1 — Perfilador Forense: actualiza el expediente del lead con el mensaje nuevo.
+PARTE 2 — Director de Estrategia: elige la táctica leyendo el expediente YA
+ACTUALIZADO de la Parte 1 (no el anterior).
+Ninguno de los dos habla con el cliente.
+
+# PARTE 1 — PERFILADOR FORENSE
+"""
+    + _body(PROMPT_SCRIBE, "# OUTPUT FORMAT (STRICT)")
+    + r"""
+
+# PARTE 2 — DIRECTOR DE ESTRATEGIA
+El EXPEDIENTE FORENSE es el `dossier` que acabas de producir en la Parte 1.
+
+"""
+    + _body(PROMPT_STRATEGIST, "# OUTPUT FORMAT (JSON STRICT)")
+    + r"""
+
+# OUTPUT FORMAT (JSON STRICT)
+Tu respuesta debe ser EXCLUSIVAMENTE un objeto JSON válido con esta forma.
+Empieza con { y termina con }. Sin markdown, sin texto adicional.
+
+{
+  "dossier": { <expediente completo de la Parte 1, mismos campos que sus ejemplos, incluido "_analisis_forense"> },
+  "analisis_estrategico": "<Razonamiento CoT de la Parte 2: camino (A/B/C), regla aplicada y metáfora.>",
+  "tactic": "<TÁCTICA_EXACTA_DEL_MÓDULO_III>",
+  "instructions_for_voice": "<Instrucciones para el Vocero. Máximo 5 oraciones.>"
+}
+
+# FEW-SHOT EXAMPLES (In-Context Learning)
+Casos resueltos de la Parte 1 parecidos al turno actual: referencia de razonamiento
+y de formato para el `dossier`.
+
+{examples}
+
+# TURNO ACTUAL
+BASE DE CONOCIMIENTO (fragmentos recuperados para este mensaje; hechos verificados):
+{knowledge}
+
+HISTORIAL DE LA CONVERSACIÓN:
+{history}
+
+ESTADO ANTERIOR DEL LEAD (campos ausentes = null o valor por defecto):
+{lead_state}
+
+Genera el JSON ahora:
+"""
+)
+
+
+# ==============================================================================
+# PLANTILLAS PRECOMPILADAS
+# Se analizan una sola vez al importar; un placeholder desconocido o ausente
+# detiene el arranque en lugar de llegar al modelo.
+# ==============================================================================
+
+from templates import PromptTemplate  # noqa: E402
+
+SCRIBE_TEMPLATE = PromptTemplate(
+    "scribe", PROMPT_SCRIBE, ("examples", "history", "lead_state"),
+)
+STRATEGIST_TEMPLATE = PromptTemplate(
+    "strategist", PROMPT_STRATEGIST, ("knowledge", "history", "lead_data", "last_message"),
+)
+FUSED_TEMPLATE = PromptTemplate(
+    "fused", PROMPT_FUSED, ("examples", "knowledge", "history", "lead_state"),
+)
+VOICE_TEMPLATE = PromptTemplate(
+    "voice", PROMPT_VOICE,
+    ("knowledge", "tactic", "instructions_for_voice", "history", "last_message"),
+)
@@ -0,0 +1,362 @@
+"""
+resilience.py — Evangelista & Co.
+Capa de llamadas resiliente alrededor del proveedor LLM.
+
+Cuando Groq se degrada, las llamadas sin timeout se apilan hasta que el `except`
+genérico de cada agente las recoge, con una cola de latencia sin techo. Esta capa
+envuelve al proveedor (igual que InstrumentedProvider) y acota cada llamada:
+
+  - Deadline por agente: tope total para la llamada, reintentos incluidos.
+  - Reintentos acotados con backoff exponencial y jitter completo, sólo para
+    errores transitorios (timeouts, conexión, 429, 5xx); cualquier otra
+    excepción es un bug y sube al primer intento. Tras un 429 se espera al
+    menos lo que pida Retry-After.
+  - Hedging (sólo `complete`, opt-in con LLM_HEDGE=1): si la primera llamada no
+    responde tras el p95 observado del agente, se lanza una segunda idéntica y
+    gana la primera que termine; la otra se cancela. Duplica llamadas justo
+    cuando el proveedor va lento, así que sólo conviene con cuota de sobra.
+  - Circuit breaker por agente: tras N fallos seguidos se abre y las llamadas
+    van directo al modelo de respaldo (más pequeño) hasta que una sonda en
+    semiabierto tenga éxito. Sin modelo de respaldo, la llamada falla rápido y
+    el agente usa su respuesta enlatada (los `except` de main.py).
+
+En streaming sólo se reintenta antes del primer token; una vez que el Vocero
+empezó a hablar no se puede repetir la respuesta.
+
+El control de admisión (admission.py) va por dentro: cada intento y cada hedge
+pide su cupo. Un AdmissionRejected sube tal cual (main.py responde 429/503): no
+se reintenta ni cuenta como fallo del breaker.
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional
+
+from admission import AdmissionRejected, retry_after
+from llm import AGENTS, LLMProvider, LLMResult
+from metrics import REGISTRY, record_fallback, record_retry
+
+LLM_CALLS = REGISTRY.counter(
+    "evangelista_llm_calls_total", "Llamadas al proveedor LLM por resultado.", ("agent", "outcome"))
+BREAKER_STATE = REGISTRY.gauge(
+    "evangelista_llm_breaker_state", "Circuit breaker por agente (0 cerrado, 1 abierto, 2 semiabierto).",
+    ("agent",))
+
+
+class CircuitOpenError(RuntimeError):
+    """El breaker está abierto y no hay modelo de respaldo."""
+
+
+def is_transient(error: BaseException) -> bool:
+    """Sólo timeouts, errores de conexión, 429 y 5xx merecen otro intento."""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    try:
+        from groq import APIConnectionError     # incluye APITimeoutError
+    except ImportError:
+        return False
+    return isinstance(error, APIConnectionError)
+
+
+@dataclass
+class CallPolicy:
+    timeout:        float             # deadline total por llamada (s)
+    attempt_timeout: float            # tope por intento (s)
+    retries:        int = 2
+    backoff_base:   float = 0.25
+    backoff_max:    float = 2.0
+    hedge:          bool = False
+    hedge_min_ms:   float = 300.0     # nunca se cubre antes de este retardo
+    fallback_model: Optional[str] = None
+
+
+POLICY_DEFAULTS = {
+    "scribe":     CallPolicy(timeout=8.0, attempt_timeout=5.0),
+    "strategist": CallPolicy(timeout=8.0, attempt_timeout=5.0),
+    "voice":      CallPolicy(timeout=12.0, attempt_timeout=8.0),
+    "fused":      CallPolicy(timeout=10.0, attempt_timeout=7.0),   # prompt y salida más largos
+}
+
+
+def load_policies() -> Dict[str, CallPolicy]:
+    """LLM_* globales y overrides <AGENTE>_TIMEOUT_S / <AGENTE>_FALLBACK_MODEL."""
+    policies = {}
+    for agent in AGENTS:
+        default = POLICY_DEFAULTS[agent]
+        prefix  = agent.upper()
+        policies[agent] = CallPolicy(
+            timeout=float(os.getenv(f"{prefix}_TIMEOUT_S", default.timeout)),
+            attempt_timeout=float(os.getenv(f"{prefix}_ATTEMPT_TIMEOUT_S", default.attempt_timeout)),
+            retries=int(os.getenv("LLM_RETRIES", default.retries)),
+            hedge=os.getenv("LLM_HEDGE", "0") == "1",
+            hedge_min_ms=float(os.getenv("LLM_HEDGE_MIN_MS", default.hedge_min_ms)),
+            fallback_model=os.getenv(f"{prefix}_FALLBACK_MODEL", os.getenv("LLM_FALLBACK_MODEL")) or None,
+        )
+    return policies
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    def __init__(self, agent: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.agent             = agent
+        self.failure_threshold = failure_threshold
+        self.reset_timeout     = reset_timeout
+        self.state     = self.CLOSED
+        self.failures  = 0
+        self.opened_at = 0.0
+        self._probing  = False
+
+    def allow(self) -> bool:
+        """¿Puede ir esta llamada al modelo principal?"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set(self.HALF_OPEN)
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True        # una sola sonda a la vez
+            return True
+        return False
+
+    def release(self) -> None:
+        """La sonda se canceló sin resultado: otra llamada puede probar."""
+        self._probing = False
+
+    def success(self) -> None:
+        self.failures = 0
+        self._probing = False
+        if self.state != self.CLOSED:
+            print(f"Circuit breaker {self.agent}: cerrado")
+            self._set(self.CLOSED)
+
+    def failure(self) -> None:
+        self.failures += 1
+        self._probing  = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                print(f"Circuit breaker {self.agent}: ABIERTO tras {self.failures} fallos")
+            self.opened_at = time.monotonic()
+            self._set(self.OPEN)
+
+    def _set(self, state: int) -> None:
+        self.state = state
+        BREAKER_STATE.set(self.agent, value=state)
+
+
+class LatencyTracker:
+    """p95 móvil de las llamadas exitosas de un agente (para decidir el hedge)."""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        if len(self._samples) < 20:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+
+class ResilientProvider(LLMProvider):
+    def __init__(
+        self,
+        inner: LLMProvider,
+        policies: Optional[Dict[str, CallPolicy]] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        seed: Optional[int] = None,
+    ):
+        self.inner     = inner
+        self.configs   = inner.configs
+        self.name      = inner.name
+        self.policies  = policies or load_policies()
+        self.breakers  = {a: CircuitBreaker(a, failure_threshold, reset_timeout) for a in self.policies}
+        self.latencies = {a: LatencyTracker() for a in self.policies}
+        self._rng      = random.Random(seed)
+
+    # --------------------------------------------------------------------------
+    # Selección de modelo
+    # --------------------------------------------------------------------------
+
+    def _route(self, agent: str) -> Optional[str]:
+        """None = modelo principal; si el breaker está abierto, el de respaldo."""
+        if self.breakers[agent].allow():
+            return None
+        fallback = self.policies[agent].fallback_model
+        if not fallback:
+            LLM_CALLS.inc(agent, "circuit_open")
+            raise CircuitOpenError(f"{agent}: circuit breaker abierto")
+        LLM_CALLS.inc(agent, "fallback_model")
+        record_fallback(f"{agent}_model")
+        return fallback
+
+    def _backoff(self, policy: CallPolicy, attempt: int, error: BaseException) -> float:
+        """Jitter completo; tras un 429, nunca menos que su Retry-After."""
+        delay = self._rng.uniform(0, min(policy.backoff_max, policy.backoff_base * (2 ** attempt)))
+        return max(delay, retry_after(error) or 0.0)
+
+    def _outcome(self, agent: str, model: Optional[str], ok: bool) -> None:
+        """Sólo el modelo principal alimenta al breaker."""
+        if model is None:
+            (self.breakers[agent].success if ok else self.breakers[agent].failure)()
+
+    # --------------------------------------------------------------------------
+    # complete: deadline + reintentos + hedging
+    # --------------------------------------------------------------------------
+
+    async def complete(self, agent: str, messages: list, model: Optional[str] = None) -> LLMResult:
+        policy   = self.policies[agent]
+        model    = model or self._route(agent)
+        deadline = time.monotonic() + policy.timeout
+        attempt  = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                result = await self._hedged(agent, messages, model, min(policy.attempt_timeout, remaining))
+            except (asyncio.CancelledError, AdmissionRejected):
+                if model is None:
+                    self.breakers[agent].release()
+                raise
+            except Exception as e:
+                outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+                LLM_CALLS.inc(agent, outcome)
+                delay = self._backoff(policy, attempt, e)
+                if (
+                    attempt >= policy.retries
+                    or not is_transient(e)
+                    or deadline - time.monotonic() <= delay
+                ):
+                    self._outcome(agent, model, ok=False)
+                    raise
+                attempt += 1
+                record_retry(agent)
+                await asyncio.sleep(delay)
+                continue
+            self._outcome(agent, model, ok=True)
+            LLM_CALLS.inc(agent, "ok")
+            return result
+
+    def _hedge_delay(self, agent: str) -> Optional[float]:
+        policy = self.policies[agent]
+        p95    = self.latencies[agent].p95()
+        if not policy.hedge or p95 is None:
+            return None
+        return max(p95, policy.hedge_min_ms / 1000)
+
+    async def _hedged(self, agent: str, messages: list, model: Optional[str], timeout: float) -> LLMResult:
+        started  = time.monotonic()
+        primary  = asyncio.ensure_future(self.inner.complete(agent, messages, model=model))
+        launched = [primary]
+        hedge_delay = self._hedge_delay(agent)
+        try:
+            if hedge_delay is not None and hedge_delay < timeout:
+                done, _ = await asyncio.wait(launched, timeout=hedge_delay)
+                if not done:
+                    LLM_CALLS.inc(agent, "hedge_fired")
+                    launched.append(asyncio.ensure_future(self.inner.complete(agent, messages, model=model)))
+            pending = set(launched)
+            error   = None
+            while pending:
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    raise asyncio.TimeoutError(f"{agent}: sin respuesta en {timeout:.1f}s")
+                done, pending = await asyncio.wait(
+                    pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            LLM_CALLS.inc(agent, "hedge_won")
+                        self.latencies[agent].add(time.monotonic() - started)
+                        result = task.result()
+                        if model:
+                            result.fallback = True
+                        return result
+                    error = task.exception()
+            raise error
+        finally:
+            for task in launched:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()        # marca la excepción como consumida
+
+    # --------------------------------------------------------------------------
+    # stream: reintentos sólo antes del primer token
+    # --------------------------------------------------------------------------
+
+    async def stream(self, agent: str, messages: list, model: Optional[str] = None) -> AsyncIterator[str]:
+        policy   = self.policies[agent]
+        model    = model or self._route(agent)
+        deadline = time.monotonic() + policy.timeout
+        attempt  = 0
+        while True:
+            emitted = False
+            tokens  = self.inner.stream(agent, messages, model=model)
+            try:
+                while True:
+                    # Primer token: tope por intento; después, lo que quede del deadline
+                    limit = deadline - time.monotonic()
+                    if not emitted:
+                        limit = min(policy.attempt_timeout, limit)
+                    try:
+                        token = await asyncio.wait_for(tokens.__anext__(), timeout=max(limit, 0.001))
+                    except StopAsyncIteration:
+                        break
+                    emitted = True
+                    yield token
+            except (asyncio.CancelledError, GeneratorExit, AdmissionRejected):
+                # Cancelado, cerrado por el consumidor o sin cupo: la sonda no dio resultado
+                if model is None:
+                    self.breakers[agent].release()
+                raise
+            except Exception as e:
+                LLM_CALLS.inc(agent, "timeout" if isinstance(e, asyncio.TimeoutError) else "error")
+                delay = self._backoff(policy, attempt, e)
+                if (
+                    emitted
+                    or attempt >= policy.retries
+                    or not is_transient(e)
+                    or deadline - time.monotonic() <= delay
+                ):
+                    self._outcome(agent, model, ok=False)
+                    raise
+                attempt += 1
+                record_retry(agent)
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                await tokens.aclose()
+            self._outcome(agent, model, ok=True)
+            LLM_CALLS.inc(agent, "ok")
+            return
+
+    def status(self) -> dict:
+        return {
+            agent: {
+                "breaker":  ("closed", "open", "half_open")[breaker.state],
+                "failures": breaker.failures,
+                "p95_ms":   round(p95 * 1000, 1) if (p95 := self.latencies[agent].p95()) else None,
+            }
+            for agent, breaker in self.breakers.items()
+        }
+
+
+def build_resilient(inner: LLMProvider) -> LLMProvider:
+    """LLM_RESILIENCE=1 (por defecto) envuelve al proveedor; 0 lo deja tal cual."""
+    if os.getenv("LLM_RESILIENCE", "1") != "1":
+        return inner
+    return ResilientProvider(
+        inner,
+        failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+        reset_timeout=float(os.getenv("LLM_BREAKER_RESET_S", "30")),
+    )
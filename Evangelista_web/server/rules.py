@@ -0,0 +1,178 @@
+"""
+rules.py — Evangelista & Co.
+Vía rápida determinista: reglas que resuelven la táctica sin llamar al Estratega.
+
+Algunos turnos tienen un desenlace fijo que el Estratega (70B) sólo confirma:
+  - el expediente ya trae red_flags → REJECT_AND_REDIRECT (Regla 1 del Módulo III),
+  - el prospecto es OPERATIVO → THE_AUTHORITY_ESCALATION (Regla 2),
+  - el mensaje sólo trae un correo/teléfono, aún falta diagnóstico y el presupuesto
+    no está validado → INVESTIGATE_DEEP.
+
+Cada regla devuelve la misma forma que el Estratega (`tactic` +
+`instructions_for_voice`) y, opcionalmente, una respuesta plantilla (`reply`) que
+también evita al Vocero. Las reglas con `before_scribe=True` se evalúan contra el
+expediente anterior y saltan además al Perfilador (hoy sólo contact_only). red_flags
+espera al Perfilador: el mensaje nuevo puede aclarar el malentendido y limpiar la
+bandera, y con el expediente anterior nunca se limpiaría.
+
+FAST_RULES=red_flags,contact_only,authority (por defecto) | off
+Cada disparo se cuenta en `evangelista_fast_path_total{rule, stage}`.
+"""
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from contacts import strip_contacts
+from dossier import Authority, LeadDossier
+from metrics import REGISTRY, current_trace
+
+RULE_HITS = REGISTRY.counter(
+    "evangelista_fast_path_total", "Turnos resueltos por la vía rápida de reglas.",
+    ("rule", "stage"))
+
+
+@dataclass
+class Rule:
+    name:          str
+    condition:     Callable[[str, LeadDossier, dict], bool]   # (mensaje, expediente, contacto)
+    tactic:        str
+    instructions:  str
+    reply:         Optional[str] = None    # respuesta plantilla: también se omite al Vocero
+    before_scribe: bool = False            # puede decidirse con el expediente anterior
+
+    def strategy(self) -> dict:
+        strategy = {
+            "tactic":                 self.tactic,
+            "instructions_for_voice": self.instructions,
+            "fast_path":              self.name,
+        }
+        if self.reply:
+            strategy["reply"] = self.reply
+        return strategy
+
+
+# ==============================================================================
+# CONDICIONES
+# ==============================================================================
+
+# Palabras de relleno que acompañan a un dato de contacto ("mi correo es …")
+_FILLER_RE = re.compile(
+    r"\b(mi|mis|es|son|el|la|y|o|de|aqui|aquí|esta|está|les|dejo|comparto|paso|"
+    r"correo|mail|email|e-mail|tel|telefono|teléfono|cel|celular|whatsapp|numero|"
+    r"número|contacto|datos|gracias)\b",
+    re.I,
+)
+_LEFTOVER_RE = re.compile(r"[\W_]*")
+
+
+def contact_only(message: str, memory: LeadDossier, contact: dict) -> bool:
+    """
+    El mensaje no aporta nada más que datos de contacto y aún falta diagnóstico.
+    Un lead con presupuesto validado nunca cae aquí: su correo no debe tapar el
+    ALLOW_MEETING que le toca al Estratega.
+    """
+    if not contact or memory.presupuesto_validado:
+        return False
+    if memory.empresa and memory.dolor_declarado:
+        return False
+    rest = _FILLER_RE.sub(" ", strip_contacts(message))
+    return _LEFTOVER_RE.fullmatch(rest) is not None
+
+
+def has_red_flags(message: str, memory: LeadDossier, contact: dict) -> bool:
+    return memory.red_flags
+
+
+def is_operative(message: str, memory: LeadDossier, contact: dict) -> bool:
+    return memory.autoridad_detectada is Authority.OPERATIVO and not memory.red_flags
+
+
+# ==============================================================================
+# REGLAS (en el mismo orden de cascada que el Módulo III)
+# ==============================================================================
+
+RULES: List[Rule] = [
+    Rule(
+        name="red_flags",
+        condition=has_red_flags,
+        tactic="REJECT_AND_REDIRECT",
+        instructions=(
+            "Rechazo firme, elegante y aséptico. Aclarar que somos arquitectos de "
+            "inteligencia de negocios, no fábrica de software. Cerrar la conversación."
+        ),
+        reply=(
+            "Evangelista & Co. diseña Arquitecturas de Inteligencia de Negocios y ejecuta "
+            "auditorías forenses de datos; no somos una fábrica de software a la medida.\n\n"
+            "Lo que describe requiere un modelo de servicio distinto al nuestro.\n\n"
+            "Quedamos a sus órdenes cuando su organización necesite gobernar los datos "
+            "que esa operación genera."
+        ),
+    ),
+    Rule(
+        name="contact_only",
+        condition=contact_only,
+        tactic="INVESTIGATE_DEEP",
+        instructions=(
+            "Confirmar que se registraron sus datos de contacto. Pedir nombre de firma "
+            "y nodo exacto de pérdida."
+        ),
+        reply=(
+            "Datos registrados. Un Socio Senior tiene ya su contacto.\n\n"
+            "Para que la conversación con Dirección sea productiva: ¿cuál es el nombre "
+            "de su firma y en qué punto exacto de la operación detecta la pérdida?"
+        ),
+        before_scribe=True,
+    ),
+    Rule(
+        name="authority",
+        condition=is_operative,
+        tactic="THE_AUTHORITY_ESCALATION",
+        instructions=(
+            "Reconocer la carga del usuario. Indicar que la solución requiere aprobación "
+            "financiera de la alta dirección. Solicitar que la Cita de Scoping se agende "
+            "con el Director General o CFO."
+        ),
+    ),
+]
+
+
+class RulesEngine:
+    """Evalúa las reglas habilitadas en orden; la primera que aplica gana."""
+
+    def __init__(self, rules: List[Rule]):
+        self.rules = rules
+        self.hits: Dict[str, int] = {rule.name: 0 for rule in rules}
+
+    def first(self, message: str, memory: LeadDossier, contact: dict,
+              before_scribe: bool = False) -> Optional[Rule]:
+        """La regla que aplicaría, sin contarla (para decidir si vale la pena especular)."""
+        for rule in self.rules:
+            if before_scribe and not rule.before_scribe:
+                continue
+            if rule.condition(message, memory or LeadDossier(), contact or {}):
+                return rule
+        return None
+
+    def match(self, message: str, memory: LeadDossier, contact: dict,
+              before_scribe: bool = False) -> Optional[dict]:
+        rule = self.first(message, memory, contact, before_scribe)
+        if rule is None:
+            return None
+        stage = "pre_scribe" if before_scribe else "pre_strategist"
+        self.hits[rule.name] += 1
+        RULE_HITS.inc(rule.name, stage)
+        trace = current_trace()
+        if trace:
+            trace.extra["fast_path"] = {"rule": rule.name, "stage": stage}
+        return rule.strategy()
+
+
+def build_rules_engine() -> RulesEngine:
+    """FAST_RULES: lista separada por comas de reglas habilitadas, u `off`."""
+    enabled = os.getenv("FAST_RULES", ",".join(rule.name for rule in RULES)).lower()
+    if enabled in ("off", "none", ""):
+        return RulesEngine([])
+    names = {name.strip() for name in enabled.split(",")}
+    return RulesEngine([rule for rule in RULES if rule.name in names])
@@ -0,0 +1,166 @@
+"""
+sessions.py — Evangelista & Co.
+Almacén de sesiones del lado del servidor.
+
+El servidor guarda el historial canónico y el expediente del lead por sesión, de
+modo que el navegador sólo envía `session_id` + mensaje nuevo en cada turno.
+
+Backends:
+  - MemorySessionStore: LRU en memoria con expiración por TTL (por defecto).
+  - SQLiteSessionStore: archivo SQLite local, sobrevive reinicios del worker.
+
+`blocking` indica si el backend toca disco: main.py llama a esos con
+`asyncio.to_thread` y al de memoria directamente en el event loop.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+def empty_session() -> dict:
+    return {"history": [], "summary": "", "lead_data": {}}
+
+
+class SessionStore:
+    """Interfaz mínima que debe cumplir cualquier backend de sesiones."""
+
+    blocking = False
+
+    def get(self, session_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def save(self, session_id: str, session: dict) -> None:
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def update(self, session_id: str, change: Callable[[Optional[dict]], Optional[dict]]) -> None:
+        """Lee, transforma y guarda sin que otro `save` se cuele; `change` → None no guarda."""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """LRU acotado por número de sesiones; cada sesión expira tras `ttl_seconds`."""
+
+    def __init__(self, max_sessions: int = 5000, ttl_seconds: float = 6 * 3600):
+        self.max_sessions = max_sessions
+        self.ttl_seconds  = ttl_seconds
+        self._data: OrderedDict = OrderedDict()   # id -> (expira_en, sesión)
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            item = self._data.get(session_id)
+            if item is None:
+                return None
+            expires_at, session = item
+            if expires_at < time.monotonic():
+                del self._data[session_id]
+                return None
+            self._data.move_to_end(session_id)
+            return session
+
+    def save(self, session_id: str, session: dict) -> None:
+        with self._lock:
+            self._data[session_id] = (time.monotonic() + self.ttl_seconds, session)
+            self._data.move_to_end(session_id)
+            while len(self._data) > self.max_sessions:
+                self._data.popitem(last=False)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._data.pop(session_id, None)
+
+    def update(self, session_id: str, change: Callable[[Optional[dict]], Optional[dict]]) -> None:
+        session = change(self.get(session_id))    # en el loop: nada se intercala
+        if session is not None:
+            self.save(session_id, session)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Persistencia en un archivo SQLite (modo WAL). Expira sesiones por TTL."""
+
+    blocking = True
+
+    def __init__(self, path: str, ttl_seconds: float = 6 * 3600):
+        self.path        = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, updated_at FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        data, updated_at = row
+        if updated_at + self.ttl_seconds < time.time():
+            self.delete(session_id)
+            return None
+        return json.loads(data)
+
+    def save(self, session_id: str, session: dict) -> None:
+        payload = json.dumps(session, ensure_ascii=False)
+        with self._lock:
+            self._write(session_id, payload)
+
+    def _write(self, session_id: str, payload: str) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sessions (id, data, updated_at) VALUES (?, ?, ?)",
+            (session_id, payload, time.time()),
+        )
+        self._conn.commit()
+
+    def update(self, session_id: str, change: Callable[[Optional[dict]], Optional[dict]]) -> None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, updated_at FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            current = None
+            if row is not None and row[1] + self.ttl_seconds >= time.time():
+                current = json.loads(row[0])
+            session = change(current)
+            if session is not None:
+                self._write(session_id, json.dumps(session, ensure_ascii=False))
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM sessions WHERE updated_at < ?",
+                (time.time() - self.ttl_seconds,),
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+
+def build_session_store() -> SessionStore:
+    """Elige backend según SESSION_BACKEND (memory | sqlite)."""
+    backend = os.getenv("SESSION_BACKEND", "memory").lower()
+    ttl     = float(os.getenv("SESSION_TTL_SECONDS", str(6 * 3600)))
+    if backend == "sqlite":
+        path = os.getenv("SESSION_DB_PATH", "sessions.db")
+        print(f"--- SESIONES EN SQLITE: {path} ---")
+        return SQLiteSessionStore(path, ttl_seconds=ttl)
+    return MemorySessionStore(
+        max_sessions=int(os.getenv("SESSION_MAX", "5000")),
+        ttl_seconds=ttl,
+    )
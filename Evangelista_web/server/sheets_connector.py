@@ -0,0 +1,117 @@
+"""
+sheets_connector.py — Evangelista & Co.
+Conexión perezosa y auto-recuperable a Google Sheets.
+
+Antes, main.py autorizaba gspread y abría DB_Leads_Evangelista de forma síncrona
+al importar: cada arranque de worker pagaba esos round-trips y, si Google fallaba
+en ese momento, el worker quedaba con `sheet_db = None` para siempre.
+
+Ahora la conexión vive en una tarea de fondo lanzada desde el lifespan de FastAPI:
+  - el worker sirve peticiones de inmediato; las filas esperan en SheetsWriter,
+  - si la conexión falla se reintenta con backoff exponencial,
+  - si una escritura falla, `mark_broken()` fuerza una reconexión,
+  - la credencial se refresca periódicamente (`refresh_interval`).
+"""
+
+import asyncio
+import json
+import time
+from typing import Optional
+
+SCOPE = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/drive",
+]
+
+
+class SheetsConnector:
+    DISABLED   = "disabled"
+    CONNECTING = "connecting"
+    CONNECTED  = "connected"
+    ERROR      = "error"
+
+    def __init__(
+        self,
+        creds_json: Optional[str],
+        sheet_name: str = "DB_Leads_Evangelista",
+        retry_min: float = 2.0,
+        retry_max: float = 300.0,
+        refresh_interval: float = 1800.0,
+    ):
+        self.creds_json       = creds_json
+        self.sheet_name       = sheet_name
+        self.retry_min        = retry_min
+        self.retry_max        = retry_max
+        self.refresh_interval = refresh_interval
+
+        self.sheet                        = None
+        self.state                        = self.CONNECTING if creds_json else self.DISABLED
+        self.last_error: Optional[str]    = None
+        self.connected_at: Optional[float] = None
+        self._broken = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.state != self.DISABLED
+
+    def use(self, sheet) -> None:
+        """Inyecta una hoja ya abierta (pruebas, benchmarks)."""
+        self.sheet        = sheet
+        self.state        = self.CONNECTED
+        self.connected_at = time.time()
+
+    def mark_broken(self, error: Exception) -> None:
+        """Llamado desde el hilo de escritura cuando una operación falla."""
+        self.last_error = str(error)
+        self.state      = self.ERROR
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._broken.set)
+
+    def _connect(self):
+        """Bloqueante: se ejecuta en un hilo vía asyncio.to_thread."""
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+
+        creds     = ServiceAccountCredentials.from_json_keyfile_dict(json.loads(self.creds_json), SCOPE)
+        client_gs = gspread.authorize(creds)
+        return client_gs.open(self.sheet_name).sheet1
+
+    async def run(self) -> None:
+        """Tarea de fondo: conecta, reconecta cuando se rompe y refresca periódicamente."""
+        if not self.creds_json:
+            return          # deshabilitado, o con una hoja inyectada vía use()
+        self._loop = asyncio.get_running_loop()
+        delay = self.retry_min
+        while True:
+            try:
+                self.state = self.CONNECTING if self.sheet is None else self.state
+                sheet = await asyncio.to_thread(self._connect)
+                self.sheet, self.state = sheet, self.CONNECTED
+                self.connected_at, self.last_error = time.time(), None
+                delay = self.retry_min
+                print("--- CONEXIÓN EXITOSA A GOOGLE SHEETS ---")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.state, self.last_error = self.ERROR, str(e)
+                print(f"Error Google (reintento en {delay:.0f}s): {e}")
+                await asyncio.sleep(delay)
+                delay = min(self.retry_max, delay * 2)
+                continue
+
+            # Conectado: esperar a que se rompa o a que toque refrescar credenciales
+            self._broken.clear()
+            try:
+                await asyncio.wait_for(self._broken.wait(), timeout=self.refresh_interval)
+                print(f"Sheets marcado como caído, reconectando: {self.last_error}")
+            except asyncio.TimeoutError:
+                pass
+
+    def status(self) -> dict:
+        return {
+            "state":        self.state,
+            "sheet":        self.sheet_name,
+            "connected_at": self.connected_at,
+            "last_error":   self.last_error,
+        }
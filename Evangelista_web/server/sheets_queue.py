@@ -0,0 +1,276 @@
+"""
+sheets_queue.py — Evangelista & Co.
+Escritor write-behind para Google Sheets.
+
+gspread es síncrono: cada append_row bloquea el event loop de uvicorn durante un
+round-trip HTTPS completo a Google. Este módulo registra las filas en una bandeja
+de salida local (outbox.py) y un hilo de fondo la drena en lotes.
+
+Política de flush: se envía un lote cuando hay `batch_size` filas pendientes o
+cuando pasan `flush_interval` segundos desde la primera fila encolada. Si el
+envío falla, las filas se quedan en la bandeja y se reintenta con backoff
+exponencial. Tras un lote fallido las filas salen de una en una hasta cubrirlo,
+así una fila envenenada (la hoja la rechaza siempre) sólo frena su propio envío:
+acumula intentos ella sola y, al agotar SHEETS_MAX_ATTEMPTS, pasa a la cola
+muerta de la bandeja (no se borra). Con la hoja desconectada no se cuentan
+intentos. Al arrancar se drena primero lo que haya quedado de ejecuciones
+anteriores.
+
+Upserts: una fila encolada con claves de lead (ver leads.py) actualiza en sitio la
+fila existente de ese lead. Dentro de un lote, las filas del mismo lead se fusionan
+antes de enviarse. Por lote hay a lo sumo un `batch_update` (actualizaciones) y un
+`append_rows` (leads nuevos).
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from leads import KEY_COLUMN, KEY_SEPARATOR, LeadIndex, appended_start_row, merge_rows
+from metrics import REGISTRY, RETRIES, observe_stage
+from outbox import MemoryOutbox
+
+SHEETS_ROWS = REGISTRY.counter(
+    "evangelista_sheets_rows_total", "Filas enviadas a Sheets por operación.", ("op",))
+SHEETS_DEAD_LETTER = REGISTRY.counter(
+    "evangelista_sheets_dead_letter_total", "Filas apartadas a la cola muerta tras agotar sus intentos.")
+
+
+class SheetsWriter:
+    """Bandeja de salida + hilo drenador que agrupa filas en llamadas a la hoja."""
+
+    def __init__(
+        self,
+        get_sheet: Callable[[], object],
+        outbox=None,
+        batch_size: int = 20,
+        flush_interval: float = 2.0,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        on_failure: Optional[Callable[[Exception], None]] = None,
+        index: Optional[LeadIndex] = None,
+    ):
+        self._get_sheet     = get_sheet
+        self.outbox         = outbox if outbox is not None else MemoryOutbox()
+        self.batch_size     = batch_size
+        self.flush_interval = flush_interval
+        self.backoff_base   = backoff_base
+        self.backoff_max    = backoff_max
+        self._on_failure    = on_failure
+        self.index          = index
+
+        self._cond           = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping       = False
+        self._queued         = 0      # filas llegadas desde el último lote
+        self._first_enqueued = 0.0
+
+        # Contadores operativos
+        self.rows_written = 0
+        self.rows_updated = 0
+        self.rows_merged  = 0
+        self.batches_sent = 0
+        self.retries      = 0
+        self.dead_letters = 0
+
+    # --------------------------------------------------------------------------
+    # API pública (nunca bloquea en red; la bandeja SQLite sí toca disco, así que
+    # desde el event loop se llama con asyncio.to_thread)
+    # --------------------------------------------------------------------------
+
+    def enqueue(self, row: list, keys: Optional[List[str]] = None) -> None:
+        """
+        Registra una fila en la bandeja. Con `keys` (claves del lead) se hace
+        upsert; sin ellas se anexa.
+        """
+        self.outbox.append(list(keys or ()), row)
+        with self._cond:
+            if not self._queued:
+                self._first_enqueued = time.monotonic()
+            self._queued += 1
+            # Despierta al hilo con la primera fila (para que arranque el plazo de
+            # flush) y cuando se completa un lote.
+            if self._queued == 1 or self._queued >= self.batch_size:
+                self._cond.notify()
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        # Lo que quedó en la bandeja de una ejecución anterior sale de inmediato
+        self._queued         = self.outbox.depth()
+        self._first_enqueued = 0.0
+        self._thread = threading.Thread(target=self._run, name="sheets-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Detiene el hilo tras un último intento de vaciar la bandeja. Lo que no se
+        pueda enviar permanece en ella (si es durable) para el próximo arranque.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def pending(self) -> int:
+        return self.outbox.depth()
+
+    def stats(self) -> dict:
+        return {
+            **self.outbox.stats(),
+            "rows_written": self.rows_written,
+            "rows_updated": self.rows_updated,
+            "rows_merged":  self.rows_merged,
+            "batches_sent": self.batches_sent,
+            "retries":      self.retries,
+            "dead_letters": self.dead_letters,
+        }
+
+    # --------------------------------------------------------------------------
+    # Hilo drenador
+    # --------------------------------------------------------------------------
+
+    def _wait_for_flush(self) -> None:
+        """Espera a que toque flush (lote lleno, plazo vencido) o a que se pida parar."""
+        with self._cond:
+            while not self._stopping:
+                if self._queued:
+                    waited = time.monotonic() - self._first_enqueued
+                    if self._queued >= self.batch_size or waited >= self.flush_interval:
+                        return
+                    self._cond.wait(self.flush_interval - waited)
+                else:
+                    self._cond.wait()
+
+    def _sleep(self, seconds: float) -> None:
+        """Pausa de backoff interrumpible por stop()."""
+        with self._cond:
+            if not self._stopping:
+                self._cond.wait(seconds)
+
+    @staticmethod
+    def _with_keys(row: list, keys: List[str], base: Optional[list] = None) -> list:
+        """Fila con la columna de claves = claves previas ∪ nuevas."""
+        row = list(row) + [""] * (KEY_COLUMN - len(row))
+        previous = base[KEY_COLUMN - 1].split(KEY_SEPARATOR) if base and len(base) >= KEY_COLUMN else []
+        row[KEY_COLUMN - 1] = KEY_SEPARATOR.join(k for k in dict.fromkeys(previous + keys) if k)
+        return row
+
+    def _plan(self, batch: List[Tuple[list, list]]) -> Tuple[Dict[int, list], List[list]]:
+        """Reparte el lote en actualizaciones {fila: valores} y filas nuevas, fusionando duplicados."""
+        updates: Dict[int, list] = {}
+        appends: List[list]      = []
+        new_slots: Dict[str, int] = {}    # clave → posición en `appends`
+        for keys, row in batch:
+            if not keys or self.index is None:
+                appends.append(list(row))
+                continue
+            number = self.index.lookup(keys)
+            if number is not None:
+                base   = updates.get(number) or self.index.values(number)
+                merged = self._with_keys(merge_rows(base, row), keys, base)
+                if merged != base:          # sin cambios: ni siquiera una llamada
+                    updates[number] = merged
+                continue
+            slot = next((new_slots[k] for k in keys if k in new_slots), None)
+            if slot is None:
+                slot = len(appends)
+                appends.append(self._with_keys(row, keys))
+            else:
+                base = appends[slot]
+                appends[slot] = self._with_keys(merge_rows(base, row), keys, base)
+            for key in keys:
+                new_slots[key] = slot
+        return updates, appends
+
+    def _write(self, sheet, batch: List[Tuple[list, list]]) -> None:
+        if self.index is not None and not self.index.warmed:
+            self.index.warm(sheet)
+        updates, appends = self._plan(batch)
+        if updates:
+            sheet.batch_update([
+                {"range": f"A{n}:{chr(ord('A') + len(row) - 1)}{n}", "values": [row]}
+                for n, row in updates.items()
+            ])
+            for number, row in updates.items():
+                self.index.remember(row[KEY_COLUMN - 1].split(KEY_SEPARATOR), number, row)
+            self.rows_updated += len(updates)
+            SHEETS_ROWS.inc("update", amount=len(updates))
+        if appends:
+            start = appended_start_row(sheet.append_rows(appends))
+            if self.index is not None and start is not None:
+                for offset, row in enumerate(appends):
+                    if len(row) >= KEY_COLUMN and row[KEY_COLUMN - 1]:
+                        self.index.remember(row[KEY_COLUMN - 1].split(KEY_SEPARATOR), start + offset, row)
+            self.rows_written += len(appends)
+            SHEETS_ROWS.inc("append", amount=len(appends))
+        merged = len(batch) - len(updates) - len(appends)
+        if merged:
+            self.rows_merged += merged
+            SHEETS_ROWS.inc("merged", amount=merged)
+
+    def _send(self, batch: list) -> Optional[bool]:
+        """Envía un lote de la bandeja; `ack` si entra, `fail` si no (None: hoja no disponible)."""
+        ids   = [entry_id for entry_id, _, _ in batch]
+        sheet = self._get_sheet()
+        try:
+            if sheet is None:
+                raise RuntimeError("hoja no disponible")
+            started = time.perf_counter()
+            self._write(sheet, [(keys, row) for _, keys, row in batch])
+            observe_stage("sheets", time.perf_counter() - started)
+        except Exception as e:
+            if sheet is None:
+                # Hoja desconectada: no es culpa de las filas, no gasta intentos
+                self.outbox.last_error = str(e)
+                return None
+            dead = self.outbox.fail(ids, str(e))
+            if dead:
+                self.dead_letters += len(dead)
+                SHEETS_DEAD_LETTER.inc(amount=len(dead))
+                print(f"Sheets: {len(dead)} filas a la cola muerta tras agotar intentos: {e}")
+            if self._on_failure:
+                self._on_failure(e)
+            return False
+        self.outbox.ack(ids)
+        self.batches_sent += 1
+        return True
+
+    def _run(self) -> None:
+        failures = 0
+        isolate  = 0      # filas por enviar de una en una tras un lote fallido
+        while True:
+            self._wait_for_flush()
+            batch = self.outbox.peek(1 if isolate else self.batch_size)
+            with self._cond:
+                if not batch:
+                    self._queued = 0
+                    if self._stopping:
+                        return
+                    continue
+            sent = self._send(batch)
+            if sent:
+                failures = 0
+                isolate  = max(0, isolate - 1)
+                with self._cond:
+                    self._queued = max(0, self._queued - len(batch))
+                    if len(batch) == self.batch_size or isolate:
+                        # Puede haber más en la bandeja: seguir drenando sin esperar
+                        self._queued         = max(self._queued, 1)
+                        self._first_enqueued = 0.0
+                continue
+            if self._stopping:
+                print(f"Sheets: {self.outbox.depth()} filas quedan en la bandeja al apagar")
+                return
+            if sent is False and len(batch) > 1:
+                isolate = len(batch)
+            self.retries += 1
+            RETRIES.inc("sheets")
+            delay = min(self.backoff_max, self.backoff_base * (2 ** failures))
+            failures += 1
+            print(f"Error Sheets (reintento {failures} en {delay:.1f}s): {self.outbox.stats()['last_error']}")
+            self._sleep(delay)
@@ -0,0 +1,357 @@
+"""
+tactic_model.py — Evangelista & Co.
+Clasificador local de tácticas: primera pasada barata antes del Estratega (70B).
+
+El Estratega paga una llamada completa al LLM para elegir una de seis tácticas
+del Módulo III, casi siempre en función de unos pocos campos del expediente.
+Este módulo:
+
+  - Con TACTIC_LOG_PATH (opt-in) registra cada decisión del LLM como par
+    (rasgos, táctica) en SQLite (`TacticLog`): sólo el vector de `featurize`, sin
+    mensaje crudo ni datos de contacto, con retención de TACTIC_LOG_RETENTION_DAYS.
+    Sólo se registran decisiones del LLM: ni las reglas ni el propio
+    clasificador se re-alimentan.
+  - Entrena fuera de línea una regresión logística multinomial sobre rasgos
+    binarios del expediente y del mensaje (`python tactic_model.py train`), y
+    reporta precisión y cobertura por umbral en un holdout.
+  - En línea (`TacticModel.predict`) responde en microsegundos. Con
+    TACTIC_MODEL=on, si la confianza supera TACTIC_MODEL_THRESHOLD decide sin
+    llamar al Estratega; con `shadow` sólo mide el acuerdo con el LLM.
+  - `score` (0–100, probabilidad de ALLOW_MEETING) llena `silent_audit.score`,
+    que vetting-gate.js pasa a `unlockCalendly`.
+
+El Hard Lock de ALLOW_MEETING en main.plan_turn aplica igual a sus decisiones.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from contacts import strip_contacts
+from dossier import ENUM_FIELDS, LeadDossier
+from knowledge import tokenize
+from metrics import REGISTRY
+
+MODEL_DECISIONS = REGISTRY.counter(
+    "evangelista_tactic_model_total",
+    "Predicciones del clasificador local (answered, deferred, agree, disagree).", ("outcome",))
+
+# Tácticas válidas del Módulo III (PROMPT_STRATEGIST), en orden de cascada
+TACTICS = (
+    "REJECT_AND_REDIRECT",
+    "THE_AUTHORITY_ESCALATION",
+    "INVESTIGATE_DEEP",
+    "ANCHOR_FOUNDATION_FEE",
+    "VALUE_WITHDRAWAL",
+    "ALLOW_MEETING",
+)
+
+# Instrucciones para el Vocero cuando decide el clasificador (Módulo III, resumido)
+INSTRUCTIONS = {
+    "REJECT_AND_REDIRECT": (
+        "Rechazo firme, elegante y aséptico. Aclarar que somos arquitectos de "
+        "inteligencia de negocios, no fábrica de software. Cerrar la conversación."
+    ),
+    "THE_AUTHORITY_ESCALATION": (
+        "Reconocer la carga del usuario. Indicar que la solución requiere aprobación "
+        "financiera de la alta dirección. Solicitar que la Cita de Scoping se agende "
+        "con el Director General o CFO."
+    ),
+    "INVESTIGATE_DEEP": (
+        "No dar precios ni soluciones. Hacer una pregunta técnica e incómoda que "
+        "evidencie falta de control de datos. Pedir nombre de firma y nodo exacto de pérdida."
+    ),
+    "ANCHOR_FOUNDATION_FEE": (
+        "Explicar que el dolor es síntoma de entropía de datos. Mencionar la Auditoría "
+        "Forense Foundation bajo ALCOA+ con Inversión Piso de $35,000 MXN; el precio "
+        "exacto se define en la Cita de Scoping. Cerrar preguntando si cuentan con esa "
+        "solvencia base para habilitar la agenda de Dirección."
+    ),
+    "VALUE_WITHDRAWAL": (
+        "Retirar la oferta sin justificar el precio: si el caos en su nodo crítico les "
+        "cuesta menos de $35,000 MXN al mes, su operación aún no requiere el nivel "
+        "institucional que construimos. Cerrar con \"Quedamos a sus órdenes para el futuro.\""
+    ),
+    "ALLOW_MEETING": (
+        "Tono de Socio a Socio. Notificar que el caso pasó el Vetting Gate y que se "
+        "desbloqueó un espacio de 45 minutos (Cita 1: Scoping Técnico) con la Tríada "
+        "Directiva. Cerrar pidiendo que seleccione su horario en el calendario."
+    ),
+}
+
+MAX_MESSAGE_TERMS = 40
+
+
+def featurize(memory: LeadDossier, message: str) -> List[str]:
+    """
+    Rasgos binarios activos: el expediente como lo lee el Módulo III y los términos
+    del mensaje. Correos y teléfonos se quitan antes de tokenizar (del contacto
+    sólo cuenta si existe).
+    """
+    features = ["bias"]
+    for name in ENUM_FIELDS:
+        features.append(f"{name}={getattr(memory, name).value}")
+    for name in ("empresa", "dolor_declarado", "contacto"):
+        features.append(f"{name}={'si' if getattr(memory, name) else 'no'}")
+    features.append(f"red_flags={memory.red_flags}")
+    features.append(f"presupuesto_validado={memory.presupuesto_validado}")
+    terms = list(dict.fromkeys(tokenize(strip_contacts(message[:1000]))))[:MAX_MESSAGE_TERMS]
+    features.extend(f"w={term}" for term in terms)
+    return features
+
+
+# ==============================================================================
+# MODELO
+# ==============================================================================
+
+@dataclass
+class Prediction:
+    tactic:        str
+    confidence:    float
+    probabilities: Dict[str, float]
+
+    def strategy(self) -> dict:
+        """Misma forma que la salida del Estratega."""
+        return {
+            "tactic":                 self.tactic,
+            "instructions_for_voice": INSTRUCTIONS[self.tactic],
+            "tactic_model":           round(self.confidence, 3),
+        }
+
+
+class TacticModel:
+    """Regresión logística multinomial: un vector de pesos por táctica, rasgos dispersos."""
+
+    def __init__(self, weights: Dict[str, List[float]], classes: Tuple[str, ...] = TACTICS,
+                 threshold: float = 0.9, meta: Optional[dict] = None):
+        self.weights   = weights
+        self.classes   = tuple(classes)
+        self.threshold = threshold
+        self.meta      = meta or {}
+        self._zero     = [0.0] * len(self.classes)
+
+    def probabilities(self, features: List[str]) -> List[float]:
+        logits = [0.0] * len(self.classes)
+        for feature in features:
+            row = self.weights.get(feature)
+            if row:
+                for i, weight in enumerate(row):
+                    logits[i] += weight
+        top  = max(logits)
+        exps = [math.exp(logit - top) for logit in logits]
+        total = sum(exps)
+        return [e / total for e in exps]
+
+    def predict(self, memory: LeadDossier, message: str) -> Prediction:
+        probs = self.probabilities(featurize(memory, message))
+        best  = max(range(len(probs)), key=probs.__getitem__)
+        return Prediction(self.classes[best], probs[best], dict(zip(self.classes, probs)))
+
+    def confident(self, prediction: Prediction) -> bool:
+        return prediction.confidence >= self.threshold
+
+    def score(self, memory: LeadDossier, message: str) -> int:
+        """Calificación del lead (0–100): probabilidad de ALLOW_MEETING."""
+        return round(100 * self.predict(memory, message).probabilities.get("ALLOW_MEETING", 0.0))
+
+    # --------------------------------------------------------------------------
+    # Entrenamiento
+    # --------------------------------------------------------------------------
+
+    @classmethod
+    def train(cls, examples: List[Tuple[List[str], str]], epochs: int = 30,
+              learning_rate: float = 0.5, l2: float = 1e-4, seed: int = 0,
+              classes: Tuple[str, ...] = TACTICS) -> "TacticModel":
+        """SGD sobre la log-verosimilitud con regularización L2 perezosa."""
+        rng   = random.Random(seed)
+        index = {tactic: i for i, tactic in enumerate(classes)}
+        model = cls({}, classes)
+        data  = [(features, index[tactic]) for features, tactic in examples if tactic in index]
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            rate = learning_rate / (1 + epoch)
+            for features, target in data:
+                probs = model.probabilities(features)
+                for feature in features:
+                    row = model.weights.setdefault(feature, [0.0] * len(classes))
+                    for i in range(len(classes)):
+                        gradient = probs[i] - (1.0 if i == target else 0.0)
+                        row[i] -= rate * (gradient + l2 * row[i])
+        return model
+
+    # --------------------------------------------------------------------------
+    # Persistencia (JSON legible; pesos redondeados)
+    # --------------------------------------------------------------------------
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump({
+                "classes": list(self.classes),
+                "meta":    self.meta,
+                "weights": {
+                    feature: [round(w, 5) for w in row]
+                    for feature, row in self.weights.items() if any(abs(w) > 1e-5 for w in row)
+                },
+            }, fh, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str, threshold: float = 0.9) -> "TacticModel":
+        with open(path, encoding="utf-8") as fh:
+            data = json.load(fh)
+        return cls(data["weights"], tuple(data["classes"]), threshold, data.get("meta"))
+
+
+# ==============================================================================
+# REGISTRO DE DECISIONES DEL LLM (datos de entrenamiento)
+# ==============================================================================
+
+class TacticLog:
+    """
+    Pares (rasgos, táctica) decididos por el LLM, en SQLite (WAL). `record` es
+    síncrono: main.py lo llama con `asyncio.to_thread`.
+    """
+
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str, retention_days: float = 90.0):
+        self.path      = path
+        self.retention = retention_days * 86400
+        self._lock     = threading.Lock()
+        self._writes   = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tactic_features ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL,"
+            " features TEXT NOT NULL, tactic TEXT NOT NULL, source TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tactic_features_created ON tactic_features (created_at)")
+        self.purge()
+
+    def record(self, features: List[str], tactic: str, source: str) -> None:
+        if tactic not in TACTICS:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO tactic_features (created_at, features, tactic, source) VALUES (?, ?, ?, ?)",
+                (time.time(), json.dumps(features, ensure_ascii=False), tactic, source),
+            )
+            self._conn.commit()
+            self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge()
+
+    def purge(self) -> int:
+        """Borra los ejemplos más viejos que la retención (0 = sin límite)."""
+        if not self.retention:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM tactic_features WHERE created_at < ?", (time.time() - self.retention,)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def examples(self) -> List[Tuple[List[str], str]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT features, tactic FROM tactic_features ORDER BY id"
+            ).fetchall()
+        return [(json.loads(features), tactic) for features, tactic in rows]
+
+
+def build_tactic_model() -> Tuple[Optional[TacticModel], str]:
+    """
+    TACTIC_MODEL=off | shadow (por defecto) | on. Sin archivo de pesos en
+    TACTIC_MODEL_PATH no hay modelo (el registro de decisiones es aparte).
+    """
+    mode = os.getenv("TACTIC_MODEL", "shadow").lower()
+    path = os.getenv("TACTIC_MODEL_PATH", "tactic_model.json")
+    if mode == "off" or not os.path.exists(path):
+        return None, mode
+    try:
+        model = TacticModel.load(path, float(os.getenv("TACTIC_MODEL_THRESHOLD", "0.9")))
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error cargando clasificador de tácticas: {e}")
+        return None, mode
+    print(f"--- CLASIFICADOR DE TÁCTICAS: {path} ({mode}, umbral {model.threshold}) ---")
+    return model, mode
+
+
+def build_tactic_log() -> Optional[TacticLog]:
+    """TACTIC_LOG_PATH (sin valor, por defecto = no registrar); TACTIC_LOG_RETENTION_DAYS=90."""
+    path = os.getenv("TACTIC_LOG_PATH", "")
+    if not path:
+        return None
+    return TacticLog(path, float(os.getenv("TACTIC_LOG_RETENTION_DAYS", "90")))
+
+
+# ==============================================================================
+# CLI: entrenamiento y evaluación
+#   python tactic_model.py train --log tactic_examples.db --out tactic_model.json
+# ==============================================================================
+
+def evaluate(model: TacticModel, examples: List[Tuple[List[str], str]],
+             thresholds=(0.5, 0.7, 0.8, 0.9, 0.95)) -> dict:
+    """Exactitud global y, por umbral, cobertura y exactitud de lo que respondería."""
+    scored = []
+    for features, tactic in examples:
+        probs = model.probabilities(features)
+        best  = max(range(len(probs)), key=probs.__getitem__)
+        scored.append((probs[best], model.classes[best] == tactic))
+    report = {
+        "examples": len(scored),
+        "accuracy": round(sum(ok for _, ok in scored) / len(scored), 4) if scored else None,
+        "thresholds": {},
+    }
+    for threshold in thresholds:
+        answered = [ok for confidence, ok in scored if confidence >= threshold]
+        report["thresholds"][str(threshold)] = {
+            "coverage": round(len(answered) / len(scored), 4) if scored else 0.0,
+            "accuracy": round(sum(answered) / len(answered), 4) if answered else None,
+        }
+    return report
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Entrena el clasificador local de tácticas.")
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--log", default=os.getenv("TACTIC_LOG_PATH") or "tactic_examples.db")
+    parser.add_argument("--out", default=os.getenv("TACTIC_MODEL_PATH", "tactic_model.json"))
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--min-examples", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    examples = TacticLog(args.log, retention_days=0).examples()
+    if len(examples) < args.min_examples:
+        print(f"Sólo hay {len(examples)} ejemplos (mínimo {args.min_examples}); no se entrena.")
+        return 1
+    random.Random(args.seed).shuffle(examples)
+    cut = int(len(examples) * (1 - args.holdout))
+    train, holdout = examples[:cut], examples[cut:]
+
+    started = time.perf_counter()
+    model   = TacticModel.train(train, epochs=args.epochs, seed=args.seed)
+    report  = evaluate(model, holdout)
+    report["train_examples"] = len(train)
+    report["train_seconds"]  = round(time.perf_counter() - started, 2)
+    model.meta = {"trained_at": time.strftime("%Y-%m-%d %H:%M"), **report}
+    model.save(args.out)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"Modelo escrito en {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,82 @@
+"""
+templates.py — Evangelista & Co.
+Motor mínimo de plantillas para los prompts de los agentes.
+
+Cada prompt se analiza UNA vez al importar: se divide en segmentos estáticos y
+slots `{nombre}`. Renderizar es una sola concatenación (`"".join`), sin cadenas de
+`.replace` que recorren y copian el prompt completo por cada placeholder, y sin
+re-escanear los valores insertados (un `{history}` dentro del mensaje del usuario
+ya no se sustituye por accidente).
+
+El texto anterior al primer slot es el prefijo estático: idéntico en todas las
+peticiones, y por tanto reutilizable por el caché de prompts del proveedor.
+"""
+
+import re
+from typing import Iterable
+
+SLOT_RE = re.compile(r"\{([a-z_][a-z0-9_]*)\}")
+
+
+class PromptTemplate:
+    """Plantilla precompilada con slots declarados explícitamente."""
+
+    def __init__(self, name: str, text: str, slots: Iterable[str]):
+        self.name  = name
+        self.text  = text
+        self.slots = frozenset(slots)
+
+        parts = []
+        positions = []
+        cursor = 0
+        for match in SLOT_RE.finditer(text):
+            parts.append(text[cursor:match.start()])
+            positions.append((len(parts), match.group(1)))
+            parts.append("")
+            cursor = match.end()
+        parts.append(text[cursor:])
+
+        found   = {slot for _, slot in positions}
+        unknown = found - self.slots
+        missing = self.slots - found
+        if unknown:
+            raise ValueError(f"Plantilla {name}: placeholders no declarados {sorted(unknown)}")
+        if missing:
+            raise ValueError(f"Plantilla {name}: placeholders declarados ausentes {sorted(missing)}")
+
+        self._parts     = parts
+        self._positions = positions
+
+    def _check(self, values: dict) -> None:
+        if values.keys() != self.slots:
+            missing = self.slots - values.keys()
+            unknown = values.keys() - self.slots
+            raise KeyError(
+                f"Plantilla {self.name}: faltan {sorted(missing)}, sobran {sorted(unknown)}"
+            )
+
+    def render(self, **values: str) -> str:
+        """Prompt completo: prefijo estático + sufijo dinámico."""
+        self._check(values)
+        parts = self._parts.copy()
+        for index, slot in self._positions:
+            parts[index] = values[slot]
+        return "".join(parts)
+
+    @property
+    def static_segments(self) -> list:
+        slot_indexes = {index for index, _ in self._positions}
+        return [part for i, part in enumerate(self._parts) if i not in slot_indexes]
+
+    def without_section(self, heading: str) -> "PromptTemplate":
+        """
+        Variante sin la sección Markdown de nivel 1 que empieza con `heading`
+        (hasta el siguiente encabezado `# `). Se usa para recortar few-shots; los
+        slots que vivían dentro de la sección dejan de existir en la variante.
+        """
+        match = re.search(rf"^{re.escape(heading)}.*?(?=^# |\Z)", self.text, re.M | re.S)
+        if not match:
+            raise ValueError(f"Plantilla {self.name}: sección {heading!r} no encontrada")
+        text    = self.text[:match.start()] + self.text[match.end():]
+        removed = {m.group(1) for m in SLOT_RE.finditer(match.group(0))}
+        return PromptTemplate(f"{self.name}-{heading}", text, self.slots - removed)